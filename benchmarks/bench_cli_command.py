@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the command construction: commands built per second with CliCommand and CommandTemplate.
+
+Usage:
+    python benchmarks/bench_cli_command.py [--repeat N] [--regions N [N ...]]
+
+The benchmark only builds command lists, no process is launched. Run it on two commits to compare them;
+the template cases are skipped when CommandTemplate is not available.
+"""
+
+import argparse
+import logging
+import timeit
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from biocommander.wrappers.cli_cmd import CliCommand
+
+try:
+    from biocommander.wrappers.cli_cmd import CommandTemplate
+except ImportError:
+    CommandTemplate = None
+
+#Keep the logging handlers out of the measurements
+logging.disable(logging.CRITICAL)
+
+KWARGS = {'b': True, 'o': 'sample.bam', 'threads': 4, 'reference': 'ref.fa'}
+
+
+def build_sort():
+    return CliCommand('samtools', ['sort'], kwargs=dict(KWARGS), args='sample.sam').cmd_list
+
+
+def build_view(regions):
+    return CliCommand('samtools', ['view'], kwargs=dict(KWARGS), args=('sample.bam', *regions)).cmd_list
+
+
+def extend_view(regions):
+    cmd = CliCommand('samtools', ['view'], kwargs=dict(KWARGS), args='sample.bam')
+    cmd.add_multiple_args(regions)
+    return cmd.cmd_list
+
+
+def add_view(regions):
+    cmd = CliCommand('samtools', ['view'], kwargs=dict(KWARGS), args='sample.bam')
+    for idx, region in enumerate(regions):
+        cmd.add_arg(region, idx + 2)
+    return cmd.cmd_list
+
+
+def measure(label, function, number, repeat):
+    best = min(timeit.repeat(function, number=number, repeat=repeat)) / number
+    print(f'{label:<40} {1 / best:>14,.1f} commands/s {best * 1e6:>14,.1f} us/command')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--regions', type=int, nargs='+', default=[10, 1000, 5000])
+    options = parser.parse_args()
+
+    measure('CliCommand sort', build_sort, 2000, options.repeat)
+
+    if CommandTemplate:
+        sort = CommandTemplate(CliCommand('samtools', ['sort'], kwargs=dict(KWARGS, o='{output}'), args='{input}'))
+        measure('CommandTemplate sort', lambda: sort.fill(input='sample.sam', output='sample.bam'), 20000, options.repeat)
+
+    for n_regions in options.regions:
+        regions = [f'chr1:{start}-{start + 999}' for start in range(1, n_regions * 1000, 1000)]
+        number = max(1, 20000 // n_regions)
+
+        measure(f'CliCommand view, {n_regions} regions', lambda: build_view(regions), number, options.repeat)
+        measure(f'add_multiple_args, {n_regions} regions', lambda: extend_view(regions), max(1, number // 10), options.repeat)
+        measure(f'add_arg loop, {n_regions} regions', lambda: add_view(regions), max(1, number // 10), options.repeat)
+
+        if CommandTemplate:
+            view = CommandTemplate(CliCommand('samtools', ['view'], kwargs=dict(KWARGS), args=('{input}', '{regions*}')))
+            measure(f'CommandTemplate view, {n_regions} regions',
+                    lambda: view.fill(input='sample.bam', regions=regions), number, options.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Cold-start benchmark: time to import biocommander and to build each wrapper in a new interpreter.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--python PATH]
+
+Every case runs in a fresh process, so nothing is cached in sys.modules, and is timed inside that process,
+so the start-up of the interpreter itself is not included. The heavy modules (pandas, NumPy, asyncio) loaded
+by each case are reported, as they dominate the start-up time of short-lived jobs. Run it on two commits to
+compare them.
+"""
+
+import subprocess
+import argparse
+import statistics
+import json
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEAVY_MODULES = ['pandas', 'numpy', 'asyncio']
+
+#(label, statements). Wrappers are built with probe_version=False: the probe runs the tool, not Python code
+CASES = [
+    ('import biocommander', 'import biocommander'),
+    ('import wrappers.wrappers', 'import biocommander.wrappers.wrappers'),
+    ('import wrappers.variants', 'import biocommander.wrappers.variants'),
+    ('import wrappers.mappers', 'import biocommander.wrappers.mappers'),
+    ('import wrappers.bedtools', 'import biocommander.wrappers.bedtools'),
+    ('Samtools()', 'from biocommander.wrappers.variants import Samtools; Samtools(probe_version=False)'),
+    ('Bcftools()', 'from biocommander.wrappers.variants import Bcftools; Bcftools(probe_version=False)'),
+    ('BwaMapper()', 'from biocommander.wrappers.mappers import BwaMapper; BwaMapper(probe_version=False)'),
+    ('Minimap2Mapper()', 'from biocommander.wrappers.mappers import Minimap2Mapper; Minimap2Mapper(probe_version=False)'),
+    ('BedTools()', 'from biocommander.wrappers.bedtools import BedTools; BedTools(probe_version=False)'),
+    ('BedTools().get_coverage()', 'from biocommander.wrappers.bedtools import BedTools; BedTools(probe_version=False, verbosity=50).get_coverage()'),
+]
+
+PROBE = '''
+import time, sys, json
+started = time.perf_counter()
+{statements}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'elapsed': elapsed, 'modules': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+
+def run_case(python, statements):
+    #Time of the statements, measured inside a new interpreter
+
+    code = PROBE.format(statements=statements, heavy=HEAVY_MODULES)
+
+    result = subprocess.run([python, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--python', default=sys.executable)
+    options = parser.parse_args()
+
+    print(f'{"case":<32} {"median ms":>10} {"min ms":>10}   heavy modules loaded')
+
+    for label, statements in CASES:
+        runs = [run_case(options.python, statements) for _ in range(options.repeat)]
+        times = [run['elapsed'] * 1e3 for run in runs]
+        modules = ', '.join(runs[-1]['modules']) or '-'
+
+        print(f'{label:<32} {statistics.median(times):>10.1f} {min(times):>10.1f}   {modules}')
+
+
+if __name__ == '__main__':
+    main()
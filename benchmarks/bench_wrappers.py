@@ -0,0 +1,250 @@
+"""
+Benchmark suite of the Python-side overhead of the wrappers, driven by the stand-in tools of fake_tools/.
+
+Usage:
+    python benchmarks/bench_wrappers.py [--lines N] [--repeat N] [--cases NAME [NAME ...]] [--json PATH]
+
+The stand-ins emit synthetic bwa, samtools, bcftools and bedtools outputs of N lines (e.g. --lines 1e8 for a
+genome-scale genomecov -d), so command building, process launch, capture and parsing are measured without the
+cost of the real tools. The 'tool:' cases run the stand-ins alone, with the output sent to /dev/null: the
+difference with the wrapper cases is the overhead of biocommander.
+
+Every case runs in a new interpreter, so the peak RSS reported is the one of that case alone. The results
+(median time, throughput, latency and peak memory) are printed as a table and, with --json, written with the
+commit and the scale, so runs on two commits can be compared.
+"""
+
+import subprocess
+import argparse
+import statistics
+import resource
+import tempfile
+import logging
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FAKE_TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_tools')
+
+LAUNCHES = 50
+
+CASES = {}
+
+
+def case(name, unit):
+    #Registers a benchmark case: a function of (lines, workdir) that returns the number of processed units
+
+    def register(function):
+        CASES[name] = (function, unit)
+        return function
+
+    return register
+
+
+def quiet(wrapper):
+    return wrapper(verbosity=logging.CRITICAL, probe_version=False)
+
+
+@case('tool:genomecov -d', 'lines')
+def tool_genomecov(lines, workdir):
+    subprocess.run(['bedtools', 'genomecov', '-ibam', 'sample.bam', '-d'], stdout=subprocess.DEVNULL, check=True)
+    return lines
+
+
+@case('genomecov -d', 'lines')
+def genomecov_d(lines, workdir):
+    from biocommander.wrappers.bedtools import BedTools
+
+    bedtools = quiet(BedTools)
+    bedtools.genomecov(ibam='sample.bam', d=True)
+    return len(bedtools.genome_cov)
+
+
+@case('genomecov -d + coverage arrays', 'lines')
+def genomecov_arrays(lines, workdir):
+    from biocommander.wrappers.bedtools import BedTools
+
+    bedtools = quiet(BedTools)
+    bedtools.genomecov(ibam='sample.bam', d=True)
+    return bedtools.get_coverage().size
+
+
+@case('genomecov -bga', 'lines')
+def genomecov_bga(lines, workdir):
+    from biocommander.wrappers.bedtools import BedTools
+
+    bedtools = quiet(BedTools)
+    bedtools.genomecov(ibam='sample.bam', bga=True)
+    return len(bedtools.genome_cov)
+
+
+@case('tool:samtools view', 'lines')
+def tool_view(lines, workdir):
+    subprocess.run(['samtools', 'view', 'sample.bam'], stdout=subprocess.DEVNULL, check=True)
+    return lines
+
+
+@case('samtools view, capture_output=True', 'lines')
+def capture_view(lines, workdir):
+    from biocommander.wrappers.variants import Samtools
+
+    samtools = quiet(Samtools)
+    output = samtools.execute_command(samtools.view_command('sample.bam').cmd_list, capture_output=True)
+    return output[samtools.STDOUT].count('\n')
+
+
+@case('samtools view, capture buffer', 'lines')
+def capture_buffer_view(lines, workdir):
+    from biocommander.wrappers.variants import Samtools
+
+    samtools = quiet(Samtools)
+    result = samtools.execute_command(samtools.view_command('sample.bam').cmd_list, capture_output=samtools.CAPTURE_BUFFER)
+    with result.stdout as stdout, stdout.open() as handle:
+        return sum(block.count(b'\n') for block in iter(lambda: handle.read(1 << 20), b''))
+
+
+@case('samtools view, stream lines', 'lines')
+def stream_view(lines, workdir):
+    from biocommander.wrappers.variants import Samtools
+
+    samtools = quiet(Samtools)
+    with samtools.view_stream('sample.bam') as stream:
+        return sum(1 for _ in stream)
+
+
+@case('bwa mem | samtools sort pipeline', 'lines')
+def pipeline(lines, workdir):
+    from biocommander.wrappers.mappers import BwaMapper
+    from biocommander.wrappers.variants import Samtools
+
+    bwa = quiet(BwaMapper)
+    bwa.add_reference('ref.fa')
+    samtools = quiet(Samtools)
+
+    stages = bwa.mem_command(['r1.fq', 'r2.fq']) | samtools.sort_command('-', o=os.path.join(workdir, 'sample.bam'))
+    stages.run()
+    return lines if stages.success else 0
+
+
+@case('bcftools call to file', 'lines')
+def bcftools_call(lines, workdir):
+    from biocommander.wrappers.variants import Bcftools
+
+    bcftools = quiet(Bcftools)
+    bcftools.call('sample.bcf', os.path.join(workdir, 'calls.vcf'))
+    return lines
+
+
+@case('samtools index, launch latency', 'commands')
+def launch_latency(lines, workdir):
+    from biocommander.wrappers.variants import Samtools
+
+    samtools = quiet(Samtools)
+    bam = os.path.join(workdir, 'sample.bam')
+    for _ in range(LAUNCHES):
+        samtools.index(bam)
+    return LAUNCHES
+
+
+def run_child(name, lines):
+    #Runs one case in this process and prints its measurements as JSON
+
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.CRITICAL)
+
+    function, _ = CASES[name]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        items = function(lines, workdir)
+        elapsed = time.perf_counter() - started
+
+    #ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+
+    print(json.dumps({
+        'seconds': elapsed,
+        'items': items,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        'children_peak_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    }))
+
+
+def run_case(name, lines):
+
+    env = dict(os.environ)
+    env['PATH'] = f'{FAKE_TOOLS}{os.pathsep}{env.get("PATH", "")}'
+    env['BIOCOMMANDER_FAKE_LINES'] = str(lines)
+
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', name, '--lines', str(lines)],
+        env=env, cwd=ROOT, capture_output=True, text=True
+    )
+
+    if result.returncode:
+        raise RuntimeError(f'Case {name} failed:\n{result.stderr}')
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=float, default=1e6)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    lines = int(options.lines)
+
+    if options.child:
+        run_child(options.child, lines)
+        return
+
+    print(f'{"case":<40} {"median s":>9} {"throughput":>16} {"latency":>12} {"peak RSS":>10} {"tool RSS":>10}')
+
+    results = []
+    for name in options.cases:
+        unit = CASES[name][1]
+        runs = [run_case(name, lines) for _ in range(options.repeat)]
+
+        seconds = statistics.median(run['seconds'] for run in runs)
+        items = runs[-1]['items']
+        peak_rss = max(run['peak_rss'] for run in runs)
+        children_peak_rss = max(run['children_peak_rss'] for run in runs)
+
+        throughput = items / seconds if seconds else 0
+        latency = seconds / items if items else 0
+
+        print(f'{name:<40} {seconds:>9.3f} {throughput:>10,.0f} {unit + "/s":<5} {latency * 1e3:>9.4f} ms '
+              f'{peak_rss / 2**20:>7.1f} MB {children_peak_rss / 2**20:>7.1f} MB')
+
+        results.append({
+            'case': name,
+            'unit': unit,
+            'items': items,
+            'seconds': seconds,
+            'throughput': throughput,
+            'latency': latency,
+            'peak_rss': peak_rss,
+            'children_peak_rss': children_peak_rss,
+        })
+
+    if options.json:
+        with open(options.json, 'w') as output:
+            json.dump({'commit': git_commit(), 'lines': lines, 'python': sys.version.split()[0], 'results': results}, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Round-trip check of IndexedFasta: index, headers and masking of FASTA files with unusual layouts.
+
+Usage:
+    python benchmarks/check_fasta.py
+
+FASTA files with '>' inside the descriptions, CRLF terminators, lines of several widths, empty sequences and
+no final newline are indexed in memory and masked with no intervals (the output must be identical to the input)
+and with intervals (only the bases of the intervals may change). The exit status is 0 if every check passes.
+"""
+
+import tempfile
+import logging
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from biocommander.wrappers.fasta import IndexedFasta
+
+CASES = {
+    'headers with >': b'>chr1 desc with a>b\nACGTACGT\nACGT\n>chr2 x>y>z\nGGGG\n>chr3\nTT\n',
+    'first header with >': b'>a>b\nACGT\n',
+    'crlf': b'>c1 one>two\r\nACGTA\r\nCG\r\n>c2\r\nAAAA\r\n',
+    'empty sequence': b'>e1 empty>\n>e2\nACGTAC\nAC\n',
+    'no final newline': b'>n1\nACGTACGT\nACG',
+}
+
+#(contig, expected length, line bases, line width) of some cases
+EXPECTED = {
+    'headers with >': [('chr1', 12, 8, 9), ('chr2', 4, 4, 5), ('chr3', 2, 2, 3)],
+    'crlf': [('c1', 7, 5, 7), ('c2', 4, 4, 6)],
+    'empty sequence': [('e1', 0, 0, 0), ('e2', 8, 6, 7)],
+    'no final newline': [('n1', 11, 8, 9)],
+}
+
+
+def main():
+
+    errors = []
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, content in CASES.items():
+            path = os.path.join(workdir, 'ref.fa')
+            with open(path, 'wb') as handle:
+                handle.write(content)
+
+            fasta = IndexedFasta(path, verbosity=logging.CRITICAL)
+
+            for contig, length, line_bases, line_width in EXPECTED.get(name, []):
+                if fasta.index.get(contig, (None,))[0:1] != (length,) or fasta.index[contig][2:] != (line_bases, line_width):
+                    errors.append(f'{name}: index of {contig} is {fasta.index.get(contig)}')
+
+            unmasked = os.path.join(workdir, 'unmasked.fa')
+            fasta.mask({}, unmasked)
+            with open(unmasked, 'rb') as handle:
+                if handle.read() != content:
+                    errors.append(f'{name}: masking no interval changed the file')
+
+            masked = os.path.join(workdir, 'masked.fa')
+            fasta.mask({contig: ([0], [fasta.contig_sizes[contig]]) for contig in fasta.index}, masked)
+            with open(masked, 'rb') as handle:
+                output = handle.read()
+
+            expected = b''.join(
+                line if line.startswith(b'>') else bytes(b if b in b'\r\n' else ord('N') for b in line)
+                for line in content.splitlines(keepends=True)
+            )
+            if output != expected:
+                errors.append(f'{name}: masked output {output!r}')
+
+            fasta.close()
+
+    for error in errors:
+        print(f'FAIL: {error}')
+
+    print('OK' if not errors else f'{len(errors)} checks failed')
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
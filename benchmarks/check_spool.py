@@ -0,0 +1,139 @@
+"""
+End-to-end check of the job spool with several local worker daemons racing for the same queue.
+
+Usage:
+    python benchmarks/check_spool.py [--workers N] [--slots N] [--jobs N]
+
+N worker processes (python -m biocommander.wrappers.spool worker, with an idle timeout) serve a queue in a
+temporary directory. The check submits jobs that succeed, fail, cannot be started or do not write their
+declared output, plus a job left in running/ by a 'dead' worker, and verifies that:
+
+    - every job has exactly one result, and every successful command ran exactly once;
+    - failed, not-started and missing-output jobs report exit status 3, 127 and the missing file;
+    - the orphaned job is requeued by the live workers and run once;
+    - the queue is empty afterwards and the workers exit on their own.
+
+The exit status is 0 if every check passes.
+"""
+
+import subprocess
+import argparse
+import tempfile
+import logging
+import time
+import sys
+import os
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from biocommander.wrappers.spool import SpoolQueue
+
+IDLE_TIMEOUT = 3
+STALE_TIMEOUT = 30
+FAILED_STATUS = 3
+
+
+def start_workers(directory, workers, slots):
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+
+    return [
+        subprocess.Popen([sys.executable, '-m', 'biocommander.wrappers.spool', 'worker', directory,
+                          '--name', f'worker{idx}', '--slots', str(slots), '--poll', '0.05',
+                          '--idle-timeout', str(IDLE_TIMEOUT), '--stale-timeout', str(STALE_TIMEOUT),
+                          '--verbosity', str(logging.CRITICAL)], env=env)
+        for idx in range(workers)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--slots', type=int, default=2)
+    parser.add_argument('--jobs', type=int, default=50)
+    options = parser.parse_args()
+
+    errors = []
+
+    def check(condition, message):
+        if not condition:
+            errors.append(message)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        queue = SpoolQueue(os.path.join(workdir, 'spool'), verbosity=logging.CRITICAL)
+        log = os.path.join(workdir, 'runs.log')
+
+        #Every successful job appends its tag to the log, so duplicated runs are visible
+        ok = {}
+        for idx in range(options.jobs):
+            output = os.path.join(workdir, f'job{idx}.out')
+            cmd = ['sh', '-c', f'echo job{idx} >> {log} && touch {output}']
+            ok[queue.submit(cmd, outputs=[output], cwd=workdir)] = f'job{idx}'
+
+        failed = queue.submit(['sh', '-c', f'exit {FAILED_STATUS}'], cwd=workdir)
+        not_started = queue.submit(['/nonexistent/biocommander-tool'], cwd=workdir)
+        missing_output = os.path.join(workdir, 'never_written.out')
+        missing = queue.submit(['true'], outputs=[missing_output], cwd=workdir)
+
+        #A job claimed by a worker that died: in running/ without heartbeat
+        orphan = queue.submit(['sh', '-c', f'echo orphan >> {log}'], cwd=workdir)
+        os.rename(queue._path(queue.PENDING, orphan), queue._path(queue.RUNNING, orphan))
+        stale = time.time() - 10 * STALE_TIMEOUT
+        os.utime(queue._path(queue.RUNNING, orphan), (stale, stale))
+
+        started = time.perf_counter()
+        workers = start_workers(queue.directory, options.workers, options.slots)
+
+        job_ids = [*ok, failed, not_started, missing, orphan]
+        try:
+            results = queue.wait(job_ids, timeout=60)
+        except TimeoutError as error:
+            results = {}
+            errors.append(str(error))
+
+        elapsed = time.perf_counter() - started
+
+        for worker in workers:
+            try:
+                check(worker.wait(timeout=IDLE_TIMEOUT + 30) == 0, f'Worker {worker.pid} exited with an error')
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                errors.append(f'Worker {worker.pid} did not exit after the idle timeout')
+
+        with open(log) as handle:
+            runs = handle.read().split()
+
+        check(len(results) == len(job_ids), f'{len(results)} results for {len(job_ids)} jobs')
+
+        for job_id, tag in ok.items():
+            check(runs.count(tag) == 1, f'{tag} ran {runs.count(tag)} times')
+            if job_id in results:
+                check(results[job_id][queue.KEY_RETURNCODE] == 0, f'{tag} exited with {results[job_id][queue.KEY_RETURNCODE]}')
+
+        check(runs.count('orphan') == 1, f'The orphaned job ran {runs.count("orphan")} times')
+
+        if failed in results:
+            check(results[failed][queue.KEY_RETURNCODE] == FAILED_STATUS, 'The failed job did not report its exit status')
+        if not_started in results:
+            check(results[not_started][queue.KEY_RETURNCODE] == queue.NOT_STARTED and results[not_started][queue.KEY_ERROR],
+                  'The job that could not start did not report status 127 and the error')
+        if missing in results:
+            check(results[missing][queue.KEY_MISSING] == [missing_output], 'The missing output was not reported')
+
+        status = queue.status()
+        check(status[queue.PENDING] == 0 and status[queue.RUNNING] == 0, f'Jobs left in the queue: {status}')
+
+        served = sorted({result[queue.KEY_WORKER] for result in results.values()})
+        print(f'{len(results)} jobs, {options.workers} workers x {options.slots} slots, {elapsed:.2f} s, served by {", ".join(served)}')
+
+    for error in errors:
+        print(f'FAIL: {error}')
+
+    print('OK' if not errors else f'{len(errors)} checks failed')
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
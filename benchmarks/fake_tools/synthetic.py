@@ -0,0 +1,120 @@
+"""
+Synthetic outputs shared by the stand-in executables of the benchmark suite.
+
+The scale is taken from the BIOCOMMANDER_FAKE_LINES environment variable (lines of the main output, 10^6 by
+default). The content follows the real formats, so the parsers of biocommander do the same work as with the
+real tools, and is generated in blocks so the stand-ins are not the bottleneck at small scales.
+"""
+
+import sys
+import os
+
+LINES = int(float(os.environ.get('BIOCOMMANDER_FAKE_LINES', 1e6)))
+CHROMS = int(os.environ.get('BIOCOMMANDER_FAKE_CHROMS', 4))
+
+BLOCK = 100000
+READ_LENGTH = 100
+
+SEQ = ('ACGTTGCA' * (READ_LENGTH // 8 + 1))[:READ_LENGTH]
+QUAL = 'I' * READ_LENGTH
+
+VERSIONS = {
+    'bwa': '0.7.17-r1188',
+    'samtools': '1.19',
+    'bcftools': '1.19',
+    'bedtools': 'v2.31.0',
+}
+
+
+def chrom_sizes(lines=LINES, chroms=CHROMS):
+    #Chromosomes of equal size covering the requested number of per-base lines
+
+    size = max(1, lines // chroms)
+    return [(f'chr{idx + 1}', size) for idx in range(chroms)]
+
+
+def option(argv, flag, default=None):
+    return argv[argv.index(flag) + 1] if flag in argv else default
+
+
+def open_output(argv, flag='-o'):
+    path = option(argv, flag)
+    return open(path, 'w') if path else sys.stdout
+
+
+def depth(position):
+    #Smooth, realistic looking depth, with low coverage valleys
+    return (position // 1000) % 60
+
+
+def genomecov_d(out, lines=LINES):
+
+    for chrom, size in chrom_sizes(lines):
+        for block_start in range(1, size + 1, BLOCK):
+            block_end = min(block_start + BLOCK, size + 1)
+            out.write(''.join([f'{chrom}\t{position}\t{depth(position)}\n' for position in range(block_start, block_end)]))
+
+
+def genomecov_bg(out, lines=LINES, run_length=50):
+
+    for chrom, size in chrom_sizes(lines * run_length):
+        for block_start in range(0, size, BLOCK * run_length):
+            block_end = min(block_start + BLOCK * run_length, size)
+            out.write(''.join([f'{chrom}\t{start}\t{min(start + run_length, size)}\t{depth(start)}\n'
+                               for start in range(block_start, block_end, run_length)]))
+
+
+def genomecov_hist(out):
+
+    total = sum(size for _, size in chrom_sizes())
+    for chrom, size in chrom_sizes() + [('genome', total)]:
+        for value in range(60):
+            out.write(f'{chrom}\t{value}\t{size // 60}\t{size}\t{1 / 60:.6f}\n')
+
+
+def sam_header(out):
+
+    out.write('@HD\tVN:1.6\tSO:coordinate\n')
+    for chrom, size in chrom_sizes(LINES * READ_LENGTH):
+        out.write(f'@SQ\tSN:{chrom}\tLN:{size}\n')
+
+
+def sam_records(out, lines=LINES):
+
+    sizes = chrom_sizes(lines * READ_LENGTH)
+    per_chrom = max(1, lines // len(sizes))
+
+    for chrom, size in sizes:
+        for block_start in range(0, per_chrom, BLOCK):
+            block_end = min(block_start + BLOCK, per_chrom)
+            out.write(''.join([f'read{idx}\t0\t{chrom}\t{idx * READ_LENGTH + 1}\t60\t{READ_LENGTH}M\t*\t0\t0\t{SEQ}\t{QUAL}\n'
+                               for idx in range(block_start, block_end)]))
+
+
+def vcf(out, lines=LINES):
+
+    out.write('##fileformat=VCFv4.2\n')
+    for chrom, size in chrom_sizes(lines * 100):
+        out.write(f'##contig=<ID={chrom},length={size}>\n')
+    out.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample\n')
+
+    sizes = chrom_sizes(lines * 100)
+    per_chrom = max(1, lines // len(sizes))
+
+    for chrom, _ in sizes:
+        for block_start in range(0, per_chrom, BLOCK):
+            block_end = min(block_start + BLOCK, per_chrom)
+            out.write(''.join([f'{chrom}\t{idx * 100 + 1}\t.\tA\tG\t{30 + idx % 70}\tPASS\tDP={depth(idx * 100)}\tGT\t0/1\n'
+                               for idx in range(block_start, block_end)]))
+
+
+def copy_stdin(out):
+    #Stages fed by a pipe pass their input through, as a filter would
+
+    for block in iter(lambda: sys.stdin.read(1 << 20), ''):
+        out.write(block)
+
+
+def touch(path, content='fake\n'):
+    with open(path, 'w') as handle:
+        handle.write(content)
@@ -0,0 +1,61 @@
+"""
+Biocommander: Python wrappers for common bioinformatic tools.
+
+The wrapper classes are available at the package level, e.g. biocommander.Samtools, and are imported lazily
+(PEP 562): importing biocommander loads no wrapper module, and accessing a class loads only the module that
+defines it. pandas and NumPy are only loaded by the classes and methods that parse outputs.
+"""
+
+import importlib
+
+#{class name : module in biocommander.wrappers}
+_REGISTRY = {
+    'CommandLineSoftware': 'wrappers',
+    'CliCommand': 'cli_cmd',
+    'CommandTemplate': 'cli_cmd',
+    'CliPipeline': 'pipes',
+    'BatchRunner': 'batch',
+    'TaskGraph': 'dag',
+    'CancelGroup': 'cancel',
+    'CommandStream': 'streaming',
+    'CapturedOutput': 'capture',
+    'VersionCache': 'versions',
+    'ReferenceRegistry': 'reference',
+    'OutputPolicy': 'formats',
+    'SpoolQueue': 'spool',
+    'SpoolWorker': 'spool',
+    'BwaMapper': 'mappers',
+    'BowtieMapper': 'mappers',
+    'Minimap2Mapper': 'mappers',
+    'Samtools': 'variants',
+    'Bcftools': 'variants',
+    'BedTools': 'bedtools',
+    'GenomecovParser': 'bedtools',
+    'GenomeCoverage': 'coverage',
+    'IndexedFasta': 'fasta',
+    'IntervalSet': 'intervals',
+    'CoverageMatrix': 'cohort',
+    'CoverageStore': 'store',
+    'StoredCoverage': 'store',
+}
+
+__all__ = sorted(_REGISTRY)
+
+
+def __getattr__(name):
+
+    module = _REGISTRY.get(name)
+
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f'.wrappers.{module}', __name__), name)
+
+    #Later accesses do not go through __getattr__
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_REGISTRY))
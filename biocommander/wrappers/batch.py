@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from .logger import set_logger
+from . import cancel
+import os
+
+
+def available_cores():
+    """
+    Returns the number of cores the current process is allowed to run on.
+
+    Returns:
+        int: The size of the CPU affinity mask, or os.cpu_count() where the affinity mask is not available.
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+class BatchRunner():
+    """
+    Runs a per-sample pipeline of wrapper calls over many samples in parallel, within a machine-wide core budget.
+
+    Args:
+        pipeline (callable): A function pipeline(sample, threads) that runs the wrapper calls of one sample,
+                             passing 'threads' to the wrappers (e.g. BwaMapper(threads=threads) or sort(..., threads=threads)).
+        cores (int, optional): The core budget. Defaults to the size of the CPU affinity mask.
+        threads (int, optional): Threads given to each sample. Defaults to None (chosen from the budget).
+        max_samples (int, optional): Maximum number of samples processed at the same time, e.g. to bound the memory
+                                     used by bwa indexes. Defaults to None (no limit).
+        fail_fast (bool, optional): If True, the first failed command or sample kills the commands of every sample
+                                    and no further command is started. Defaults to False.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The budget is split so that concurrent samples x threads per sample never exceeds the cores available,
+        avoiding oversubscription. Without a fixed 'threads', as many samples as possible run at once, since
+        sample-level parallelism scales better than tool threading; the remaining cores are given as threads.
+
+        Samples run in worker threads: the tools are external processes, so the GIL is not a bottleneck.
+
+        Every sample runs inside the CancelGroup of the batch. With fail_fast, a command exiting with a non-zero
+        status (or a sample raising) cancels it: the running tools are killed with their process groups, and the
+        wrapper calls made afterwards raise CommandCancelled, which is stored as the error of their sample.
+        cancel() does the same from another thread.
+
+        Example:
+            def pipeline(sample, threads):
+                bwa = BwaMapper(reference='ref.fa', threads=threads)
+                bwa.mem(sample['reads'], output=f"{sample['name']}.sam")
+                ...
+
+            BatchRunner(pipeline).run(samples)
+    """
+
+    KEY_SAMPLE = 'sample'
+    KEY_RESULT = 'result'
+    KEY_ERROR = 'error'
+
+    def __init__(self, pipeline, cores=None, threads=None, max_samples=None, fail_fast=False, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+        self.pipeline = pipeline
+        self.cores = cores if cores else available_cores()
+        self.threads = threads
+        self.max_samples = max_samples
+        self.fail_fast = fail_fast
+
+        self.group = None
+        self.results = []
+
+    def plan(self, n_samples):
+        """
+        Splits the core budget between concurrent samples and threads per sample.
+
+        Args:
+            n_samples (int): The number of samples to process.
+
+        Returns:
+            tuple: (concurrent samples, threads per sample).
+        """
+
+        n_samples = max(n_samples, 1)
+
+        if self.threads:
+            threads = min(self.threads, self.cores)
+            workers = max(self.cores // threads, 1)
+        else:
+            workers = min(n_samples, self.cores)
+            if self.max_samples:
+                workers = min(workers, self.max_samples)
+            threads = max(self.cores // workers, 1)
+
+        workers = min(workers, n_samples)
+        if self.max_samples:
+            workers = min(workers, self.max_samples)
+
+        return workers, threads
+
+    def _run_sample(self, sample, threads):
+
+        try:
+            with self.group:
+                self.group.check()
+                return {self.KEY_SAMPLE: sample, self.KEY_RESULT: self.pipeline(sample, threads), self.KEY_ERROR: None}
+        except cancel.CommandCancelled as error:
+            self.logger.warning(f'Sample {sample} cancelled: {self.group.reason}')
+            return {self.KEY_SAMPLE: sample, self.KEY_RESULT: None, self.KEY_ERROR: error}
+        except Exception as error:
+            self.logger.error(f'Sample {sample} failed: {error}')
+            self.group.fail(f'Sample {sample} failed: {error}')
+            return {self.KEY_SAMPLE: sample, self.KEY_RESULT: None, self.KEY_ERROR: error}
+
+    def run(self, samples):
+        """
+        Runs the pipeline over every sample.
+
+        Args:
+            samples (list): The samples, in any format accepted by the pipeline function.
+
+        Returns:
+            list: One dictionary per sample, in input order: {'sample' : sample, 'result' : returned value, 'error' : exception or None}.
+        """
+
+        samples = list(samples)
+        workers, threads = self.plan(len(samples))
+
+        self.logger.info(f'Processing {len(samples)} samples: {workers} concurrent x {threads} threads ({self.cores} cores)')
+
+        self.group = cancel.CancelGroup(self.fail_fast)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                try:
+                    futures = [executor.submit(self._run_sample, sample, threads) for sample in samples]
+                    self.results = [future.result() for future in futures]
+                except BaseException:
+                    #e.g. KeyboardInterrupt: the running tools are killed before the worker threads are joined
+                    self.group.cancel('interrupted')
+                    raise
+        finally:
+            self.group.close()
+
+        return self.results
+
+    def cancel(self, reason='cancelled'):
+        """
+        Kills the running commands of the batch; the samples not finished yet fail with CommandCancelled.
+        """
+
+        if self.group:
+            self.group.cancel(reason)
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result[self.KEY_ERROR] is not None]
@@ -1,5 +1,99 @@
 from .wrappers import CommandLineSoftware
-import pandas as pd
+import time
+import io
+
+#pandas, NumPy and the modules built on them are imported by the methods that parse or analyse the outputs,
+#so scripts that only run commands do not pay their import time
+
+
+class GenomecovParser():
+    """
+    Incremental parser for the standard output of bedtools genomecov.
+
+    Args:
+        columns (list): Names of the tab separated columns of the output.
+        dtypes (dict): A dictionary of {column : dtype} used to parse each column.
+
+    Note:
+        Bytes are provided in arbitrary chunks through the feed() method. Only complete lines are
+        parsed, straight into typed columns, so the memory used is the typed result plus one chunk.
+        Columns parsed as 'category' are merged with union_categoricals when the parse is finished.
+    """
+
+    LINE_SEP = b'\n'
+    COL_SEP = '\t'
+
+    def __init__(self, columns, dtypes):
+
+        self.columns = columns
+        self.dtypes = dtypes
+
+        self._remainder = b''
+        self._frames = []
+
+    def feed(self, chunk):
+        """
+        Parses the complete lines contained in a chunk of bytes.
+
+        Args:
+            chunk (bytes): A chunk of the genomecov output. The trailing incomplete line is kept
+                           until the next call.
+        """
+
+        data = self._remainder + chunk if self._remainder else chunk
+
+        cut = data.rfind(self.LINE_SEP) + 1
+
+        self._remainder = data[cut:]
+
+        if cut:
+            self._parse(data[:cut])
+
+    def _parse(self, block):
+        import pandas as pd
+
+        frame = pd.read_csv(
+            io.BytesIO(block),
+            sep=self.COL_SEP,
+            header=None,
+            names=self.columns,
+            dtype=self.dtypes,
+            engine='c'
+        )
+
+        if len(frame):
+            self._frames.append(frame)
+
+    def finish(self):
+        """
+        Parses any pending data and combines all the parsed chunks.
+
+        Returns:
+            DataFrame: The typed genomecov output.
+        """
+        from pandas.api.types import union_categoricals
+        import pandas as pd
+        import numpy as np
+
+        if self._remainder.strip():
+            self._parse(self._remainder)
+        self._remainder = b''
+
+        if not self._frames:
+            return pd.DataFrame({col: pd.Series(dtype=self.dtypes[col]) for col in self.columns})
+
+        data = {}
+        for col in self.columns:
+            chunks = [frame[col] for frame in self._frames]
+            if self.dtypes[col] == 'category':
+                data[col] = union_categoricals(chunks)
+            else:
+                data[col] = np.concatenate([chunk.to_numpy() for chunk in chunks])
+
+        self._frames = []
+
+        return pd.DataFrame(data, columns=self.columns)
+
 
 class BedTools(CommandLineSoftware):
     #TODO: Quedan formatos que configurar
@@ -13,6 +107,8 @@ class BedTools(CommandLineSoftware):
     BGA = 'bga'
     BG = 'bg'
     D = "d"
+    DZ = 'dz'
+    SCALE = 'scale'
 
     CHR = 'chr'
     START = 'start'
@@ -28,65 +124,248 @@ class BedTools(CommandLineSoftware):
     BEDGRAPH_COLUMNS = [CHR, START, END, COVERAGE]
     D_FORMAT_COLUMNS = [CHR, POSITION, COVERAGE]
 
+    DEFAULT_DTYPES = {CHR: 'category', DEPTH: 'int32', NUMBER_EQUAL_2: 'int64', SIZE: 'int64', FRACTION: 'float64'}
+    BEDGRAPH_DTYPES = {CHR: 'category', START: 'int32', END: 'int32', COVERAGE: 'int32'}
+    D_FORMAT_DTYPES = {CHR: 'category', POSITION: 'int32', COVERAGE: 'int32'}
+    SCALED_COVERAGE_DTYPE = 'float64'
+
+    # Size of the blocks read from the genomecov standard output
+    CHUNK_SIZE = 1 << 22
+
     SUBCMD_GENOMECOV = 'genomecov'
     SUBCMD_MASKFASTA = 'maskfasta'
 
-    genome_cov = ''
+    genome_cov = None
+    coverage = None
+    #Chromosome sizes the coverage attribute was built with
+    _coverage_sizes = None
 
-    def genomecov(self,  **kwargs):
-        #genomecOV sale a las salida estándar
-        # Hay que proveer de métodos estandarizados para lectura del STDOUT
-        # Para mantener la lógica, estos métodos deben recuperar la salida estándar y mandarla a un archivo en un formato específico.
-        # ¿Capacidad de almacenarla a la vez?
+    def genomecov_command(self, **kwargs):
 
-        self.logger.info(f"Output will be storaged into the {self.__class__.__name__}.genomecov attribute")
         cmd = self._build_command([self.SUBCMD_GENOMECOV], kwargs=kwargs)
 
         #Bedtools use all flags with - instead of --
         cmd.long_flag_to_short()
 
-        output = self.execute_command(cmd.cmd_list, capture_output=True)
-
-        if output[self.STDOUT]:
-            self.genome_cov = self._deal_genomecov(output[self.STDOUT])
-            print(self.genome_cov)
-            if self.BGA in kwargs.keys() or self.BG in kwargs.keys():
-                self.genome_cov.columns = self.BEDGRAPH_COLUMNS
-                self.genome_cov[self.COVERAGE] = pd.to_numeric(self.genome_cov[self.COVERAGE])
-            elif self.D in kwargs.keys():
-                self.genome_cov.columns = self.D_FORMAT_COLUMNS
-                self.genome_cov[self.COVERAGE] = pd.to_numeric(self.genome_cov[self.COVERAGE])
-            else:
-                self.genome_cov.columns = self.DEFAULT_COLUMNS
+        return cmd
 
-        else:
+    def genomecov(self,  **kwargs):
+        #genomecov sale a la salida estándar, que se lee por bloques y se convierte directamente en columnas tipadas
+        #Returns True if genomecov succeeded; otherwise genome_cov is left as None
+
+        self.logger.info(f"Output will be storaged into the {self.__class__.__name__}.genome_cov attribute")
+        cmd = self.genomecov_command(**kwargs)
+
+        columns, dtypes = self._genomecov_layout(kwargs)
+
+        with self.stream_command(cmd.cmd_list, lines=False, chunk_size=self.CHUNK_SIZE) as stream:
+            genome_cov = self._deal_genomecov(stream, columns, dtypes)
+
+        return self._store_genomecov(genome_cov, stream.returncode, stream.stderr)
+
+    async def genomecov_async(self, **kwargs):
+        #Asynchronous version of genomecov. The chunks are parsed in the default executor to keep the event loop free
+        import asyncio
+
+        self.logger.info(f"Output will be storaged into the {self.__class__.__name__}.genome_cov attribute")
+        cmd = self.genomecov_command(**kwargs)
+
+        parser = GenomecovParser(*self._genomecov_layout(kwargs))
+
+        loop = asyncio.get_running_loop()
+
+        async def read_stdout(stream):
+            while chunk := await stream.read(self.CHUNK_SIZE):
+                await loop.run_in_executor(None, parser.feed, chunk)
+            return await loop.run_in_executor(None, parser.finish)
+
+        async with self._async_semaphore():
+            started = time.perf_counter()
+            process = await self.open_command_async(cmd.cmd_list, stderr=asyncio.subprocess.PIPE)
+            genome_cov, errors = await asyncio.gather(read_stdout(process.stdout), process.stderr.read())
+            returncode = await process.wait()
+
+        self._record_async_metrics(cmd.cmd_list, process, started)
+
+        return self._store_genomecov(genome_cov, returncode, errors.decode('utf-8', errors='replace'))
+
+    def _store_genomecov(self, genome_cov, returncode, errors):
+        #The output of a failed genomecov may be truncated: it is discarded, and so is any previous result
+
+        self.genome_cov = None
+        self.coverage = None
+
+        if returncode:
+            self.logger.error(f'genomecov exited with status {returncode}: {errors.strip()}')
+            return False
+
+        if not len(genome_cov):
             self.logger.error("Error in process output")
+            return False
+
+        self.genome_cov = genome_cov
 
-    def filter_coverage_bed(self, output='', threshold = 100):
+        return True
+
+    def _genomecov_layout(self, kwargs):
+        #Column names and dtypes of the genomecov output for the requested format
+
+        if self.BGA in kwargs.keys() or self.BG in kwargs.keys():
+            columns, dtypes = self.BEDGRAPH_COLUMNS, dict(self.BEDGRAPH_DTYPES)
+        elif self.D in kwargs.keys() or self.DZ in kwargs.keys():
+            columns, dtypes = self.D_FORMAT_COLUMNS, dict(self.D_FORMAT_DTYPES)
+        else:
+            return self.DEFAULT_COLUMNS, dict(self.DEFAULT_DTYPES)
+
+        if self.SCALE in kwargs.keys():
+            dtypes[self.COVERAGE] = self.SCALED_COVERAGE_DTYPE
+
+        return columns, dtypes
+
+    def get_coverage(self, chrom_sizes=None):
+        """
+        Returns the per-chromosome coverage arrays built from the genome_cov attribute.
+
+        Args:
+            chrom_sizes (dict, optional): A dictionary of {chromosome : length}, used to extend the arrays
+                                          when genomecov omits the last positions (-bg). The arrays are
+                                          built again only if the sizes differ from the previous call.
+
+        Returns:
+            GenomeCoverage: The coverage object, also stored in the coverage attribute.
+        """
+        from .coverage import GenomeCoverage
+
+        if self.genome_cov is None:
+            self.logger.error('Requires the execution of genomecov() method')
+            return None
+
+        #Built once per genomecov output; only new chromosome sizes build it again
+        if self.coverage is None or (chrom_sizes and chrom_sizes != self._coverage_sizes):
+            self.coverage = GenomeCoverage.from_genomecov(self.genome_cov, chrom_sizes, self.verbosity)
+            self._coverage_sizes = dict(chrom_sizes) if chrom_sizes else None
+
+        return self.coverage
+
+    def filter_coverage_bed(self, output='', threshold = 100, min_length = 1):
         #Custom function for create filter BED file to maskfasta
+        #Adjacent positions below the threshold are merged into a single interval
 
         #Requires genome_cov
 
-        if not self.genome_cov:
-            self.logger.error('Requires the execution of genomecov() method')
-        self.filter_bed_file = self.genome_cov[self.genome_cov[self.COVERAGE] < threshold]
+        coverage = self.get_coverage()
 
-        self.filter_bed_file.to_csv(output, sep = '\t', header=False, index=False)
+        if coverage is None:
+            return
 
+        self.filter_bed_file = coverage.intervals_below(threshold, min_length=min_length)
 
-    def _deal_genomecov(self, string, col_sep = '\n', row_sep = '\t'):
-        #Split the string output of bedtools genomecov and conver into dataframe
-        
-        rows = string.split(col_sep)
-        
-        data = [row.split(row_sep) for row in rows]
-        
-        df = pd.DataFrame(data).dropna()
+        coverage.to_bed(self.filter_bed_file, output)
 
-        return df
+    def mask_low_coverage(self, reference, output, threshold = 100, min_length = 1, mask_char = 'N', soft = False):
+        """
+        Masks the reference bases covered below a threshold, in process (equivalent to filter_coverage_bed + maskfasta).
 
-    def maskfasta(self, input, bed, output, **kwargs):
-        #   Execute maskfasta algorithm
+        Args:
+            reference (str or IndexedFasta): The reference FASTA file, or an IndexedFasta shared by many samples.
+            output (str): The masked FASTA file.
+            threshold (int, optional): Bases with a depth below the threshold are masked. Defaults to 100.
+            min_length (int, optional): Minimum length of the masked intervals. Defaults to 1.
+            mask_char (str, optional): The character written over the masked bases. Defaults to 'N'.
+            soft (bool, optional): If True, masked bases are written in lowercase instead. Defaults to False.
+
+        Note:
+            Requires genome_cov. No BED file is written and bedtools is not executed: the intervals are taken from
+            the coverage arrays and applied to a memory map of the reference (see IndexedFasta.mask).
+        """
+        from .fasta import IndexedFasta
+
+        fasta = reference if isinstance(reference, IndexedFasta) else IndexedFasta(reference, self.verbosity)
+
+        #The contig sizes extend the arrays to every reference base: -bg omits the uncovered tails and contigs
+        coverage = self.get_coverage(fasta.contig_sizes)
+
+        if coverage is None:
+            return
+
+        self.filter_bed_file = coverage.intervals_below(threshold, min_length=min_length)
+
+        self.trace_output(output, self.SUBCMD_MASKFASTA)
+        fasta.mask(self.filter_bed_file, output, mask_char, soft)
+
+    def feature_depth(self, features, threshold = None):
+        """
+        Summarizes the depth of every feature of an annotation, in process (instead of bedtools coverage).
+
+        Args:
+            features (str or IntervalSet): A BED file (e.g. one interval per gene, with its name) or an IntervalSet.
+            threshold (int, optional): If provided, the bases of every feature with depth below it are counted too.
+
+        Returns:
+            DataFrame: One row per feature with its mean, minimum and maximum depth (see IntervalSet.depth).
+
+        Note:
+            Requires genome_cov. The features are read once and can be reused for many samples; the low coverage
+            intervals themselves are available with IntervalSet.from_coverage, for intersect, merge or complement.
+        """
+        from .intervals import IntervalSet
+
+        coverage = self.get_coverage()
+
+        if coverage is None:
+            return None
+
+        if not isinstance(features, IntervalSet):
+            features = IntervalSet.from_bed(features, self.verbosity)
+
+        return features.depth(coverage, threshold)
+
+    def coverage_summary(self, thresholds = None, percentiles = None, regions = None, chrom_sizes = None):
+        """
+        Summarizes the coverage (mean, median, percentiles and breadth at several depths) in one pass, per chromosome and genome-wide.
+
+        Args:
+            thresholds (list, optional): Depths whose breadth is reported. Defaults to 1, 10, 20, 30 and 100x.
+            percentiles (list, optional): Percentiles of the depth reported besides the median. Defaults to 5, 25, 75 and 95.
+            regions (str or IntervalSet, optional): A BED file or an IntervalSet of target regions, e.g. an exome
+                                                    panel. Defaults to None (every base).
+            chrom_sizes (dict, optional): A dictionary of {chromosome : length}, required with -bg outputs (see get_coverage).
+
+        Returns:
+            DataFrame: One row per chromosome plus a 'genome' row (see GenomeCoverage.summary).
+
+        Note:
+            Requires genome_cov in per-base (-d) or bedgraph (-bg/-bga) layout. Replaces one genomecov or
+            filter_coverage_bed run per threshold: the depth histogram of every chromosome is built once and
+            every statistic is taken from it.
+        """
+        from .intervals import IntervalSet
+
+        coverage = self.get_coverage(chrom_sizes)
+
+        if coverage is None:
+            return None
+
+        if regions is not None and not isinstance(regions, IntervalSet):
+            regions = IntervalSet.from_bed(regions, self.verbosity)
+
+        return coverage.summary(
+            thresholds if thresholds is not None else coverage.DEFAULT_THRESHOLDS,
+            percentiles if percentiles is not None else coverage.DEFAULT_PERCENTILES,
+            regions
+        )
+
+    def _deal_genomecov(self, chunks, columns, dtypes):
+        #Convert the binary chunks of the bedtools genomecov output into a typed dataframe
+
+        parser = GenomecovParser(columns, dtypes)
+
+        for chunk in chunks:
+            parser.feed(chunk)
+
+        return parser.finish()
+
+    def maskfasta_command(self, input, bed, output, **kwargs):
 
         kwargs['fi'] = input
         kwargs['bed'] = bed
@@ -96,6 +375,17 @@ class BedTools(CommandLineSoftware):
 
         cmd.long_flag_to_short()
 
-        self.execute_command(cmd.cmd_list)
-                        
+        return cmd
+
+    def maskfasta(self, input, bed, output, **kwargs):
+        #   Execute maskfasta algorithm
+
+        cmd = self.maskfasta_command(input, bed, output, **kwargs)
+
+        self._execute_output(cmd, self.SUBCMD_MASKFASTA, output)
+
+    async def maskfasta_async(self, input, bed, output, **kwargs):
+
+        cmd = self.maskfasta_command(input, bed, output, **kwargs)
 
+        return await self._execute_output_async(cmd, self.SUBCMD_MASKFASTA, output)
@@ -0,0 +1,237 @@
+import threading
+import resource
+import signal
+import os
+
+#Timeouts, process-group cancellation and fail-fast groups of commands (see CancelGroup)
+
+#Seconds of CPU between the soft limit (SIGXCPU) and the hard limit (SIGKILL) of RLIMIT_CPU
+CPU_GRACE = 5
+
+_local = threading.local()
+
+
+class CommandCancelled(RuntimeError):
+    """
+    Raised when a command is started in a CancelGroup that has been cancelled.
+    """
+
+
+def kill_group(process, sig=signal.SIGKILL):
+    """
+    Sends a signal to the process group of a command, so the processes it forked receive it too.
+
+    Args:
+        process (Popen): A process started with start_new_session=True, the leader of its group.
+        sig (int, optional): The signal. Defaults to SIGKILL.
+    """
+
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        #The group is gone (or the pid was reused by a process of another user)
+        pass
+    except AttributeError:
+        process.send_signal(sig)
+
+
+def limit_cpu(process, seconds):
+    """
+    Limits the CPU time of a started command with RLIMIT_CPU.
+
+    Args:
+        process (Popen or asyncio Process): The command, just started.
+        seconds (float): Seconds of CPU. None or 0 leaves the command without limit.
+
+    Returns:
+        bool: True if the limit was set.
+
+    Note:
+        The limit is set from the parent with prlimit, after the process is started, instead of in a preexec_fn,
+        which is not safe when the parent runs threads. At 'seconds' of CPU the process receives SIGXCPU and,
+        CPU_GRACE seconds later, SIGKILL. The processes it forks afterwards inherit their own limit; a process
+        forked before the limit is set (in the first instants of the command) is not limited, but it is still
+        killed by the Watchdog and by the CancelGroup with the process group.
+    """
+
+    if not seconds or not hasattr(resource, 'prlimit'):
+        return False
+
+    seconds = int(seconds)
+
+    try:
+        resource.prlimit(process.pid, resource.RLIMIT_CPU, (seconds, seconds + CPU_GRACE))
+    except (ProcessLookupError, PermissionError):
+        #The command has already finished
+        return False
+
+    return True
+
+
+class Watchdog():
+    """
+    Kills the process groups of a command when it runs longer than a wall-clock timeout.
+
+    Args:
+        processes (Popen or list): The processes of the command, started with start_new_session=True.
+        timeout (float): Seconds of wall time. None or 0 disables the watchdog.
+    """
+
+    def __init__(self, processes, timeout):
+
+        self.processes = processes if isinstance(processes, list) else [processes]
+        self.timeout = timeout
+        self.expired = False
+
+        self._timer = None
+        if timeout:
+            self._timer = threading.Timer(timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _expire(self):
+
+        self.expired = True
+        for process in self.processes:
+            if process.returncode is None:
+                kill_group(process)
+
+    def cancel(self):
+
+        if self._timer:
+            self._timer.cancel()
+
+
+def current_group():
+    """
+    Returns the innermost CancelGroup entered by the current thread, or None.
+    """
+
+    stack = getattr(_local, 'stack', None)
+
+    return stack[-1] if stack else None
+
+
+class CancelGroup():
+    """
+    The processes of a batch, pipeline or task graph, killed together when the group is cancelled.
+
+    Args:
+        fail_fast (bool, optional): If True, the first failed command cancels the group. Defaults to True.
+        parent (CancelGroup, optional): The enclosing group. Defaults to the group of the current thread.
+
+    Note:
+        The wrappers register every process they start with the group of the current thread (entered with
+        'with group:'). Cancelling the group kills the process groups of its running commands, so their forked
+        children die too and the cores are freed at once, and every command started afterwards raises
+        CommandCancelled, so the following steps do not run on truncated outputs.
+
+        A failure is also reported to the parent group, and cancelling a group cancels its child groups.
+    """
+
+    def __init__(self, fail_fast=True, parent=None):
+
+        self.fail_fast = fail_fast
+        self.parent = parent if parent else current_group()
+
+        self.cancelled = False
+        self.reason = None
+        #True if a command of this group (or of a child group) failed, as opposed to being cancelled from outside
+        self.failed = False
+
+        self._processes = []
+        self._children = []
+        self._lock = threading.Lock()
+
+        if self.parent:
+            self.parent._add_child(self)
+
+    def __enter__(self):
+
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(self)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.stack.remove(self)
+
+    def _add_child(self, group):
+
+        with self._lock:
+            self._children.append(group)
+            cancelled = self.cancelled
+
+        if cancelled:
+            group.cancel(self.reason)
+
+    def close(self):
+        #Detaches the group from its parent once its commands have finished
+
+        if self.parent:
+            with self.parent._lock:
+                if self in self.parent._children:
+                    self.parent._children.remove(self)
+
+    def check(self):
+        """
+        Raises CommandCancelled if the group has been cancelled.
+        """
+
+        if self.cancelled:
+            raise CommandCancelled(f'Cancelled: {self.reason}')
+
+    def register(self, process):
+        """
+        Adds a running process to the group. It is killed at once if the group has been cancelled.
+        """
+
+        with self._lock:
+            #Reaped processes are dropped, their pids may be reused
+            self._processes = [running for running in self._processes if running.returncode is None]
+            self._processes.append(process)
+            cancelled = self.cancelled
+
+        if cancelled:
+            kill_group(process)
+
+    def cancel(self, reason='cancelled'):
+        """
+        Kills the running processes of the group and of its child groups.
+
+        Args:
+            reason (str, optional): The reason, stored in the reason attribute and in CommandCancelled errors.
+        """
+
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            processes = list(self._processes)
+            children = list(self._children)
+
+        for process in processes:
+            if process.returncode is None:
+                kill_group(process)
+
+        for child in children:
+            child.cancel(reason)
+
+    def fail(self, reason):
+        """
+        Reports a failed command: the group is cancelled if it is fail-fast, and the failure is passed to the parent.
+        """
+
+        #Commands killed by the cancellation of the group are not failures
+        if self.cancelled:
+            return
+
+        self.failed = True
+
+        if self.fail_fast:
+            self.cancel(reason)
+
+        if self.parent:
+            self.parent.fail(reason)
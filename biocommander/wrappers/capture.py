@@ -0,0 +1,141 @@
+import tempfile
+import mmap
+import io
+import os
+
+
+class CapturedOutput():
+    """
+    Captured output of a command: in memory while small, spilled to a temporary file when it grows.
+
+    Args:
+        spill_size (int, optional): Size in bytes above which the output is moved to a temporary file.
+                                    Defaults to 64 MiB.
+        directory (str, optional): Directory of the temporary file. Defaults to the system temporary directory.
+
+    Note:
+        The content is exposed as a zero-copy buffer: the in-memory bytes or a read-only memory map of the
+        temporary file. Readers that accept the buffer protocol consume it directly, without another copy:
+
+            np.frombuffer(captured.buffer, dtype=np.uint8)
+            pd.read_csv(captured.open(), sep='\t')
+
+        A spilled output lives in the page cache, so the kernel can drop it under memory pressure. The temporary
+        file is anonymous and is removed when the object is closed or collected.
+    """
+
+    SPILL_SIZE = 64 << 20
+    READ_SIZE = 1 << 20
+
+    def __init__(self, spill_size=SPILL_SIZE, directory=None):
+
+        self.spill_size = spill_size
+        self.directory = directory
+
+        self._memory = io.BytesIO()
+        self._file = None
+        self._map = None
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f'CapturedOutput({self._size} bytes, {"spilled" if self.spilled else "in memory"})'
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    def write(self, chunk):
+        """
+        Appends a chunk of bytes, moving the content to the temporary file when it exceeds spill_size.
+        """
+
+        if self._file is None and self._size + len(chunk) > self.spill_size:
+            self._file = tempfile.TemporaryFile(dir=self.directory)
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+
+        (self._file if self._file is not None else self._memory).write(chunk)
+        self._size += len(chunk)
+
+    def read_from(self, stream):
+        """
+        Copies a binary stream until its end.
+
+        Args:
+            stream (file): The binary stream, e.g. the stdout pipe of a process.
+        """
+
+        read = getattr(stream, 'read1', stream.read)
+
+        while chunk := read(self.READ_SIZE):
+            self.write(chunk)
+
+    @property
+    def buffer(self):
+        """
+        Returns the content as a read-only zero-copy buffer.
+
+        Returns:
+            memoryview: A view of the in-memory bytes or of a memory map of the temporary file. It must be
+                        released before the object is closed.
+        """
+
+        if self._file is None:
+            return self._memory.getbuffer().toreadonly()
+
+        if not self._size:
+            return memoryview(b'')
+
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return memoryview(self._map)
+
+    def open(self):
+        """
+        Returns a new binary file object positioned at the start of the content, for parsers that read files.
+        """
+
+        if self._file is None:
+            return io.BytesIO(self._memory.getbuffer())
+
+        self._file.flush()
+
+        handle = os.fdopen(os.dup(self._file.fileno()), 'rb')
+        handle.seek(0)
+
+        return handle
+
+    def getvalue(self):
+        #Copy of the content as bytes
+
+        return bytes(self.buffer)
+
+    def decode(self, encoding='utf-8', errors='strict'):
+        return str(self.buffer, encoding, errors)
+
+    def close(self):
+        """
+        Releases the memory map and removes the temporary file.
+        """
+
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                #A view of the map is still alive; it is released when the view is collected
+                pass
+            self._map = None
+
+        if self._file is not None:
+            self._file.close()
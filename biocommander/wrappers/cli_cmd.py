@@ -1,4 +1,6 @@
 from .logger import set_logger
+from collections.abc import MutableMapping
+import logging
 
 class CliCommand():
     """
@@ -18,8 +20,16 @@ class CliCommand():
         The CliCommand class provides a convenient way to construct a command line command with subcommands,
         keyword arguments, and arguments. It automatically formats the command into a string or list representation
         that can be executed using subprocess.
+
+        The positional arguments are stored as a list and the command list is built lazily, once, the first time
+        cmd_list or cmd_str is used after a change, so building a command is linear in its number of arguments.
+        The methods of the class, and assignments to args (cmd.args[2] = 'other.bam'), mark the command as changed;
+        the option dictionaries in kwargs must be changed through add_kwargs or mod_kwarg. Commands built many times
+        with different values should use a CommandTemplate.
     """
 
+    __slots__ = ('logger', 'cmd', 'subcmds', 'raw_kwargs', 'kwargs', 'raw_args', '_args', '_cmd_list')
+
 
     KEY_END = 'end'
     KEY_START = 'start'
@@ -51,25 +61,53 @@ class CliCommand():
         self.logger = set_logger(self.__class__.__name__, verbosity)
         self.cmd = cmd
 
-        self.subcmds = subcmds
+        if isinstance(subcmds, str):
+            subcmds = [subcmds]
+        self.subcmds = list(subcmds) if subcmds else []
 
         self.raw_kwargs = kwargs
 
         if self.raw_kwargs:
             self.kwargs = self._extend_kwargs(self.raw_kwargs)
         else:
-            self.kwargs = kwargs
+            self.kwargs = {}
   
         self.raw_args = self._format_arg_tuple(args)
 
-        if self.raw_args:
-            self.args = self._build_arg_dict(self.raw_args)
-        else:
-            self.args = {}
+        self._args = list(self.raw_args) if self.raw_args else []
+
+        self._cmd_list = None
+
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f'Create command: {self.cmd_str}')
+
+    @property
+    def args(self):
+        #Positional arguments as a mapping of {position (1-based) : argument}; assignments change the command
+        return ArgumentView(self)
+
+    @args.setter
+    def args(self, args):
 
-        self.build_cmd()
+        if isinstance(args, dict):
+            args = [args[idx] for idx in sorted(args)]
 
-        self.logger.debug(f'Create command: {self.cmd_str}')
+        self._args = list(args)
+        self._cmd_list = None
+
+    @property
+    def cmd_list(self):
+        #The command is built the first time it is requested after a change; a copy is returned, so changing the
+        #list does not change the command
+
+        if self._cmd_list is None:
+            self.build_cmd()
+
+        return list(self._cmd_list)
+
+    @property
+    def cmd_str(self):
+        return ' '.join(self.cmd_list)
 
     def add_subcmd(self, subcmds, position=''):
         """
@@ -108,19 +146,26 @@ class CliCommand():
         if position == self.KEY_END:
             self.subcmds.extend(subcmds)
         elif position == self.KEY_START:
-            subcmds.extend(self.subcmds)
-            self.subcmds = subcmds
+            self.subcmds[0:0] = subcmds
+
+        self._cmd_list = None
+
+    def __or__(self, command):
+        #Pipes the stdout of this command to the stdin of the next one (see CliPipeline)
+        from .pipes import CliPipeline
+
+        return CliPipeline([self], verbosity=self.logger.level) | command
 
     def __repr__(self):
 
-        self.cmd_dict = {
+        cmd_dict = {
             self.KEY_CMD : self.cmd,
             self.KEY_SUBCMD : self.subcmds,
             self.KEY_OPTIONS : self.kwargs,
             self.KEY_ARGS : self.args
         }
 
-        returned = ','.join([f'{key}={value}' for key, value in self.cmd_dict.items()])
+        returned = ','.join([f'{key}={value}' for key, value in cmd_dict.items()])
         return f'CliCommand({returned})'
 
 
@@ -138,7 +183,7 @@ class CliCommand():
         Note:
             This method ensures that the arguments are represented as a tuple. If the 'args' parameter is already a tuple,
             it is kept as is. If 'args' is a string or an integer, it is converted into a single-element tuple. If 'args'
-            is a list, it is converted into a tuple.
+            is a list, it is converted into a tuple. None is converted into an empty tuple.
 
             If the input format for 'args' is not compatible (e.g., an unsupported data type), the method logs an error
             and returns None.
@@ -150,6 +195,8 @@ class CliCommand():
             args = (args,)
         elif isinstance(args, list):
             args = tuple(args)
+        elif args is None:
+            args = ()
         else:
             self.logger.error('The args input format is not compatible')
             args = None
@@ -267,7 +314,7 @@ class CliCommand():
 
         If 'value' is provided, the method changes the value of the keyword argument to the new value provided.
 
-        After modifying the keyword argument, the method rebuilds the command to reflect the changes made.
+        After modifying the keyword argument, the command is rebuilt the next time it is requested.
         """
 
         if flag:
@@ -280,7 +327,7 @@ class CliCommand():
             self.kwargs[new_key] = self.kwargs[key]
             del self.kwargs[key]
         
-        self.build_cmd()
+        self._cmd_list = None
 
     def _preserve_keys(self, src_dict, new_dict):
 
@@ -339,41 +386,6 @@ class CliCommand():
 
         return args_dict
     
-    def _order_args(self):
-        """
-        Orders the positional arguments in the command dictionary based on their keys.
-
-        Note:
-        This method resets the order of the positional arguments in the 'args' dictionary to ensure they are in the correct
-        order for constructing the command.
-
-        The method starts by retrieving the keys of the 'args' dictionary and stores them in a list called 'args_order'.
-        The keys represent the indices of the positional arguments.
-
-        The list of keys is then sorted in ascending order using the 'sort' method.
-
-        After sorting, the positional arguments are retrieved from the 'args' dictionary in the newly determined order
-        and stored in a list called 'args'.
-
-        Finally, the 'args' dictionary is rebuilt using the '_build_arg_dict' method, which creates a new dictionary
-        with the positional arguments in the correct order.
-
-        The purpose of this method is to guarantee that the positional arguments in the command are in the correct order,
-        ensuring that the command is constructed with the appropriate sequence of arguments.
-        """
-
-
-        args_order = list(self.args.keys())
-
-        args_order.sort()
-
-        args = [self.args[idx] for idx in args_order]
-
-        self.args = self._build_arg_dict(args)
-
-        self.logger.debug(f'Args reordered: {self.args}')
-
-            
     def add_kwargs(self, new_kwargs, replace = False):
         """
     Adds new keyword arguments to the command.
@@ -397,7 +409,7 @@ class CliCommand():
         The method checks if any of the values in 'new_kwargs' are not already formatted as dictionary entries. If a value
         is not a dictionary entry, it formats it using the '_format_kwarg' method to ensure it is in the correct format.
 
-        After updating the keyword arguments, the method rebuilds the command to reflect the changes made.
+        After updating the keyword arguments, the command is rebuilt the next time it is requested.
         """
         temp_new_kwargs = {}
         for key, value in new_kwargs.items():
@@ -408,52 +420,53 @@ class CliCommand():
                 temp_new_kwargs[key] = value
 
     # Update 'new_kwargs' based on the 'replace' parameter
-        self.kwargs = self.kwargs.update(new_kwargs) if replace else self._preserve_keys(self.kwargs, temp_new_kwargs)
-
-        self.build_cmd()
-
+        if replace:
+            self.kwargs.update(temp_new_kwargs)
+        else:
+            self._preserve_keys(self.kwargs, temp_new_kwargs)
 
-    def add_arg(self, new_arg, position=int):
-        
-        #Obtenemos las posiciones ya existentes
+        self._cmd_list = None
 
-        order = list(self.args.keys())
 
-        order.sort()
-        upd_dict = {}
-        
-        if position in order:
+    def add_arg(self, new_arg, position=None):
+        """
+        Inserts a positional argument.
 
-            updates = [value for value in order if value >= position]
-            upd_dict = {old + 1 : value for old, value in self.args.items() if old in updates}
+        Args:
+            new_arg: The argument to be added.
+            position (int, optional): 1-based position of the new argument. The arguments at or after this position are
+                                      shifted one place. Defaults to None (added at the end).
+        """
 
-        upd_dict[position] = new_arg
-        
-        self.args.update(upd_dict)
+        if position is None:
+            self._args.append(new_arg)
+        else:
+            self._args.insert(max(position - 1, 0), new_arg)
 
-        self.build_cmd()
+        self._cmd_list = None
 
     def add_multiple_args(self, args, position=''):
+        """
+        Adds several positional arguments at the start or at the end of the existing ones.
+
+        Args:
+            args (tuple, str, int, list): The arguments to be added, in order.
+            position (str, optional): 'start' or 'end'. Defaults to 'end'.
+        """
 
         if not position:
             position = self.KEY_END
         
         args = self._format_arg_tuple(args)
 
-        self._order_args()
-
         if position == self.KEY_END:
-            idx_control = len(self.args)
+            self._args.extend(args)
         elif position == self.KEY_START:
-            idx_control = 0
+            self._args[0:0] = args
         else:
             self.logger.error(f'Only {self.KEY_END} or {self.KEY_START} admitted as position')
 
-        for idx, arg in enumerate(args):
-            idx += idx_control
-            self.add_arg(arg, idx)
-        
-        self.build_cmd()
+        self._cmd_list = None
 
     def _list_kwargs(self):
         #Method for create the list of kwargs needed to build the cmd list
@@ -464,21 +477,13 @@ class CliCommand():
             kwargs_list.append(keyword)
 
             if not isinstance(value, bool) and value:
-                kwargs_list.append(value)
+                kwargs_list.append(str(value))
         
         return kwargs_list
     
     def _list_args(self):
 
-        self._order_args()
-        args_list = []
-
-        order = list(self.args.keys())
-        order.sort()
-        for pos in order:
-            args_list.append(self.args[pos])
-        
-        return args_list
+        return [str(arg) for arg in self._args]
 
     
     def build_cmd(self):
@@ -500,7 +505,7 @@ class CliCommand():
         Finally, the method joins all elements of the command list into a single string, 'cmd_str', representing the complete command.
 
         The 'cmd_list' attribute is also updated with the final list, which can be useful if you need to access the individual
-        components separately.
+        components separately. The cmd_list and cmd_str properties call this method when the command has changed.
 
         Note that in many cases, it is more convenient and safer to use the 'cmd_list' attribute directly, especially if you
         need to further manipulate or pass the command components to other functions or processes. The 'cmd_str' is provided for
@@ -511,19 +516,179 @@ class CliCommand():
         """
         #Add main cmd
 
-        self.cmd_list = [self.cmd]
+        cmd_list = [self.cmd]
 
         #Add subcommands, if exists
         if self.subcmds:
-            self.cmd_list.extend(self.subcmds)
+            cmd_list.extend(self.subcmds)
 
         #Add kwargs
         if self.kwargs:
-            self.cmd_list.extend(self._list_kwargs())
+            cmd_list.extend(self._list_kwargs())
 
-        if self.args:
-            self.cmd_list.extend(self._list_args())
+        if self._args:
+            cmd_list.extend(self._list_args())
     
-        self.cmd_str = ' '.join(self.cmd_list)
+        self._cmd_list = cmd_list
+
+        return cmd_list
+
+
+
+
+class ArgumentView(MutableMapping):
+    """
+    The positional arguments of a CliCommand as a mapping of {position (1-based) : argument}.
+
+    Args:
+        command (CliCommand): The command whose arguments are viewed.
+
+    Note:
+        The view reads and writes the argument list of the command, and every change marks the command to be built
+        again. Assigning a position after the last one appends the argument, and deleting a position shifts the
+        following arguments one place, as add_arg does when inserting.
+    """
+
+    __slots__ = ('_command',)
+
+    def __init__(self, command):
+        self._command = command
+
+    def _index(self, position):
+
+        if not isinstance(position, int) or not 1 <= position <= len(self._command._args):
+            raise KeyError(position)
+
+        return position - 1
+
+    def __getitem__(self, position):
+        return self._command._args[self._index(position)]
+
+    def __setitem__(self, position, value):
+
+        if isinstance(position, int) and position > len(self._command._args):
+            self._command._args.append(value)
+        else:
+            self._command._args[self._index(position)] = value
+
+        self._command._cmd_list = None
+
+    def __delitem__(self, position):
+
+        del self._command._args[self._index(position)]
+        self._command._cmd_list = None
+
+    def __iter__(self):
+        return iter(range(1, len(self._command._args) + 1))
+
+    def __len__(self):
+        return len(self._command._args)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CommandTemplate():
+    """
+    Represents a command compiled once and filled with different values many times.
+
+    Args:
+        command (CliCommand or list): The command, built with placeholders as whole tokens. '{name}' is replaced
+                                      by one value and '{name*}' by every item of an iterable.
+
+    Raises:
+        ValueError: If a value is missing when the template is filled.
+
+    Note:
+        The options, flags and threads of the command are formatted once, when the template is compiled, and
+        fill() only copies the fixed tokens and inserts the values, so it is much cheaper than building a new
+        CliCommand for every sample. Any *_command method of the wrappers can be used to build the template:
+
+            sort = CommandTemplate(samtools.sort_command('{input}', o='{output}', threads=4))
+            samtools.execute_command(sort.fill(input='sample.sam', output='sample.bam'))
+
+            view = CommandTemplate(samtools.view_command('{input}', ['{regions*}'], b=True))
+            view.fill(input='sample.bam', regions=['chr1:1-1000', 'chr2:1-1000'])
+    """
+
+    __slots__ = ('cmd_list', 'fields', '_segments')
+
+    PLACEHOLDER_START = '{'
+    PLACEHOLDER_END = '}'
+    VARIADIC = '*'
+
+    #Kinds of segments of the compiled command
+    _FIXED = 0
+    _VALUE = 1
+    _VALUES = 2
+
+    def __init__(self, command):
+
+        cmd_list = command.cmd_list if hasattr(command, 'cmd_list') else [str(token) for token in command]
+
+        self.cmd_list = list(cmd_list)
+        self.fields = []
+        self._segments = []
+
+        fixed = []
+        for token in self.cmd_list:
+            placeholder = self._placeholder(token)
+
+            if placeholder is None:
+                fixed.append(token)
+                continue
+
+            if fixed:
+                self._segments.append((self._FIXED, fixed))
+                fixed = []
+
+            name, variadic = placeholder
+            self._segments.append((self._VALUES if variadic else self._VALUE, name))
+            self.fields.append(name)
+
+        if fixed:
+            self._segments.append((self._FIXED, fixed))
+
+    def __repr__(self):
+        return f"CommandTemplate({' '.join(self.cmd_list)})"
+
+    @classmethod
+    def _placeholder(cls, token):
+        #Returns (name, variadic) if the token is a placeholder, otherwise None
+
+        if not (token.startswith(cls.PLACEHOLDER_START) and token.endswith(cls.PLACEHOLDER_END)):
+            return None
+
+        name = token[1:-1]
+        variadic = name.endswith(cls.VARIADIC)
+
+        if variadic:
+            name = name[:-1]
+
+        return (name, variadic) if name.isidentifier() else None
+
+    def fill(self, **values):
+        """
+        Builds the command list with the provided values.
+
+        Args:
+            **values: The value of every placeholder. Variadic placeholders take an iterable.
+
+        Returns:
+            list: The command list, ready to be executed.
+        """
+
+        cmd_list = []
 
+        try:
+            for kind, payload in self._segments:
+                if kind == self._FIXED:
+                    cmd_list.extend(payload)
+                elif kind == self._VALUE:
+                    cmd_list.append(str(values[payload]))
+                else:
+                    cmd_list.extend([str(value) for value in values[payload]])
+        except KeyError as error:
+            raise ValueError(f'Missing value for the placeholder {error.args[0]}') from None
 
+        return cmd_list
@@ -0,0 +1,367 @@
+from .logger import set_logger
+from fractions import Fraction
+import numpy as np
+import json
+import os
+
+
+def read_chrom_sizes(path):
+    """
+    Reads the chromosome sizes of a .fai index or of a bedtools genome file (name and length columns).
+
+    Returns:
+        dict: An ordered dictionary of {chromosome : length}.
+    """
+
+    sizes = {}
+    with open(path) as handle:
+        for line in handle:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2 and not line.startswith('#'):
+                sizes[fields[0]] = int(fields[1])
+
+    return sizes
+
+
+class CoverageMatrix():
+    """
+    Per-base depth of a cohort, stored on disk as one memory-mapped samples x positions matrix.
+
+    Args:
+        directory (str): The directory of the matrix, written by create() or build().
+        mode (str, optional): 'r' to query the matrix, 'r+' to write sample rows. Defaults to 'r'.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The chromosomes are laid end to end along the positions axis, in the order of the chromosome sizes, and
+        every sample is one row of a compact unsigned integer dtype (uint16 by default, 2 bytes per base and
+        sample). Depths above the maximum of the dtype are stored as the maximum.
+
+        The matrix is never loaded as a whole: build() writes each sample row as its genomecov finishes, and the
+        queries read blocks of CHUNK_SIZE positions of every sample (one contiguous read per sample), so the
+        memory used is bounded by the block size whatever the number of samples and the genome size.
+
+        Example:
+            matrix = CoverageMatrix.build(bams, 'cohort_cov', 'ref.fa.fai')
+            #Positions where more than 10% of the samples are below 20x
+            low = matrix.positions_below(20, min_fraction=0.1)
+    """
+
+    MATRIX_FILE = 'matrix.bin'
+    METADATA_FILE = 'matrix.json'
+
+    KEY_SAMPLES = 'samples'
+    KEY_CHROMOSOMES = 'chromosomes'
+    KEY_DTYPE = 'dtype'
+    KEY_FAILED = 'failed'
+
+    CHR = 'chr'
+    START = 'start'
+    END = 'end'
+
+    DEFAULT_DTYPE = 'uint16'
+
+    #Positions per block read by the queries
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, directory, mode='r', verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+        self.directory = directory
+        self.mode = mode
+
+        with open(os.path.join(directory, self.METADATA_FILE)) as handle:
+            metadata = json.load(handle)
+
+        self.samples = metadata[self.KEY_SAMPLES]
+        self.chrom_sizes = {chrom: length for chrom, length in metadata[self.KEY_CHROMOSOMES]}
+        self.dtype = np.dtype(metadata[self.KEY_DTYPE])
+        self.failed = metadata.get(self.KEY_FAILED, [])
+
+        #Offset of every chromosome along the positions axis
+        self.offsets = {}
+        offset = 0
+        for chrom, length in self.chrom_sizes.items():
+            self.offsets[chrom] = offset
+            offset += length
+
+        self.n_positions = offset
+        self.matrix = np.memmap(os.path.join(directory, self.MATRIX_FILE), dtype=self.dtype, mode=mode,
+                                shape=(len(self.samples), self.n_positions))
+
+    def __repr__(self):
+        return f'CoverageMatrix(samples={len(self.samples)}, positions={self.n_positions}, dtype={self.dtype})'
+
+    @classmethod
+    def _write_metadata(cls, directory, samples, chrom_sizes, dtype, failed):
+
+        metadata = {
+            cls.KEY_SAMPLES: samples,
+            cls.KEY_CHROMOSOMES: [[chrom, int(length)] for chrom, length in chrom_sizes.items()],
+            cls.KEY_DTYPE: np.dtype(dtype).name,
+            cls.KEY_FAILED: failed,
+        }
+
+        tmp = os.path.join(directory, f'{cls.METADATA_FILE}.tmp')
+        with open(tmp, 'w') as handle:
+            json.dump(metadata, handle, indent=1)
+        os.replace(tmp, os.path.join(directory, cls.METADATA_FILE))
+
+    @classmethod
+    def create(cls, directory, samples, chrom_sizes, dtype=DEFAULT_DTYPE, verbosity=20):
+        """
+        Creates an empty (zero depth) matrix, opened for writing.
+
+        Args:
+            directory (str): The directory of the matrix, created if it does not exist.
+            samples (list): The sample names, one row each.
+            chrom_sizes (dict or str): A dictionary of {chromosome : length}, or a .fai or genome file.
+            dtype (str, optional): An unsigned integer dtype. Defaults to 'uint16'.
+            verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+        Returns:
+            CoverageMatrix: The matrix, in 'r+' mode.
+        """
+
+        if not np.issubdtype(np.dtype(dtype), np.unsignedinteger):
+            raise ValueError(f"Invalid dtype '{dtype}'. The matrix requires an unsigned integer dtype")
+
+        if len(set(samples)) != len(samples):
+            raise ValueError('Sample names must be unique')
+
+        chrom_sizes = read_chrom_sizes(chrom_sizes) if isinstance(chrom_sizes, str) else chrom_sizes
+
+        os.makedirs(directory, exist_ok=True)
+        cls._write_metadata(directory, list(samples), chrom_sizes, dtype, [])
+
+        #The file is sparse until the rows are written
+        n_positions = sum(chrom_sizes.values())
+        with open(os.path.join(directory, cls.MATRIX_FILE), 'wb') as handle:
+            handle.truncate(len(samples) * n_positions * np.dtype(dtype).itemsize)
+
+        return cls(directory, mode='r+', verbosity=verbosity)
+
+    @classmethod
+    def build(cls, bams, directory, chrom_sizes, names=None, dtype=DEFAULT_DTYPE, cores=None, max_samples=None,
+              fail_fast=False, verbosity=20):
+        """
+        Runs bedtools genomecov on every BAM in a worker pool and writes the depths into a new matrix.
+
+        Args:
+            bams (list): The BAM files, one sample each.
+            directory (str): The directory of the matrix.
+            chrom_sizes (dict or str): A dictionary of {chromosome : length}, or a .fai or genome file.
+            names (list, optional): The sample names. Defaults to the BAM file names without extension.
+            dtype (str, optional): An unsigned integer dtype. Defaults to 'uint16'.
+            cores (int, optional): Concurrent genomecov processes. Defaults to the size of the CPU affinity mask.
+            max_samples (int, optional): Maximum samples in memory at the same time. Defaults to None (one per core).
+            fail_fast (bool, optional): If True, the first failed sample cancels the others. Defaults to False.
+            verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+        Returns:
+            CoverageMatrix: The matrix, opened read-only. Failed samples keep a zero row and are listed in 'failed'.
+
+        Note:
+            Each worker holds the bedgraph (-bga) output and the arrays of one sample only, and drops them once its
+            row is written, so the memory used grows with the number of workers, not with the cohort size.
+        """
+        from .batch import BatchRunner
+
+        bams = list(bams)
+        names = list(names) if names else [os.path.basename(bam).rsplit('.', 1)[0] for bam in bams]
+
+        matrix = cls.create(directory, names, chrom_sizes, dtype, verbosity)
+
+        runner = BatchRunner(matrix._add_bam, cores=cores, threads=1, max_samples=max_samples,
+                             fail_fast=fail_fast, verbosity=verbosity)
+        results = runner.run(list(enumerate(bams)))
+
+        failed = [names[result[runner.KEY_SAMPLE][0]] for result in results
+                  if result[runner.KEY_ERROR] is not None or not result[runner.KEY_RESULT]]
+
+        if failed:
+            matrix.logger.error(f'{len(failed)} samples failed and have zero depth: {", ".join(failed)}')
+
+        matrix.flush()
+        cls._write_metadata(directory, names, matrix.chrom_sizes, dtype, failed)
+
+        return cls(directory, verbosity=verbosity)
+
+    def _add_bam(self, sample, threads):
+        #BatchRunner pipeline: (row, bam) -> True if the row was written
+        from .bedtools import BedTools
+
+        row, bam = sample
+
+        bedtools = BedTools(verbosity=self.verbosity, probe_version=False)
+        if not bedtools.genomecov(ibam=bam, bga=True):
+            self.logger.error(f'genomecov failed for {bam}; row {row} not written')
+            return False
+
+        coverage = bedtools.get_coverage(self.chrom_sizes)
+        if coverage is None:
+            return False
+
+        self.add_coverage(row, coverage)
+
+        return True
+
+    def add_coverage(self, sample, coverage):
+        """
+        Writes the depths of a sample.
+
+        Args:
+            sample (int or str): The row or the name of the sample.
+            coverage (GenomeCoverage): The coverage of the sample. Chromosomes missing from the matrix are ignored.
+        """
+
+        row = self._row(sample)
+        max_depth = np.iinfo(self.dtype).max
+
+        for chrom, array in coverage.arrays.items():
+            if chrom not in self.offsets:
+                self.logger.warning(f'Chromosome {chrom} is not in the matrix')
+                continue
+
+            length = min(len(array), self.chrom_sizes[chrom])
+            offset = self.offsets[chrom]
+
+            self.matrix[row, offset:offset + length] = np.minimum(array[:length], max_depth)
+
+    def flush(self):
+        if self.mode != 'r':
+            self.matrix.flush()
+
+    def _row(self, sample):
+        return sample if isinstance(sample, (int, np.integer)) else self.samples.index(sample)
+
+    def _rows(self, samples):
+        return slice(None) if samples is None else [self._row(sample) for sample in samples]
+
+    def _bounds(self, chrom, start, end):
+        #Positions axis span of a 0-based, half-open region
+
+        if chrom not in self.offsets:
+            raise ValueError(f"Chromosome '{chrom}' is not in the matrix")
+
+        length = self.chrom_sizes[chrom]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+
+        return self.offsets[chrom] + start, self.offsets[chrom] + max(end, start)
+
+    def region(self, chrom, start=0, end=None, samples=None):
+        """
+        Returns the depths of a region.
+
+        Args:
+            chrom (str): The chromosome.
+            start (int, optional): 0-based start. Defaults to 0.
+            end (int, optional): End (exclusive). Defaults to the chromosome end.
+            samples (list, optional): The names or rows of the samples. Defaults to None (every sample).
+
+        Returns:
+            array: A samples x positions array, read into memory.
+        """
+
+        first, last = self._bounds(chrom, start, end)
+
+        return np.array(self.matrix[self._rows(samples), first:last])
+
+    def chunks(self, chrom=None, start=0, end=None, samples=None, chunk_size=None):
+        """
+        Iterates over the matrix in blocks of positions.
+
+        Args:
+            chrom (str, optional): Restricts the blocks to a chromosome. Defaults to None (every chromosome).
+            start (int, optional): 0-based start within the chromosome. Defaults to 0.
+            end (int, optional): End (exclusive) within the chromosome. Defaults to the chromosome end.
+            samples (list, optional): The names or rows of the samples. Defaults to None (every sample).
+            chunk_size (int, optional): Positions per block. Defaults to CHUNK_SIZE.
+
+        Yields:
+            tuple: (chromosome, 0-based start of the block, samples x positions array).
+        """
+
+        chunk_size = chunk_size if chunk_size else self.CHUNK_SIZE
+        rows = self._rows(samples)
+
+        for name in ([chrom] if chrom else self.chrom_sizes):
+            first, last = self._bounds(name, start if chrom else 0, end if chrom else None)
+
+            for block_start in range(first, last, chunk_size):
+                block_end = min(block_start + chunk_size, last)
+                yield name, block_start - self.offsets[name], np.array(self.matrix[rows, block_start:block_end])
+
+    def fraction_below(self, threshold, chrom, start=0, end=None, samples=None):
+        """
+        Returns the fraction of samples with depth below a threshold at every position of a region.
+
+        Note:
+            The region is read in blocks of CHUNK_SIZE positions; only the result, one value per position, is
+            kept in memory.
+        """
+
+        n_samples = len(self.samples) if samples is None else len(samples)
+
+        fractions = [np.count_nonzero(block < threshold, axis=0) / n_samples
+                     for _, _, block in self.chunks(chrom, start, end, samples)]
+
+        return np.concatenate(fractions) if fractions else np.empty(0)
+
+    def positions_below(self, threshold, min_fraction=0.1, chrom=None, start=0, end=None, samples=None, min_length=1):
+        """
+        Finds the positions where more than a fraction of the samples have a depth below a threshold.
+
+        Args:
+            threshold (int): The depth threshold.
+            min_fraction (float, optional): Fraction of the samples that must be below the threshold. Defaults to 0.1.
+            chrom (str, optional): Restricts the query to a chromosome. Defaults to None (every chromosome).
+            start (int, optional): 0-based start within the chromosome. Defaults to 0.
+            end (int, optional): End (exclusive) within the chromosome. Defaults to the chromosome end.
+            samples (list, optional): The names or rows of the samples. Defaults to None (every sample).
+            min_length (int, optional): Minimum length of the reported intervals. Defaults to 1.
+
+        Returns:
+            DataFrame: BED intervals (chr, start, end, 0-based half-open), adjacent positions merged.
+        """
+        import pandas as pd
+        from .coverage import GenomeCoverage
+
+        n_samples = len(self.samples) if samples is None else len(samples)
+        #More than min_fraction of the samples, in exact arithmetic: 0.57 * 100 is 57.00000000000001 in floating point
+        min_samples = int(Fraction(str(min_fraction)) * n_samples) + 1
+
+        chroms, starts, ends = [], [], []
+
+        for name, block_start, block in self.chunks(chrom, start, end, samples):
+            below = np.count_nonzero(block < threshold, axis=0) >= min_samples
+            run_starts, run_ends = GenomeCoverage._runs(below)
+
+            for run_start, run_end in zip(run_starts + block_start, run_ends + block_start):
+                #Runs crossing the block boundary are joined
+                if chroms and chroms[-1] == name and ends[-1] == run_start:
+                    ends[-1] = int(run_end)
+                else:
+                    chroms.append(name)
+                    starts.append(int(run_start))
+                    ends.append(int(run_end))
+
+        intervals = pd.DataFrame({self.CHR: chroms, self.START: starts, self.END: ends})
+        intervals = intervals[intervals[self.END] - intervals[self.START] >= min_length].reset_index(drop=True)
+
+        self.logger.debug(f'{len(intervals)} intervals with more than {min_fraction:g} of the samples below {threshold}')
+
+        return intervals
+
+    def sample_coverage(self, sample):
+        """
+        Returns the depths of a sample as a GenomeCoverage, whose arrays are views of the memory map.
+        """
+        from .coverage import GenomeCoverage
+
+        row = self._row(sample)
+        arrays = {chrom: self.matrix[row, offset:offset + self.chrom_sizes[chrom]] for chrom, offset in self.offsets.items()}
+
+        return GenomeCoverage(arrays, self.verbosity)
@@ -0,0 +1,377 @@
+from .logger import set_logger
+import pandas as pd
+import numpy as np
+
+
+class GenomeCoverage():
+    """
+    Per-base coverage stored as one compact NumPy array per chromosome.
+
+    Args:
+        arrays (dict, optional): A dictionary of {chromosome : array} with the depth of every base (0-based).
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The arrays use the smallest unsigned integer dtype able to store the maximum depth (or float32
+        for scaled coverage), so a human genome at moderate depth needs ~3 GB instead of the tens of GB
+        of a per-base DataFrame. Intervals below or above a threshold are extracted with vectorized
+        run-length encoding, so adjacent positions are emitted as a single merged interval.
+    """
+
+    #Column names of the bedtools genomecov layouts (see BedTools)
+    CHR = 'chr'
+    START = 'start'
+    END = 'end'
+    POSITION = 'position'
+    COVERAGE = 'cov'
+
+    BED_COLUMNS = [CHR, START, END]
+
+    #Columns of the coverage summary
+    GENOME = 'genome'
+    LENGTH = 'length'
+    MEAN = 'mean'
+    MEDIAN = 'median'
+    MIN = 'min'
+    MAX = 'max'
+    PERCENTILE_TEMPLATE = 'p{:g}'
+    BREADTH_TEMPLATE = 'breadth_{:g}x'
+
+    DEFAULT_THRESHOLDS = [1, 10, 20, 30, 100]
+    DEFAULT_PERCENTILES = [5, 25, 75, 95]
+
+    UINT_DTYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+    FLOAT_DTYPE = np.float32
+
+    def __init__(self, arrays=None, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.arrays = arrays if arrays else {}
+
+    def __repr__(self):
+        return f'GenomeCoverage(chromosomes={len(self.arrays)}, bases={self.size})'
+
+    @property
+    def size(self):
+        return sum(len(array) for array in self.arrays.values())
+
+    @property
+    def chrom_sizes(self):
+        return {chrom: len(array) for chrom, array in self.arrays.items()}
+
+    @classmethod
+    def compact_dtype(cls, values):
+        """
+        Returns the smallest dtype able to store the provided depth values.
+
+        Args:
+            values (array): The depth values.
+
+        Returns:
+            dtype: An unsigned integer dtype, or float32 if the values are not integers.
+        """
+
+        if not np.issubdtype(values.dtype, np.integer):
+            return cls.FLOAT_DTYPE
+
+        max_value = int(values.max()) if len(values) else 0
+
+        for dtype in cls.UINT_DTYPES:
+            if max_value <= np.iinfo(dtype).max:
+                return dtype
+
+    @classmethod
+    def from_genomecov(cls, genome_cov, chrom_sizes=None, verbosity=20):
+        """
+        Builds the coverage arrays from the output of BedTools.genomecov.
+
+        Args:
+            genome_cov (DataFrame): The genome_cov attribute of BedTools, in per-base (-d) or bedgraph (-bg/-bga) layout.
+            chrom_sizes (dict, optional): A dictionary of {chromosome : length}. Required to extend the arrays to the
+                                          full chromosome length when the output omits the last positions (-bg).
+            verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+        Returns:
+            GenomeCoverage: The coverage object.
+
+        Raises:
+            ValueError: If genome_cov is in histogram layout, which has no positional information.
+        """
+
+        chrom_sizes = chrom_sizes if chrom_sizes else {}
+
+        if cls.POSITION in genome_cov.columns:
+            build = cls._from_positions
+        elif cls.START in genome_cov.columns:
+            build = cls._from_runs
+        else:
+            raise ValueError('Per-base (-d) or bedgraph (-bg/-bga) genomecov output is required to build the coverage')
+
+        dtype = cls.compact_dtype(genome_cov[cls.COVERAGE].to_numpy())
+
+        arrays = {}
+        for chrom, frame in genome_cov.groupby(cls.CHR, observed=True, sort=False):
+            arrays[chrom] = build(frame, chrom_sizes.get(chrom, 0), dtype)
+
+        for chrom, size in chrom_sizes.items():
+            if chrom not in arrays:
+                arrays[chrom] = np.zeros(size, dtype=dtype)
+
+        return cls(arrays, verbosity)
+
+    @classmethod
+    def _from_positions(cls, frame, size, dtype):
+        #Per-base layout: 1-based position and depth
+
+        positions = frame[cls.POSITION].to_numpy()
+        array = np.zeros(max(size, int(positions.max())), dtype=dtype)
+        array[positions - 1] = frame[cls.COVERAGE].to_numpy()
+
+        return array
+
+    @classmethod
+    def _from_runs(cls, frame, size, dtype):
+        #Bedgraph layout: sorted, non overlapping runs. Missing runs (-bg) are filled with zero depth
+
+        starts = frame[cls.START].to_numpy().astype(np.int64)
+        ends = frame[cls.END].to_numpy().astype(np.int64)
+        values = frame[cls.COVERAGE].to_numpy().astype(dtype)
+
+        gap_lengths = starts - np.concatenate(([0], ends[:-1]))
+
+        lengths = np.empty(2 * len(starts), dtype=np.int64)
+        lengths[0::2] = gap_lengths
+        lengths[1::2] = ends - starts
+
+        depths = np.zeros(2 * len(starts), dtype=dtype)
+        depths[1::2] = values
+
+        array = np.repeat(depths, lengths)
+
+        if size > len(array):
+            array = np.concatenate((array, np.zeros(size - len(array), dtype=dtype)))
+
+        return array
+
+    @staticmethod
+    def _runs(mask):
+        #Start and end (0-based, half-open) of the runs of True values of a boolean array
+
+        edges = np.diff(mask.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        return starts, ends
+
+    def intervals(self, threshold, below=True, min_length=1):
+        """
+        Extracts the merged intervals whose depth is below or above a threshold.
+
+        Args:
+            threshold (int or float): The depth threshold.
+            below (bool, optional): If True, selects positions with depth < threshold. Otherwise, selects positions
+                                    with depth >= threshold. Defaults to True.
+            min_length (int, optional): Minimum length of the reported intervals. Defaults to 1.
+
+        Returns:
+            DataFrame: BED intervals (chr, start, end), 0-based and half-open, one row per run of positions.
+        """
+
+        chroms, starts, ends = [], [], []
+
+        for chrom, array in self.arrays.items():
+            mask = array < threshold if below else array >= threshold
+            run_starts, run_ends = self._runs(mask)
+
+            if min_length > 1:
+                keep = (run_ends - run_starts) >= min_length
+                run_starts, run_ends = run_starts[keep], run_ends[keep]
+
+            chroms.append(np.full(len(run_starts), chrom, dtype=object))
+            starts.append(run_starts)
+            ends.append(run_ends)
+
+        if not chroms:
+            return pd.DataFrame(columns=self.BED_COLUMNS)
+
+        intervals = pd.DataFrame({
+            self.CHR: pd.Categorical(np.concatenate(chroms), categories=list(self.arrays)),
+            self.START: np.concatenate(starts),
+            self.END: np.concatenate(ends),
+        })
+
+        self.logger.debug(f'{len(intervals)} intervals {"below" if below else "above"} {threshold}')
+
+        return intervals
+
+    def intervals_below(self, threshold, min_length=1):
+        """
+        Extracts the merged intervals with depth < threshold. See intervals().
+        """
+        return self.intervals(threshold, below=True, min_length=min_length)
+
+    def intervals_above(self, threshold, min_length=1):
+        """
+        Extracts the merged intervals with depth >= threshold. See intervals().
+        """
+        return self.intervals(threshold, below=False, min_length=min_length)
+
+    def _region_values(self, chrom, starts, ends):
+        #Depths of the bases of merged regions, and the number of region bases beyond the array (zero depth)
+
+        array = self.arrays.get(chrom, np.empty(0, dtype=np.uint8))
+
+        values = np.concatenate([array[start:end] for start, end in zip(starts, ends)]) if len(starts) else array[:0]
+        missing = int((ends - starts).sum()) - len(values)
+
+        return values, missing
+
+    @staticmethod
+    def _histogram(values, zeros=0, weights=None):
+        #(depths, counts) of the values: bincount for integer depths, unique values for scaled coverage.
+        #weights are the number of bases of every value, e.g. the lengths of runs (see CoverageStore)
+
+        if np.issubdtype(values.dtype, np.integer):
+            #bincount does not take uint64, which cannot be cast safely to intp
+            counts = np.bincount(values.astype(np.int64, copy=False), weights=weights, minlength=1).astype(np.int64)
+            depths = np.arange(len(counts), dtype=np.int64)
+        else:
+            if weights is not None:
+                depths, inverse = np.unique(values, return_inverse=True)
+                counts = np.bincount(inverse, weights=weights, minlength=len(depths)).astype(np.int64)
+            else:
+                depths, counts = np.unique(values, return_counts=True)
+
+            #Only the observed depths have a bin: the bases without coverage data need the depth-0 one
+            if zeros and (not len(depths) or depths[0] != 0):
+                depths = np.concatenate(([0], depths))
+                counts = np.concatenate(([0], counts))
+
+        if zeros:
+            counts[np.searchsorted(depths, 0)] += zeros
+
+        return depths, counts
+
+    def histogram(self, regions=None):
+        """
+        Returns the depth histogram of every chromosome, optionally restricted to regions.
+
+        Args:
+            regions (IntervalSet, optional): Target regions, e.g. the capture design of an exome panel. Overlapping
+                                             regions are counted once, and region bases without coverage data count
+                                             as depth 0. Defaults to None (every base).
+
+        Returns:
+            dict: A dictionary of {chromosome : (depths, counts)}, with the sorted depths and their number of bases.
+        """
+
+        if regions is None:
+            return {chrom: self._histogram(array) for chrom, array in self.arrays.items()}
+
+        histograms = {}
+        for chrom, (starts, ends, _) in regions.merge().intervals.items():
+            values, missing = self._region_values(chrom, starts, ends)
+            histograms[chrom] = self._histogram(values, missing)
+
+        return histograms
+
+    @staticmethod
+    def _combine(histograms):
+        #Histogram of the union of several histograms
+
+        histograms = list(histograms)
+
+        if not histograms:
+            return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+        depths, inverse = np.unique(np.concatenate([depths for depths, _ in histograms]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([counts for _, counts in histograms])).astype(np.int64)
+
+        return depths, counts
+
+    @classmethod
+    def _summary_row(cls, chrom, depths, counts, thresholds, percentiles):
+        #Statistics of one histogram. Percentiles follow the inverted CDF: the lowest depth reaching the fraction
+
+        total = int(counts.sum())
+        row = {cls.CHR: chrom, cls.LENGTH: total}
+
+        if not total:
+            row.update({cls.MEAN: np.nan, cls.MEDIAN: np.nan, cls.MIN: np.nan, cls.MAX: np.nan})
+            row.update({cls.PERCENTILE_TEMPLATE.format(q): np.nan for q in percentiles})
+            row.update({cls.BREADTH_TEMPLATE.format(t): 0.0 for t in thresholds})
+            return row
+
+        cumulative = np.cumsum(counts)
+        present = np.flatnonzero(counts)
+
+        def percentile(q):
+            rank = max(int(np.ceil(q / 100 * total)), 1)
+            return depths[np.searchsorted(cumulative, rank)]
+
+        row[cls.MEAN] = float(np.dot(depths.astype(np.float64), counts)) / total
+        row[cls.MEDIAN] = percentile(50)
+        row[cls.MIN] = depths[present[0]]
+        row[cls.MAX] = depths[present[-1]]
+
+        for q in percentiles:
+            row[cls.PERCENTILE_TEMPLATE.format(q)] = percentile(q)
+
+        #Bases with depth >= t: all minus the cumulative count of the depths below t
+        below = np.searchsorted(depths, thresholds, side='left')
+        for t, idx in zip(thresholds, below):
+            row[cls.BREADTH_TEMPLATE.format(t)] = (total - (int(cumulative[idx - 1]) if idx else 0)) / total
+
+        return row
+
+    def summary(self, thresholds=DEFAULT_THRESHOLDS, percentiles=DEFAULT_PERCENTILES, regions=None):
+        """
+        Computes the depth statistics of every chromosome and of the whole genome (or target) in one pass.
+
+        Args:
+            thresholds (list, optional): Depths whose breadth (fraction of bases with depth >= threshold) is reported.
+                                         Defaults to DEFAULT_THRESHOLDS (1, 10, 20, 30 and 100x).
+            percentiles (list, optional): Percentiles of the depth reported besides the median. Defaults to DEFAULT_PERCENTILES.
+            regions (IntervalSet, optional): Target regions the statistics are restricted to. Defaults to None (every base).
+
+        Returns:
+            DataFrame: One row per chromosome plus a 'genome' row, with the bases (length), mean, median, minimum,
+                       maximum, percentiles (p5, p95...) and breadth (breadth_1x, breadth_30x...) columns.
+
+        Note:
+            Every array is read once to build its depth histogram (np.bincount); all the statistics, for any number of
+            thresholds and percentiles, are then computed from the histograms, whose size is the maximum depth rather
+            than the number of bases. The genome row combines the histograms, so it is exact too.
+        """
+
+        histograms = self.histogram(regions)
+
+        self.logger.debug(f'Coverage summary of {len(histograms)} chromosomes')
+
+        return self._summary_frame(histograms, thresholds, percentiles)
+
+    @classmethod
+    def _summary_frame(cls, histograms, thresholds, percentiles):
+        #Summary DataFrame of {chromosome : (depths, counts)} histograms, plus the genome row
+
+        rows = [cls._summary_row(chrom, depths, counts, thresholds, percentiles) for chrom, (depths, counts) in histograms.items()]
+        rows.append(cls._summary_row(cls.GENOME, *cls._combine(histograms.values()), thresholds, percentiles))
+
+        columns = [cls.CHR, cls.LENGTH, cls.MEAN, cls.MEDIAN, cls.MIN, cls.MAX]
+        columns += [cls.PERCENTILE_TEMPLATE.format(q) for q in percentiles]
+        columns += [cls.BREADTH_TEMPLATE.format(t) for t in thresholds]
+
+        return pd.DataFrame(rows, columns=columns)
+
+    @classmethod
+    def to_bed(cls, intervals, output):
+        """
+        Writes intervals to a BED file.
+
+        Args:
+            intervals (DataFrame): Intervals returned by intervals(), intervals_below() or intervals_above().
+            output (str): The BED file path.
+        """
+
+        intervals[cls.BED_COLUMNS].to_csv(output, sep='\t', header=False, index=False)
@@ -0,0 +1,396 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .batch import available_cores
+from .logger import set_logger
+from . import cancel
+import time
+import os
+
+
+class Task():
+    """
+    A node of a TaskGraph: one wrapper call with its input and output files and the resources it needs.
+
+    Args:
+        name (str): Unique name of the task.
+        function (callable): The call, usually a wrapper method (e.g. samtools.sort) or a CliPipeline.run.
+        args (tuple): Positional arguments of the call.
+        kwargs (dict): Keyword arguments of the call.
+        inputs (list): Files read by the task. A task depends on the tasks that write its inputs.
+        outputs (list): Files written by the task.
+        threads (int): Cores used by the task.
+        memory (int): Peak memory of the task in bytes.
+        cost (float): Estimated duration, in any unit, used to compute the critical path.
+        after (list): Names of other tasks that must finish first, for dependencies not expressed by files.
+    """
+
+    def __init__(self, name, function, args=(), kwargs=None, inputs=(), outputs=(), threads=1, memory=0, cost=1.0, after=()):
+
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs) if kwargs else {}
+        self.inputs = [os.path.abspath(path) for path in inputs]
+        self.outputs = [os.path.abspath(path) for path in outputs]
+        self.threads = max(int(threads), 1)
+        self.memory = memory
+        self.cost = cost
+        self.after = list(after)
+
+        self.dependencies = set()
+        self.dependents = set()
+        self.priority = cost
+
+    def __repr__(self):
+        return f'Task({self.name}, threads={self.threads}, priority={self.priority})'
+
+    def __call__(self):
+        return self.function(*self.args, **self.kwargs)
+
+
+class TaskGraph():
+    """
+    Runs wrapper calls connected by their input and output files as a dependency graph, in parallel.
+
+    Args:
+        cores (int, optional): The core budget. Defaults to the size of the CPU affinity mask.
+        memory (int, optional): The memory budget in bytes. Defaults to None (no limit).
+        fail_fast (bool, optional): If True, the first failure kills the running tasks and cancels the rest of
+                                    the graph. Defaults to False.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        A task becomes ready when every task that writes one of its inputs has finished. Ready tasks are started
+        while their threads and memory fit in the free budget, highest priority first: the priority of a task is
+        the length of the longest chain of costs from it to the end of the graph (critical path), so long chains,
+        e.g. mapping, start before short side branches such as indexing or genomecov. Smaller tasks fill the cores
+        left free by a large one.
+
+        Independent steps overlap: one sample is indexed while another is mapping, and genomecov runs beside the
+        variant calling. A task bigger than the whole budget runs alone. When a task fails (it raises, returns a
+        non-zero exit status or does not write its outputs), its dependents are skipped and the rest of the graph
+        goes on. With fail_fast, the tools of the running tasks are killed with their process groups, so their
+        cores are freed at once, and the tasks not finished are reported as 'cancelled'. cancel() does the
+        same from another thread.
+
+        Example:
+            graph = TaskGraph(cores=16, memory=64 * 2**30)
+            for sample in samples:
+                sam, bam = f'{sample}.sam', f'{sample}.sorted.bam'
+                graph.add(f'mem:{sample}', bwa.mem, f'{sample}.fq', sam, inputs=[f'{sample}.fq'], outputs=[sam],
+                          threads=8, memory=6 * 2**30, cost=10, threads_kwarg=True)
+                graph.add(f'sort:{sample}', samtools.sort, sam, o=bam, inputs=[sam], outputs=[bam], threads=4, cost=3)
+                graph.add(f'index:{sample}', samtools.index, bam, inputs=[bam], outputs=[f'{bam}.bai'])
+            graph.run()
+    """
+
+    KEY_TASK = 'task'
+    KEY_STATUS = 'status'
+    KEY_RESULT = 'result'
+    KEY_ERROR = 'error'
+    KEY_STARTED = 'started'
+    KEY_FINISHED = 'finished'
+
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, cores=None, memory=None, fail_fast=False, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+        self.cores = cores if cores else available_cores()
+        self.memory = memory
+        self.fail_fast = fail_fast
+
+        self.group = None
+        self.tasks = {}
+        self.results = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, name, function, *args, inputs=(), outputs=(), threads=1, memory=0, cost=1.0, after=(), threads_kwarg=False, **kwargs):
+        """
+        Adds a task to the graph.
+
+        Args:
+            name (str): Unique name of the task.
+            function (callable): The call, e.g. a wrapper method.
+            *args: Positional arguments of the call.
+            inputs (list, optional): Files read by the task.
+            outputs (list, optional): Files written by the task. Every file can be written by one task only.
+            threads (int, optional): Cores used by the task. Defaults to 1.
+            memory (int, optional): Peak memory of the task in bytes. Defaults to 0.
+            cost (float, optional): Estimated duration, used for the critical path. Defaults to 1.0.
+            after (list, optional): Names of tasks that must finish first, besides the file dependencies.
+            threads_kwarg (bool, optional): If True, threads is passed to the call as the 'threads' keyword argument,
+                                            which the wrappers translate into the threads flag of the tool. Defaults to False.
+            **kwargs: Keyword arguments of the call.
+
+        Returns:
+            Task: The new task.
+        """
+
+        if name in self.tasks:
+            raise ValueError(f'Duplicated task name: {name}')
+
+        if threads_kwarg:
+            kwargs['threads'] = threads
+
+        task = Task(name, function, args, kwargs, inputs, outputs, threads, memory, cost, after)
+        self.tasks[name] = task
+
+        return task
+
+    def _link(self):
+        #Builds the dependencies from the files and the explicit 'after' names, and the critical-path priorities
+
+        producers = {}
+        for task in self.tasks.values():
+            task.dependencies = set()
+            task.dependents = set()
+            for output in task.outputs:
+                if output in producers:
+                    raise ValueError(f'{output} is written by {producers[output]} and {task.name}')
+                producers[output] = task.name
+
+        for task in self.tasks.values():
+            names = [producers[path] for path in task.inputs if path in producers] + task.after
+            for name in names:
+                if name not in self.tasks:
+                    raise ValueError(f'Unknown task {name} required by {task.name}')
+                if name != task.name:
+                    task.dependencies.add(name)
+                    self.tasks[name].dependents.add(task.name)
+
+        order = self.topological_order()
+
+        for name in reversed(order):
+            task = self.tasks[name]
+            task.priority = task.cost + max((self.tasks[dependent].priority for dependent in task.dependents), default=0)
+
+    def topological_order(self):
+        """
+        Returns the task names in an order where every task comes after its dependencies.
+
+        Raises:
+            ValueError: If the dependencies contain a cycle.
+        """
+
+        pending = {name: len(task.dependencies) for name, task in self.tasks.items()}
+        ready = [name for name, count in pending.items() if not count]
+        order = []
+
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for dependent in self.tasks[name].dependents:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    ready.append(dependent)
+
+        if len(order) != len(self.tasks):
+            cycle = sorted(name for name, count in pending.items() if count)
+            raise ValueError(f'The task dependencies contain a cycle: {", ".join(cycle)}')
+
+        return order
+
+    @property
+    def critical_path(self):
+        """
+        Returns the chain of task names with the highest total cost, the lower bound of the makespan.
+        """
+
+        self._link()
+
+        if not self.tasks:
+            return []
+
+        path = [max((task for task in self.tasks.values() if not task.dependencies), key=lambda task: task.priority).name]
+        while self.tasks[path[-1]].dependents:
+            path.append(max(self.tasks[path[-1]].dependents, key=lambda name: self.tasks[name].priority))
+
+        return path
+
+    def _fits(self, task, free_cores, free_memory, running):
+        #A task bigger than the whole budget is started alone, so the graph can not block
+
+        if not running:
+            return True
+
+        memory_fits = self.memory is None or task.memory <= free_memory
+
+        return min(task.threads, self.cores) <= free_cores and memory_fits
+
+    def _failed(self, task, result):
+        #Failure of a call that did not raise: non-zero exit status, failed pipeline stage or missing outputs
+
+        if result is False:
+            return 'returned False'
+
+        returncode = getattr(result, 'returncode', None)
+        if returncode:
+            return f'exit status {returncode}'
+
+        if isinstance(result, list) and any(isinstance(item, dict) and item.get('returncode') for item in result):
+            return 'a pipeline stage failed'
+
+        missing = [path for path in task.outputs if not os.path.exists(path)]
+        if missing:
+            return f'missing outputs: {", ".join(missing)}'
+
+        return None
+
+    def _run_task(self, task):
+
+        started = time.time()
+        status = self.DONE
+
+        #Own group of the task, to tell its failures from the kills of a cancelled graph
+        task_group = cancel.CancelGroup(fail_fast=False, parent=self.group)
+
+        try:
+            with task_group:
+                task_group.check()
+                result = task()
+            error = self._failed(task, result)
+        except cancel.CommandCancelled as exception:
+            result, error, status = None, exception, self.CANCELLED
+        except Exception as exception:
+            result, error = None, exception
+        finally:
+            task_group.close()
+
+        if error and status == self.DONE:
+            status = self.CANCELLED if task_group.cancelled and not task_group.failed else self.FAILED
+
+        return {
+            self.KEY_TASK: task.name,
+            self.KEY_STATUS: status,
+            self.KEY_RESULT: result,
+            self.KEY_ERROR: error,
+            self.KEY_STARTED: started,
+            self.KEY_FINISHED: time.time(),
+        }
+
+    def _not_run(self, name, status, error):
+        return {self.KEY_TASK: name, self.KEY_STATUS: status, self.KEY_RESULT: None,
+                self.KEY_ERROR: error, self.KEY_STARTED: None, self.KEY_FINISHED: None}
+
+    def _skip(self, name):
+        #Marks every task that depends on a failed task as skipped
+
+        pending = list(self.tasks[name].dependents)
+        while pending:
+            dependent = pending.pop()
+            if dependent not in self.results:
+                self.results[dependent] = self._not_run(dependent, self.SKIPPED, f'{name} failed')
+                pending.extend(self.tasks[dependent].dependents)
+
+    def cancel(self, reason='cancelled'):
+        """
+        Kills the running tasks of the graph and cancels the tasks not started.
+        """
+
+        if self.group:
+            self.group.cancel(reason)
+
+    def run(self):
+        """
+        Runs every task of the graph.
+
+        Returns:
+            dict: A dictionary of {task name : {'task', 'status', 'result', 'error', 'started', 'finished'}}, where
+                  status is 'done', 'failed', 'skipped' or 'cancelled'.
+        """
+
+        self._link()
+        self.results = {}
+        self.group = cancel.CancelGroup(self.fail_fast)
+
+        try:
+            self._run_graph()
+        finally:
+            self.group.close()
+
+        #Tasks never started because the graph was cancelled
+        for name in self.tasks:
+            if name not in self.results:
+                self.results[name] = self._not_run(name, self.CANCELLED, self.group.reason)
+
+        return self.results
+
+    def _run_graph(self):
+
+        remaining = {name: len(task.dependencies) for name, task in self.tasks.items()}
+        ready = [name for name, count in remaining.items() if not count]
+
+        self.logger.info(f'Running {len(self.tasks)} tasks with {self.cores} cores'
+                         f'{f" and {self.memory / 2**30:.1f} GiB" if self.memory else ""}; '
+                         f'critical path: {" -> ".join(self.critical_path)}')
+
+        with ThreadPoolExecutor(max_workers=self.cores) as executor:
+            try:
+                self._schedule(executor, ready, remaining)
+            except BaseException:
+                #e.g. KeyboardInterrupt: the running tools are killed before the worker threads are joined
+                self.group.cancel('interrupted')
+                raise
+
+    def _schedule(self, executor, ready, remaining):
+
+        free_cores = self.cores
+        free_memory = self.memory if self.memory is not None else 0
+        running = {}
+
+        while (ready and not self.group.cancelled) or running:
+
+            #Highest priority first; tasks that do not fit are left for later, smaller ones may fill the gap
+            ready.sort(key=lambda name: self.tasks[name].priority, reverse=True)
+
+            for name in list(ready):
+                task = self.tasks[name]
+                if self.group.cancelled:
+                    break
+                if not self._fits(task, free_cores, free_memory, running):
+                    continue
+
+                ready.remove(name)
+                free_cores -= min(task.threads, self.cores)
+                free_memory -= task.memory
+
+                self.logger.info(f'Starting {name} ({task.threads} threads)')
+                running[executor.submit(self._run_task, task)] = task
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                task = running.pop(future)
+                free_cores += min(task.threads, self.cores)
+                free_memory += task.memory
+
+                result = future.result()
+                self.results[task.name] = result
+
+                if result[self.KEY_STATUS] == self.CANCELLED:
+                    continue
+
+                if result[self.KEY_STATUS] == self.FAILED:
+                    self.logger.error(f'Task {task.name} failed: {result[self.KEY_ERROR]}')
+                    self._skip(task.name)
+                    if self.fail_fast:
+                        self.group.cancel(f'{task.name} failed')
+                    continue
+
+                for dependent in task.dependents:
+                    remaining[dependent] -= 1
+                    if not remaining[dependent] and dependent not in self.results:
+                        ready.append(dependent)
+
+    @property
+    def failed(self):
+        return [result for result in self.results.values() if result[self.KEY_STATUS] != self.DONE]
@@ -0,0 +1,282 @@
+from .logger import set_logger
+from . import regions
+import numpy as np
+import mmap
+import os
+
+
+class IndexedFasta():
+    """
+    Read-only memory map of a FASTA file, addressed through its .fai index.
+
+    Args:
+        path (str): The FASTA file. It must not be compressed.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The file is mapped once and the sequences are exposed as NumPy views of the map, so nothing is copied or
+        parsed until a region is used. The pages live in the page cache and are shared by every process that maps
+        the same file: build one object before forking a process pool and every worker masks its own sample from
+        the same physical memory. The object can also be pickled; the map is opened again in the receiving process.
+
+        If the .fai file does not exist, the index is computed in memory, as samtools faidx would write it.
+    """
+
+    #Columns of the interval tables (see GenomeCoverage.intervals)
+    CHR = 'chr'
+    START = 'start'
+    END = 'end'
+
+    NEWLINE = ord('\n')
+    CARRIAGE_RETURN = ord('\r')
+    HEADER = b'>'
+    MASK_CHAR = 'N'
+    LOWERCASE_BIT = 0x20
+    UPPER_A = ord('A')
+    UPPER_Z = ord('Z')
+
+    #Lines masked per block when writing
+    BLOCK_LINES = 1 << 16
+
+    def __init__(self, path, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+        self.path = path
+
+        self._open()
+
+    def _open(self):
+
+        with open(self.path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.data = np.frombuffer(self._map, dtype=np.uint8)
+
+        fai = f'{self.path}{regions.FAI_EXT}'
+        self.index = self.read_fai(fai) if os.path.exists(fai) else self.build_index()
+
+    def __getstate__(self):
+        return {'path': self.path, 'verbosity': self.verbosity}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['verbosity'])
+
+    def __repr__(self):
+        return f'IndexedFasta({self.path}, contigs={len(self.index)})'
+
+    def __contains__(self, contig):
+        return contig in self.index
+
+    @staticmethod
+    def read_fai(fai):
+        """
+        Reads a .fai file.
+
+        Returns:
+            dict: An ordered dictionary of {contig : (length, offset, line bases, line width)}.
+        """
+
+        index = {}
+        with open(fai) as handle:
+            for line in handle:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) >= 5:
+                    index[fields[0]] = tuple(int(field) for field in fields[1:5])
+
+        return index
+
+    def build_index(self):
+        #Same fields as samtools faidx; every line of a sequence but the last must have the same length
+
+        index = {}
+        data = self._map
+        position = data.find(self.HEADER)
+
+        while position != -1:
+            header_end = data.find(b'\n', position)
+            if header_end == -1:
+                break
+
+            fields = data[position + 1:header_end].split()
+            offset = header_end + 1
+
+            next_header = data.find(b'\n' + self.HEADER, header_end)
+            end = next_header + 1 if next_header != -1 else len(data)
+
+            if not fields:
+                self.logger.warning(f'Sequence without name at byte {position}, not indexed')
+            else:
+                #Measured in place: the line layout comes from the first line and the length follows from it
+                first_newline = data.find(b'\n', offset, end)
+                line_end = first_newline + 1 if first_newline != -1 else end
+                line_width = line_end - offset
+                line_bases = len(data[offset:line_end].rstrip(b'\r\n'))
+
+                sequence_end = end
+                while sequence_end > offset and data[sequence_end - 1] in (self.NEWLINE, self.CARRIAGE_RETURN):
+                    sequence_end -= 1
+
+                full_lines, last_line = divmod(sequence_end - offset, line_width) if line_width else (0, 0)
+                length = full_lines * line_bases + last_line
+
+                index[fields[0].decode()] = (length, offset, line_bases, line_width)
+
+            position = next_header + 1 if next_header != -1 else -1
+
+        return index
+
+    @property
+    def contig_sizes(self):
+        return {contig: fields[0] for contig, fields in self.index.items()}
+
+    def _raw_offset(self, contig, positions):
+        #File offsets of 0-based positions of a contig, skipping the line terminators
+
+        length, offset, line_bases, line_width = self.index[contig]
+
+        positions = np.asarray(positions, dtype=np.int64)
+
+        return offset + positions + (positions // line_bases) * (line_width - line_bases)
+
+    def raw(self, contig):
+        """
+        Returns the bytes of a sequence as stored in the file, line terminators included.
+
+        Returns:
+            array: A read-only uint8 view of the map.
+        """
+
+        length, offset, line_bases, line_width = self.index[contig]
+
+        if not length:
+            return self.data[offset:offset]
+
+        end = int(self._raw_offset(contig, length - 1)) + 1
+
+        #The terminator of the last line, if any, belongs to the sequence
+        while end < len(self.data) and self.data[end] in (self.CARRIAGE_RETURN, self.NEWLINE):
+            end += 1
+
+        return self.data[offset:end]
+
+    def header(self, contig):
+        #The header line of a sequence, with its terminator
+
+        offset = self.index[contig][1]
+
+        #The header starts a line: a '>' inside the description is not its start
+        start = self._map.rfind(b'\n' + self.HEADER, 0, offset)
+
+        return self._map[start + 1 if start != -1 else 0:offset]
+
+    def mask(self, intervals, output, mask_char=MASK_CHAR, soft=False):
+        """
+        Writes a copy of the FASTA with the bases of the intervals masked.
+
+        Args:
+            intervals (DataFrame or dict): The regions to mask, 0-based and half-open: a DataFrame with chr, start and
+                                           end columns (e.g. GenomeCoverage.intervals_below) or a dictionary of
+                                           {contig : (starts, ends)}.
+            output (str or file): The output FASTA, as a path or a binary file object.
+            mask_char (str, optional): The character written over the masked bases. Defaults to 'N'.
+            soft (bool, optional): If True, masked bases are written in lowercase instead (bedtools maskfasta -soft).
+                                   Defaults to False.
+
+        Note:
+            Equivalent to bedtools maskfasta, without writing the intervals to a BED file and without parsing the
+            FASTA: every block of lines is copied from the map, the intervals are turned into a boolean mask
+            with a cumulative sum of their starts and ends, and the masked bytes are replaced in one vectorized
+            operation. Line layout and headers are kept as they are, and the output is written block by block,
+            so the memory used does not depend on the size of the reference.
+        """
+
+        intervals = self._intervals_by_contig(intervals)
+
+        unknown = set(intervals) - set(self.index)
+        if unknown:
+            self.logger.warning(f'Contigs not in the reference, not masked: {", ".join(sorted(unknown))}')
+
+        handle = open(output, 'wb') if isinstance(output, str) else output
+
+        try:
+            for contig in self.index:
+                handle.write(self.header(contig))
+
+                starts, ends = intervals.get(contig, (None, None))
+
+                if starts is None or not len(starts):
+                    handle.write(self.raw(contig))
+                    continue
+
+                self._write_masked(handle, contig, starts, ends, ord(mask_char), soft)
+        finally:
+            if isinstance(output, str):
+                handle.close()
+
+    def _intervals_by_contig(self, intervals):
+
+        if isinstance(intervals, dict):
+            return {contig: (np.asarray(starts), np.asarray(ends)) for contig, (starts, ends) in intervals.items()}
+
+        by_contig = {}
+        for contig, group in intervals.groupby(self.CHR, observed=True, sort=False):
+            by_contig[str(contig)] = (group[self.START].to_numpy(), group[self.END].to_numpy())
+
+        return by_contig
+
+    def _write_masked(self, handle, contig, starts, ends, mask_byte, soft):
+
+        length, offset, line_bases, line_width = self.index[contig]
+
+        starts = np.clip(starts, 0, length)
+        ends = np.clip(ends, 0, length)
+        keep = ends > starts
+        starts, ends = starts[keep], ends[keep]
+
+        if not len(starts):
+            handle.write(self.raw(contig))
+            return
+
+        #Raw offsets relative to the sequence start; the end of an interval is the offset after its last base
+        raw_starts = self._raw_offset(contig, starts) - offset
+        raw_ends = self._raw_offset(contig, ends - 1) - offset + 1
+
+        raw = self.raw(contig)
+        block_size = self.BLOCK_LINES * line_width
+
+        for block_start in range(0, len(raw), block_size):
+            block_end = min(block_start + block_size, len(raw))
+
+            selected = (raw_ends > block_start) & (raw_starts < block_end)
+
+            block = raw[block_start:block_end]
+
+            if not selected.any():
+                handle.write(block)
+                continue
+
+            delta = np.zeros(block_end - block_start + 1, dtype=np.int32)
+            np.add.at(delta, np.maximum(raw_starts[selected], block_start) - block_start, 1)
+            np.add.at(delta, np.minimum(raw_ends[selected], block_end) - block_start, -1)
+
+            masked = np.cumsum(delta[:-1]) > 0
+            masked &= (block != self.NEWLINE) & (block != self.CARRIAGE_RETURN)
+
+            block = block.copy()
+            if soft:
+                masked &= (block >= self.UPPER_A) & (block <= self.UPPER_Z)
+                block[masked] |= self.LOWERCASE_BIT
+            else:
+                block[masked] = mask_byte
+
+            handle.write(block)
+
+    def close(self):
+
+        self.data = None
+        try:
+            self._map.close()
+        except BufferError:
+            #A view of the map is still alive; it is released when the view is collected
+            pass
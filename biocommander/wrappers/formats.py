@@ -0,0 +1,126 @@
+import os
+
+
+class OutputPolicy():
+    """
+    Chooses the output format, compression level and compression threads of the Samtools and Bcftools wrappers.
+
+    Args:
+        intermediate_variants (str, optional): Format of the intermediate variant outputs. Defaults to 'bcf'.
+        final_variants (str, optional): Format of the final variant outputs. Defaults to 'vcf.gz'.
+        intermediate_alignments (str, optional): Format of the intermediate alignment outputs. Defaults to 'bam'.
+        final_alignments (str, optional): Format of the final alignment outputs. Defaults to 'bam'.
+        intermediate_level (int, optional): Compression level of the intermediate outputs. Defaults to 0 (uncompressed).
+        final_level (int, optional): Compression level of the final outputs. Defaults to None (software default).
+        threads (int, optional): Compression threads, used when the wrapper or the call does not set threads.
+        index (bool, optional): If True, final outputs are indexed after they are written, and the inputs of the
+                                steps that need an index (region queries, consensus) are indexed when the index is
+                                missing or older. Defaults to True.
+
+    Note:
+        An output file whose extension names a format (.bcf, .vcf.gz, .vcf, .bam, .cram, .sam) is written in that
+        format; the policy gives the format of the outputs without a known extension and of the outputs streamed
+        to stdout, and the compression level of all of them. Use path() to name the outputs after the policy.
+
+        Level 0 keeps the BGZF blocks, so the intermediates can still be indexed, but skips the deflate work in
+        the writer and the inflate work in the next reader. Uncompressed outputs streamed to a pipe are written
+        as raw BCF (bcftools -Ou), which is not indexable but needs no BGZF framing at all.
+
+        Example:
+            policy = OutputPolicy()   #uncompressed BCF for intermediates, bgzipped VCF for finals
+            bcftools = Bcftools(output_policy=policy)
+            bcftools.call('sample.pileup.bcf', policy.path('sample.calls', policy.VARIANTS))
+            bcftools.filter('sample.calls.bcf', policy.path('sample', policy.VARIANTS, final=True), final=True)
+    """
+
+    BCF = 'bcf'
+    VCF = 'vcf'
+    VCF_GZ = 'vcf.gz'
+    BAM = 'bam'
+    CRAM = 'cram'
+    SAM = 'sam'
+
+    VARIANTS = 'variants'
+    ALIGNMENTS = 'alignments'
+
+    #Longest extensions first, so .vcf.gz is not taken for .gz
+    EXTENSIONS = [
+        ('.vcf.gz', VCF_GZ), ('.vcf.bgz', VCF_GZ), ('.bcf', BCF), ('.vcf', VCF),
+        ('.bam', BAM), ('.cram', CRAM), ('.sam', SAM),
+    ]
+
+    FORMATS = {VARIANTS: [BCF, VCF_GZ, VCF], ALIGNMENTS: [BAM, CRAM, SAM]}
+
+    #BGZF formats, the ones that can be indexed
+    COMPRESSED = [BCF, VCF_GZ, BAM, CRAM]
+
+    STDOUT = '-'
+
+    def __init__(self, intermediate_variants=BCF, final_variants=VCF_GZ, intermediate_alignments=BAM, final_alignments=BAM,
+                 intermediate_level=0, final_level=None, threads=None, index=True):
+
+        self.formats = {
+            (self.VARIANTS, False): intermediate_variants,
+            (self.VARIANTS, True): final_variants,
+            (self.ALIGNMENTS, False): intermediate_alignments,
+            (self.ALIGNMENTS, True): final_alignments,
+        }
+
+        for (kind, _), format in self.formats.items():
+            if format not in self.FORMATS[kind]:
+                raise ValueError(f"Invalid {kind} format '{format}'. Valid formats are {', '.join(self.FORMATS[kind])}")
+
+        self.intermediate_level = intermediate_level
+        self.final_level = final_level
+        self.threads = threads
+        self.index = index
+
+    @classmethod
+    def path_format(cls, path):
+        #Format named by the extension of a file, None if it names none
+
+        if not path or path == cls.STDOUT:
+            return None
+
+        for extension, format in cls.EXTENSIONS:
+            if path.endswith(extension):
+                return format
+
+        return None
+
+    @staticmethod
+    def is_file(output):
+        return bool(output) and output != OutputPolicy.STDOUT
+
+    def output_format(self, output, kind, final=False):
+        """
+        Returns the format of an output: the one of its extension, if it names a format of the kind, or the one of the policy.
+
+        Args:
+            output (str): The output file, '' or '-' for stdout.
+            kind (str): 'variants' or 'alignments'.
+            final (bool, optional): True for final outputs. Defaults to False.
+        """
+
+        format = self.path_format(output)
+
+        return format if format in self.FORMATS[kind] else self.formats[(kind, final)]
+
+    def level(self, final=False):
+        return self.final_level if final else self.intermediate_level
+
+    def path(self, stem, kind, final=False):
+        """
+        Returns the output file name of a stem, with the extension of the format of the policy, e.g. sample.calls.bcf.
+        """
+
+        return f'{stem}.{self.formats[(kind, final)]}'
+
+    def should_index(self, output, kind, final=False):
+        #Final outputs written to a file in a BGZF format
+
+        return self.index and final and self.is_file(output) and self.output_format(output, kind, final) in self.COMPRESSED
+
+    @classmethod
+    def indexable(cls, path):
+        return cls.path_format(path) in cls.COMPRESSED and os.path.isfile(path)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+
+#Fingerprint modes
+
+STAT = 'stat'
+HASH = 'hash'
+
+MODES = [STAT, HASH]
+
+MANIFEST_TEMPLATE = '.{name}.biocommander.json'
+
+HASH_BLOCK_SIZE = 1 << 20
+
+KEY_CMD = 'cmd'
+KEY_VERSION = 'version'
+KEY_INPUTS = 'inputs'
+KEY_OUTPUTS = 'outputs'
+KEY_FINGERPRINT = 'fingerprint'
+
+
+def manifest_path(output):
+    """
+    Returns the path of the manifest of an output file: a hidden file in the same directory.
+
+    Args:
+        output (str): The output file path.
+
+    Returns:
+        str: The manifest path.
+    """
+
+    directory, name = os.path.split(os.path.abspath(output))
+
+    return os.path.join(directory, MANIFEST_TEMPLATE.format(name=name))
+
+
+def file_identity(path, mode=STAT):
+    """
+    Returns the identity of a file.
+
+    Args:
+        path (str): The file path.
+        mode (str, optional): 'stat' for size and modification time (cheap), or 'hash' for the SHA-256 of the content.
+                              Defaults to 'stat'.
+
+    Returns:
+        list or str: [size, mtime_ns] in stat mode, or the hex digest in hash mode.
+    """
+
+    if mode == HASH:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def command_inputs(cmd_list, outputs):
+    """
+    Returns the input files of a command: the existing files in the command that are not outputs.
+
+    Args:
+        cmd_list (list): The fully built command.
+        outputs (list): The output files of the command.
+
+    Returns:
+        list: The input file paths, in command order and without duplicates.
+    """
+
+    outputs = {os.path.abspath(output) for output in outputs}
+
+    inputs = []
+    for token in cmd_list[1:]:
+        token = str(token)
+        if token in inputs or os.path.abspath(token) in outputs:
+            continue
+        if os.path.isfile(token):
+            inputs.append(token)
+
+    return inputs
+
+
+def build_manifest(cmd_list, version, outputs, mode=STAT):
+    """
+    Builds the manifest of a command: its fingerprint and the identities of its inputs.
+
+    Args:
+        cmd_list (list): The fully built command.
+        version (str): The software version.
+        outputs (list): The output files of the command.
+        mode (str, optional): The file identity mode of the inputs, 'stat' or 'hash'. Defaults to 'stat'.
+
+    Returns:
+        dict: The manifest. The output identities are added by write_manifest once the outputs exist.
+    """
+
+    cmd_list = [str(token) for token in cmd_list]
+
+    manifest = {
+        KEY_CMD: cmd_list,
+        KEY_VERSION: version,
+        KEY_INPUTS: {path: file_identity(path, mode) for path in command_inputs(cmd_list, outputs)},
+    }
+
+    manifest[KEY_FINGERPRINT] = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+
+    return manifest
+
+
+def is_up_to_date(manifest, outputs):
+    """
+    Checks whether the outputs of a command were produced by the same command, version and inputs.
+
+    Args:
+        manifest (dict): The manifest of the command to run, returned by build_manifest.
+        outputs (list): The output files of the command.
+
+    Returns:
+        bool: True if every output exists, was not modified after the previous run and its manifest
+              has the same fingerprint.
+    """
+
+    for output in outputs:
+        try:
+            with open(manifest_path(output)) as handle:
+                stored = json.load(handle)
+            if stored[KEY_FINGERPRINT] != manifest[KEY_FINGERPRINT]:
+                return False
+            if stored[KEY_OUTPUTS][output] != file_identity(output):
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+
+    return bool(outputs)
+
+
+def write_manifest(manifest, outputs):
+    """
+    Writes the manifest next to every output of a successful command.
+
+    Args:
+        manifest (dict): The manifest returned by build_manifest.
+        outputs (list): The output files of the command. Outputs that do not exist are ignored.
+    """
+
+    existing = [output for output in outputs if os.path.exists(output)]
+
+    manifest = dict(manifest)
+    manifest[KEY_OUTPUTS] = {output: file_identity(output) for output in existing}
+
+    for output in existing:
+        path = manifest_path(output)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as handle:
+            json.dump(manifest, handle, indent=1)
+        os.replace(tmp_path, path)
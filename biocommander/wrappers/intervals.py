@@ -0,0 +1,379 @@
+from .logger import set_logger
+import pandas as pd
+import numpy as np
+
+
+class IntervalSet():
+    """
+    Genomic intervals stored as sorted NumPy arrays per chromosome, with vectorized set operations.
+
+    Args:
+        intervals (dict, optional): A dictionary of {chromosome : (starts, ends, names)}, 0-based and half-open.
+                                    names may be None.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The intervals of every chromosome are sorted by start once, when the set is built. Every operation is a
+        handful of NumPy calls per chromosome (searchsorted, cumulative sums and maxima), so thousands of queries,
+        e.g. the coverage of every gene of an annotation, run in milliseconds without launching bedtools or
+        parsing any file again.
+
+        Operations that combine intervals (merge, complement, intersect, subtract) return merged intervals
+        without names, as bedtools merge does. Per-feature operations (coverage, depth) keep one row per interval.
+    """
+
+    CHR = 'chr'
+    START = 'start'
+    END = 'end'
+    NAME = 'name'
+
+    BED_COLUMNS = [CHR, START, END]
+
+    #Columns of the per-feature results
+    COVERED_BASES = 'covered_bases'
+    LENGTH = 'length'
+    FRACTION = 'fraction'
+    MEAN_DEPTH = 'mean_depth'
+    MIN_DEPTH = 'min_depth'
+    MAX_DEPTH = 'max_depth'
+    BASES_BELOW = 'bases_below'
+    FRACTION_BELOW = 'fraction_below'
+
+    COMMENT_PREFIXES = ('#', 'track', 'browser')
+
+    def __init__(self, intervals=None, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+
+        self.intervals = {}
+        self._merged_cache = {}
+
+        for chrom, (starts, ends, names) in (intervals if intervals else {}).items():
+            starts = np.asarray(starts, dtype=np.int64)
+            ends = np.asarray(ends, dtype=np.int64)
+
+            order = np.argsort(starts, kind='stable')
+            names = np.asarray(names, dtype=object)[order] if names is not None else None
+
+            self.intervals[chrom] = (starts[order], ends[order], names)
+
+    def __repr__(self):
+        return f'IntervalSet(chromosomes={len(self.intervals)}, intervals={len(self)})'
+
+    def __len__(self):
+        return sum(len(starts) for starts, _, _ in self.intervals.values())
+
+    @property
+    def total_length(self):
+        #Bases covered by the set, counting overlaps once
+
+        return sum(int((ends - starts).sum()) for starts, ends, _ in self.merge().intervals.values())
+
+    @classmethod
+    def from_frame(cls, frame, verbosity=20):
+        """
+        Builds the set from a DataFrame with chr, start and end columns (and optionally name), e.g. the output of
+        GenomeCoverage.intervals_below.
+        """
+
+        intervals = {}
+        for chrom, group in frame.groupby(cls.CHR, observed=True, sort=False):
+            names = group[cls.NAME].to_numpy() if cls.NAME in group else None
+            intervals[str(chrom)] = (group[cls.START].to_numpy(), group[cls.END].to_numpy(), names)
+
+        return cls(intervals, verbosity)
+
+    @classmethod
+    def from_bed(cls, bed, verbosity=20):
+        """
+        Reads a BED file. The fourth column, if present, is kept as the name of each interval.
+        """
+
+        #Header lines (track, browser, #) are only allowed before the intervals
+        skip = 0
+        with open(bed) as handle:
+            for line in handle:
+                if line.strip() and not line.startswith(cls.COMMENT_PREFIXES):
+                    break
+                skip += 1
+
+        frame = pd.read_csv(bed, sep='\t', header=None, skiprows=skip, dtype={0: str}, engine='c')
+
+        frame = frame.iloc[:, :4]
+        frame.columns = [cls.CHR, cls.START, cls.END, cls.NAME][:frame.shape[1]]
+        frame = frame.astype({cls.START: np.int64, cls.END: np.int64})
+
+        return cls.from_frame(frame, verbosity)
+
+    @classmethod
+    def from_coverage(cls, coverage, threshold, below=True, min_length=1, verbosity=20):
+        """
+        Builds the set of the intervals whose depth is below (or at least) a threshold. See GenomeCoverage.intervals.
+        """
+
+        return cls.from_frame(coverage.intervals(threshold, below, min_length), verbosity)
+
+    def to_frame(self):
+        """
+        Returns the intervals as a DataFrame with chr, start and end columns (and name, if any).
+        """
+
+        frames = []
+        for chrom, (starts, ends, names) in self.intervals.items():
+            frame = pd.DataFrame({self.CHR: chrom, self.START: starts, self.END: ends})
+            if names is not None:
+                frame[self.NAME] = names
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame(columns=self.BED_COLUMNS)
+
+        frame = pd.concat(frames, ignore_index=True)
+        frame[self.CHR] = pd.Categorical(frame[self.CHR], categories=list(self.intervals))
+
+        return frame
+
+    def to_bed(self, output):
+        """
+        Writes the intervals to a BED file.
+        """
+
+        self.to_frame().to_csv(output, sep='\t', header=False, index=False)
+
+    @staticmethod
+    def _merge(starts, ends, distance=0):
+        #Merges sorted intervals: a new group starts where the start is beyond every previous end
+
+        if not len(starts):
+            return starts, ends
+
+        reach = np.maximum.accumulate(ends)
+        new_group = np.empty(len(starts), dtype=bool)
+        new_group[0] = True
+        new_group[1:] = starts[1:] > reach[:-1] + distance
+
+        first = np.flatnonzero(new_group)
+        last = np.append(first[1:], len(starts)) - 1
+
+        return starts[first], reach[last]
+
+    def _merged(self, chrom):
+        #Merged intervals of a chromosome, computed once per set
+
+        if chrom not in self._merged_cache:
+            if chrom in self.intervals:
+                starts, ends, _ = self.intervals[chrom]
+                self._merged_cache[chrom] = self._merge(starts, ends)
+            else:
+                self._merged_cache[chrom] = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+        return self._merged_cache[chrom]
+
+    def merge(self, distance=0):
+        """
+        Merges the overlapping intervals (bedtools merge).
+
+        Args:
+            distance (int, optional): Intervals closer than this distance are merged too. Defaults to 0
+                                      (overlapping or book-ended intervals).
+
+        Returns:
+            IntervalSet: The merged intervals.
+        """
+
+        merged = {}
+        for chrom, (starts, ends, _) in self.intervals.items():
+            merged[chrom] = (*self._merge(starts, ends, distance), None)
+
+        return IntervalSet(merged, self.verbosity)
+
+    def complement(self, chrom_sizes):
+        """
+        Returns the intervals not covered by the set (bedtools complement).
+
+        Args:
+            chrom_sizes (dict): A dictionary of {chromosome : length}, e.g. GenomeCoverage.chrom_sizes.
+
+        Returns:
+            IntervalSet: The uncovered intervals.
+        """
+
+        complement = {}
+        for chrom, size in chrom_sizes.items():
+            starts, ends = self._merged(chrom)
+
+            gap_starts = np.concatenate(([0], ends))
+            gap_ends = np.concatenate((starts, [size]))
+
+            gap_starts = np.minimum(gap_starts, size)
+            keep = gap_ends > gap_starts
+
+            complement[chrom] = (gap_starts[keep], gap_ends[keep], None)
+
+        return IntervalSet(complement, self.verbosity)
+
+    def _overlap_pairs(self, chrom, starts, ends):
+        #For each query interval, the range of merged intervals of the set that overlap it
+
+        merged_starts, merged_ends = self._merged(chrom)
+
+        first = np.searchsorted(merged_ends, starts, side='right')
+        last = np.searchsorted(merged_starts, ends, side='left')
+
+        return merged_starts, merged_ends, first, np.maximum(last - first, 0)
+
+    def intersect(self, other):
+        """
+        Returns the bases covered by both sets, as merged intervals (bedtools intersect of the merged sets).
+
+        Args:
+            other (IntervalSet): The other set.
+
+        Returns:
+            IntervalSet: The intersection.
+        """
+
+        intersection = {}
+        for chrom in self.intervals:
+            starts, ends = self._merged(chrom)
+
+            other_starts, other_ends, first, counts = other._overlap_pairs(chrom, starts, ends)
+
+            query = np.repeat(np.arange(len(starts)), counts)
+            #Index of each overlapping interval of other: first of the query plus the position within its range
+            offsets = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+            target = np.repeat(first, counts) + offsets
+
+            new_starts = np.maximum(starts[query], other_starts[target])
+            new_ends = np.minimum(ends[query], other_ends[target])
+
+            keep = new_ends > new_starts
+            intersection[chrom] = (new_starts[keep], new_ends[keep], None)
+
+        return IntervalSet(intersection, self.verbosity)
+
+    def subtract(self, other):
+        """
+        Returns the bases of the set not covered by the other set (bedtools subtract of the merged sets).
+        """
+
+        sizes = {chrom: int(ends.max()) if len(ends) else 0 for chrom, (_, ends, _) in self.intervals.items()}
+
+        return self.intersect(other.complement(sizes))
+
+    def _covered_before(self, chrom, positions):
+        #Bases of the set covered in [0, position) for every position, with the cumulative merged lengths
+
+        starts, ends = self._merged(chrom)
+
+        cumulative = np.concatenate(([0], np.cumsum(ends - starts)))
+
+        idx = np.searchsorted(starts, positions, side='right')
+        previous = np.maximum(idx - 1, 0)
+
+        partial = np.clip(positions - starts[previous], 0, (ends - starts)[previous]) if len(starts) else 0
+
+        return np.where(idx > 0, cumulative[previous] + partial, 0)
+
+    def coverage(self, features):
+        """
+        Counts the bases of every feature covered by the set (bedtools coverage -a features -b set).
+
+        Args:
+            features (IntervalSet): The features, e.g. genes read with from_bed.
+
+        Returns:
+            DataFrame: One row per feature with chr, start, end (name), covered_bases, length and fraction.
+        """
+
+        frames = []
+        for chrom, (starts, ends, names) in features.intervals.items():
+            covered = self._covered_before(chrom, ends) - self._covered_before(chrom, starts)
+            frames.append(features._feature_frame(chrom, starts, ends, names, {self.COVERED_BASES: covered}))
+
+        frame = self._concat(frames, features)
+        frame[self.LENGTH] = frame[self.END] - frame[self.START]
+        frame[self.FRACTION] = frame[self.COVERED_BASES] / frame[self.LENGTH].where(frame[self.LENGTH] > 0)
+
+        return frame
+
+    def depth(self, coverage, threshold=None):
+        """
+        Summarizes the per-base depth over every interval of the set.
+
+        Args:
+            coverage (GenomeCoverage): The per-base coverage, e.g. BedTools.get_coverage().
+            threshold (int or float, optional): If provided, the bases with depth below it are counted too.
+
+        Returns:
+            DataFrame: One row per interval with chr, start, end (name), mean_depth, min_depth and max_depth, plus
+                       bases_below and fraction_below when a threshold is given. Intervals beyond the end of the
+                       coverage arrays are clipped.
+
+        Note:
+            Sums, counts, minimum and maximum use reduceat over the interval bounds, restricted to the span of the
+            intervals of each chromosome, so no per-chromosome cumulative array is built on every call.
+        """
+
+        frames = []
+        for chrom, (starts, ends, names) in self.intervals.items():
+            array = coverage.arrays.get(chrom)
+            if array is None:
+                self.logger.warning(f'{chrom} not in the coverage, skipped')
+                continue
+
+            s = np.clip(starts, 0, len(array))
+            e = np.clip(ends, 0, len(array))
+            lengths = e - s
+            valid = lengths > 0
+
+            columns = {key: np.full(len(s), np.nan) for key in (self.MEAN_DEPTH, self.MIN_DEPTH, self.MAX_DEPTH)}
+            below = np.zeros(len(s), dtype=np.int64)
+
+            if valid.any():
+                #Only the span of the intervals is read; the sentinel makes an interval ending at its end a valid bound
+                span_start, span_end = int(s[valid].min()), int(e[valid].max())
+                span = np.append(array[span_start:span_end], array.dtype.type(0))
+
+                bounds = np.empty(2 * len(s), dtype=np.int64)
+                bounds[0::2] = np.clip(s - span_start, 0, span_end - span_start)
+                bounds[1::2] = np.clip(e - span_start, 0, span_end - span_start)
+
+                sums = np.add.reduceat(span, bounds, dtype=np.float64)[0::2]
+                np.divide(sums, lengths, out=columns[self.MEAN_DEPTH], where=valid)
+
+                for key, function in ((self.MIN_DEPTH, np.minimum), (self.MAX_DEPTH, np.maximum)):
+                    values = function.reduceat(span, bounds)[0::2]
+                    columns[key][valid] = values[valid]
+
+                if threshold is not None:
+                    below[valid] = np.add.reduceat(span < threshold, bounds, dtype=np.int64)[0::2][valid]
+
+            if threshold is not None:
+                columns[self.BASES_BELOW] = below
+                columns[self.FRACTION_BELOW] = np.divide(below, lengths, out=np.full(len(s), np.nan), where=valid)
+
+            frames.append(self._feature_frame(chrom, starts, ends, names, columns))
+
+        return self._concat(frames, self)
+
+    def _feature_frame(self, chrom, starts, ends, names, columns):
+
+        frame = pd.DataFrame({self.CHR: chrom, self.START: starts, self.END: ends})
+        if names is not None:
+            frame[self.NAME] = names
+        for key, values in columns.items():
+            frame[key] = values
+
+        return frame
+
+    def _concat(self, frames, features):
+
+        if not frames:
+            return pd.DataFrame(columns=self.BED_COLUMNS)
+
+        frame = pd.concat(frames, ignore_index=True)
+        frame[self.CHR] = pd.Categorical(frame[self.CHR], categories=list(features.intervals))
+
+        return frame
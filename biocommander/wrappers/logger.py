@@ -5,11 +5,18 @@ def set_logger(name, verbosity):
     logger = logging.getLogger(name)
     logger.setLevel(verbosity)
 
+    #Loggers are shared by name: the console handler is only added the first time
+    for handler in logger.handlers:
+        if getattr(handler, '_biocommander', False):
+            handler.setLevel(verbosity)
+            return logger
+
     console_handler = logging.StreamHandler()
     console_handler.setLevel(verbosity)
+    console_handler._biocommander = True
 
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
-    return logger
\ No newline at end of file
+    return logger
@@ -1,15 +1,20 @@
 
 from .wrappers import CommandLineSoftware
+from .reference import REGISTRY
+from . import regions
 import subprocess
+import hashlib
+import json
 import re
+import os
 
 #Vamos a crear el objeto Mapper
 
 
 class ReadMapper(CommandLineSoftware):
     
-    def __init__(self, command='', shell=False, verbosity=20, reference = ''):
-        super().__init__(command, shell, verbosity)
+    def __init__(self, command='', shell=False, verbosity=20, reference = '', threads = None, probe_version = True, spool = None, timeout = None, cpu_timeout = None):
+        super().__init__(command, shell, verbosity, threads, probe_version, spool=spool, timeout=timeout, cpu_timeout=cpu_timeout)
 
         self.reference=reference
 
@@ -24,49 +29,317 @@ class BwaMapper(ReadMapper):
     SAM_EXT = 'sam'
     DEFAULT_COMMAND = 'bwa'
 
-    def index(self, **kwargs):
+    THREADS_FLAG = 't'
+    THREADED_SUBCMDS = [SUBCMD_MEM]
 
-        self.launch_command([self.SUBCMD_INDEX], kwargs=kwargs, args=self.reference)
-        
+    def index(self, force=False, **kwargs):
+        """
+        Builds the bwa index of the reference, unless it is already up to date.
 
-    def mem(self, input = None, output='', **kwargs):
+        Args:
+            force (bool, optional): If True, the index is rebuilt even if it is up to date. Defaults to False.
+            **kwargs: Options of bwa index.
+
+        Returns:
+            bool: True if the index was built by this call.
+
+        Note:
+            The index is built under a file lock (see ReferenceRegistry), so concurrent calls on the same reference,
+            from threads or processes, build it once.
+        """
+
+        return REGISTRY.bwa_index(self.reference, self, force, **kwargs)
+
+    async def index_async(self, force=False, **kwargs):
+
+        import asyncio
+
+        return await asyncio.to_thread(self.index, force, **kwargs)
+
+    def mem_command(self, input = None, output='', **kwargs):
 
-        #Add output ¿Specific method?
         #Para adaptarlo a launch_command hay que añadir la referencia a la lista de inputs
+        #Without output, bwa mem writes the SAM to stdout and the command can be piped (see CliPipeline)
 
-        kwargs['o'] = output
+        if output:
+            kwargs['o'] = output
 
         cmd = self._build_command([self.SUBCMD_MEM], kwargs=kwargs, args=input)
 
         cmd.add_arg(self.reference, 1) #??
 
-        self.execute_command(cmd.cmd_list)
+        return cmd
+
+    def mem(self, input = None, output='', **kwargs):
+
+        cmd = self.mem_command(input, output, **kwargs)
+
+        self._execute_output(cmd, self.SUBCMD_MEM, output)
+
+    async def mem_async(self, input = None, output='', **kwargs):
+
+        cmd = self.mem_command(input, output, **kwargs)
+
+        return await self._execute_output_async(cmd, self.SUBCMD_MEM, output)
 
     def check_index(self):
-        pass
+        #True if the five bwa index files of the reference exist and are newer than the reference
+
+        return REGISTRY.is_current(self.reference, REGISTRY.bwa_files(self.reference))
         
-    def get_version(self):
+    def _probe_version(self):
 
         #bwa no tiene flag version, así que vamos a sacarlo del mensaje de error:
 
-        result = subprocess.run(self.command, capture_output=True, text=True)
+        try:
+            result = subprocess.run(self.command, capture_output=True, text=True)
+        except OSError as error:
+            self.logger.debug(f'Version probe failed: {error}')
+            return None
 
         version_pattern = r'Version: (\S+)'
 
         version_match = re.search(version_pattern, result.stderr)
 
         if version_match:
-            self.version = f'{self.command} {version_match.group(1)}'
-            self.logger.info(f'Software version: {self.version}')
-        else:
-            self.logger.warning(self.MSG_VERSION_NOT_FOUND)
-            self.version = None
+            return f'{self.command} {version_match.group(1)}'
+
+        return None
 
 class BowtieMapper(ReadMapper):
     pass
 
 class Minimap2Mapper(ReadMapper):
-    pass
+    """
+    Wrapper of minimap2 that builds a .mmi index per preset once and reuses it for every mapping.
+
+    Args:
+        command (str, optional): The command for the software. Defaults to 'minimap2'.
+        shell (bool, optional): If True, enables the shell function for command execution. Defaults to False.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+        reference (str, optional): The reference FASTA file. Defaults to ''.
+        threads (int, optional): Number of threads of the mapping. Defaults to None (software default).
+        probe_version (bool, optional): If False, the software version is never probed. Defaults to True.
+        preset (str, optional): The minimap2 preset: 'map-ont', 'map-hifi', 'map-pb', 'sr', 'asm5', 'splice'...
+                                Defaults to 'map-ont'.
+        index_batch (int or str, optional): Maximum reference bases loaded per index part (-I), e.g. '4G'.
+                                            Defaults to None (minimap2 default, 8G).
+        max_memory (int, optional): Approximate memory limit of the index in bytes, translated into index_batch.
+                                    Ignored if index_batch is given. Defaults to None.
+        index_options (dict, optional): Other minimap2 options that change the index, e.g. {'k': 19, 'w': 10}.
+                                        Used by the index built for map(). Defaults to None.
+
+    Note:
+        Without an index, minimap2 indexes the FASTA on every call. The k-mer and window sizes of the index
+        depend on the preset, so one index is kept per preset, next to the reference: <reference>.<preset>.mmi.
+        Indexes built with other options (index_batch, index_options) get a short hash of the options in their
+        name, <reference>.<preset>.<hash>.mmi, so an index built with different options is never reused.
+        Indexes are built once under a file lock (see ReferenceRegistry), and loading a .mmi is a sequential read.
+
+        References larger than the index batch are indexed in several parts. Each part is mapped in turn and
+        the results are merged with --split-prefix, so the memory used is bounded by the batch size.
+    """
+
+    DEFAULT_COMMAND = 'minimap2'
+
+    MMI_EXT = '.mmi'
+    SAM_EXT = 'sam'
+    PAF_EXT = 'paf'
+
+    PRESET_FLAG = 'x'
+    INDEX_FLAG = 'd'
+    BATCH_FLAG = 'I'
+    OUTPUT_FLAG = 'o'
+    SAM_FLAG = 'a'
+    SPLIT_PREFIX_FLAG = 'split_prefix'
+
+    DEFAULT_PRESET = 'map-ont'
+
+    #minimap2 has no subcommands
+    THREADS_FLAG = 't'
+    THREADED_SUBCMDS = ['']
+
+    #Rough, conservative peak memory of the index per reference base; the real value depends on k and w of the preset
+    INDEX_BYTES_PER_BASE = 2
+
+    BASES_UNITS = {'K': 10**3, 'M': 10**6, 'G': 10**9}
+
+    def __init__(self, command='', shell=False, verbosity=20, reference='', threads=None, probe_version=True, preset=DEFAULT_PRESET, index_batch=None, max_memory=None, spool=None, timeout=None, cpu_timeout=None, index_options=None):
+        super().__init__(command, shell, verbosity, reference, threads, probe_version, spool, timeout, cpu_timeout)
+
+        self.preset = preset
+        self.index_options = dict(index_options) if index_options else {}
+
+        if index_batch is None and max_memory:
+            index_batch = int(max_memory / self.INDEX_BYTES_PER_BASE)
+        self.index_batch = index_batch
+
+    @classmethod
+    def parse_bases(cls, value):
+        #'4G' -> 4000000000, as minimap2 parses -I
+
+        if isinstance(value, str) and value[-1:].upper() in cls.BASES_UNITS:
+            return int(float(value[:-1]) * cls.BASES_UNITS[value[-1].upper()])
+
+        return int(value)
+
+    def _index_options(self, kwargs):
+        #Options of the index besides the preset: index_options, the call options and the index batch
+
+        options = {**self.index_options, **kwargs}
+        if self.index_batch:
+            options[self.BATCH_FLAG] = self.index_batch
+
+        return options
+
+    def index_path(self, preset=None, **kwargs):
+        """
+        Returns the .mmi file of the reference for a preset and index options (see index).
+        """
+
+        preset = preset if preset else self.preset
+        options = self._index_options(kwargs)
+
+        name = f'{self.reference}.{preset}' if preset else self.reference
+
+        if options:
+            digest = hashlib.sha256(json.dumps(sorted((str(flag), str(value)) for flag, value in options.items())).encode())
+            name = f'{name}.{digest.hexdigest()[:8]}'
+
+        return f'{name}{self.MMI_EXT}'
+
+    def check_index(self, preset=None, **kwargs):
+        #True if the .mmi of the preset and options exists and is newer than the reference
+
+        return REGISTRY.is_current(self.reference, [self.index_path(preset, **kwargs)])
+
+    def index(self, preset=None, force=False, **kwargs):
+        """
+        Builds the .mmi index of the reference for a preset, unless it is already up to date.
+
+        Args:
+            preset (str, optional): The minimap2 preset. Defaults to the preset of the object.
+            force (bool, optional): If True, the index is rebuilt even if it is up to date. Defaults to False.
+            **kwargs: Other options of minimap2 that change the index (k, w, H...), added to index_options.
+                      They are part of the index name, so map() only uses the index of index_options.
+
+        Returns:
+            str: The path of the index.
+        """
+
+        preset = preset if preset else self.preset
+
+        mmi = self.index_path(preset, **kwargs)
+
+        options = self._index_options(kwargs)
+        if preset:
+            options[self.PRESET_FLAG] = preset
+
+        REGISTRY.minimap2_index(self.reference, self, mmi, force, **options)
+
+        return mmi
+
+    async def index_async(self, preset=None, force=False, **kwargs):
+
+        import asyncio
+
+        return await asyncio.to_thread(self.index, preset, force, **kwargs)
+
+    def is_split_index(self):
+        #True if the reference is larger than one index batch, so the index has several parts
+
+        if not self.index_batch:
+            return False
+
+        fai = f'{self.reference}{regions.FAI_EXT}'
+        if os.path.exists(fai):
+            bases = sum(length for _, length in regions.read_fai(fai))
+        else:
+            #Upper bound: the FASTA size includes headers and newlines
+            bases = os.path.getsize(self.reference)
+
+        return bases > self.parse_bases(self.index_batch)
+
+    def map_command(self, input, output='', sam=True, preset=None, **kwargs):
+        """
+        Builds the mapping command against the .mmi index of the preset.
+
+        Args:
+            input (str or list): The read file, or the two files of paired-end reads.
+            output (str, optional): The output file. Defaults to '' (standard output, so it can be piped).
+            sam (bool, optional): If True, the output is SAM (-a); otherwise PAF. Defaults to True.
+            preset (str, optional): The minimap2 preset. Defaults to the preset of the object.
+            **kwargs: Other options of minimap2.
+
+        Returns:
+            CliCommand: The command. The index must exist (see index).
+        """
+
+        preset = preset if preset else self.preset
+
+        if preset:
+            kwargs[self.PRESET_FLAG] = preset
+        if sam:
+            kwargs[self.SAM_FLAG] = True
+        if output:
+            kwargs[self.OUTPUT_FLAG] = output
+        if self.is_split_index() and self.SPLIT_PREFIX_FLAG not in kwargs:
+            kwargs[self.SPLIT_PREFIX_FLAG] = f'{output if output else self.index_path(preset)}.split{os.getpid()}'
+
+        inputs = [input] if isinstance(input, str) else list(input)
+
+        return self._build_command(kwargs=kwargs, args=(self.index_path(preset), *inputs))
+
+    def map(self, input, output='', sam=True, preset=None, **kwargs):
+
+        self.index(preset)
+
+        cmd = self.map_command(input, output, sam, preset, **kwargs)
+
+        return self._execute_output(cmd, 'map', output)
+
+    async def map_async(self, input, output='', sam=True, preset=None, **kwargs):
+
+        await self.index_async(preset)
+
+        cmd = self.map_command(input, output, sam, preset, **kwargs)
+
+        return await self._execute_output_async(cmd, 'map', output)
+
+    def map_samples(self, samples, sam=True, preset=None, **kwargs):
+        """
+        Maps many read files against one index, built at most once.
+
+        Args:
+            samples (dict): A dictionary of {output file : read file or [read files]}.
+            sam (bool, optional): If True, the outputs are SAM; otherwise PAF. Defaults to True.
+            preset (str, optional): The minimap2 preset. Defaults to the preset of the object.
+            **kwargs: Other options of minimap2.
+
+        Returns:
+            dict: A dictionary of {output file : exit status}.
+
+        Note:
+            The samples run one after the other, each one with all the threads, so the index file stays in the
+            page cache and every run after the first loads it from memory.
+        """
+
+        self.index(preset)
+
+        status = {}
+        for output, input in samples.items():
+            result = self._execute_output(self.map_command(input, output, sam, preset, **kwargs), 'map', output)
+            status[output] = result.returncode if result is not None else 0
+
+        return status
+
+    def _probe_version(self):
+
+        #minimap2 --version prints only the version number
+
+        version = super()._probe_version()
+
+        return f'{self.command} {version.strip()}' if version else None
 
 
 
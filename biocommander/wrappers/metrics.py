@@ -0,0 +1,213 @@
+import time
+import json
+import sys
+import os
+
+#Keys of the resource usage records
+
+KEY_CMD = 'cmd'
+KEY_TOOL = 'tool'
+KEY_SUBCMD = 'subcommand'
+KEY_PID = 'pid'
+KEY_TIMESTAMP = 'timestamp'
+KEY_RETURNCODE = 'returncode'
+KEY_WALL = 'wall_time'
+KEY_USER = 'user_time'
+KEY_SYS = 'sys_time'
+KEY_MAX_RSS = 'max_rss'
+KEY_READ_BYTES = 'read_bytes'
+KEY_WRITE_BYTES = 'write_bytes'
+KEY_RCHAR = 'rchar'
+KEY_WCHAR = 'wchar'
+KEY_TIMED_OUT = 'timed_out'
+
+PROC_IO = '/proc/{pid}/io'
+
+#ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+MAX_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+PROMETHEUS_PREFIX = 'biocommander_command'
+
+#(metric, record key, type, help). Counters are summed and gauges keep the maximum of the records
+PROMETHEUS_METRICS = [
+    ('wall_seconds_total', KEY_WALL, 'counter', 'Wall-clock time of the executed commands'),
+    ('user_seconds_total', KEY_USER, 'counter', 'User CPU time of the executed commands'),
+    ('system_seconds_total', KEY_SYS, 'counter', 'System CPU time of the executed commands'),
+    ('read_bytes_total', KEY_READ_BYTES, 'counter', 'Bytes read from storage by the executed commands'),
+    ('write_bytes_total', KEY_WRITE_BYTES, 'counter', 'Bytes written to storage by the executed commands'),
+    ('max_rss_bytes', KEY_MAX_RSS, 'gauge', 'Peak resident set size of the executed commands'),
+]
+
+
+def new_record(cmd, pid=None, timestamp=None):
+    """
+    Creates an empty resource usage record for a command.
+
+    Args:
+        cmd (list or str): The executed command.
+        pid (int, optional): The process id. Defaults to None.
+        timestamp (float, optional): Start time as seconds since the epoch. Defaults to now.
+
+    Returns:
+        dict: The record, with the tool and subcommand extracted from the command.
+    """
+
+    cmd_list = cmd.split() if isinstance(cmd, str) else [str(arg) for arg in cmd]
+
+    subcommand = cmd_list[1] if len(cmd_list) > 1 and not cmd_list[1].startswith('-') else ''
+
+    return {
+        KEY_CMD: ' '.join(cmd_list),
+        KEY_TOOL: os.path.basename(cmd_list[0]) if cmd_list else '',
+        KEY_SUBCMD: subcommand,
+        KEY_PID: pid,
+        KEY_TIMESTAMP: timestamp if timestamp else time.time(),
+        KEY_RETURNCODE: None,
+        KEY_WALL: None,
+        KEY_USER: None,
+        KEY_SYS: None,
+        KEY_MAX_RSS: None,
+        KEY_READ_BYTES: None,
+        KEY_WRITE_BYTES: None,
+        KEY_RCHAR: None,
+        KEY_WCHAR: None,
+        KEY_TIMED_OUT: False,
+    }
+
+
+def read_proc_io(pid):
+    """
+    Reads the I/O counters of a process from /proc/<pid>/io.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        dict: The counters (read_bytes, write_bytes, rchar, wchar...), or an empty dictionary if not available.
+    """
+
+    try:
+        with open(PROC_IO.format(pid=pid)) as proc_io:
+            return {key: int(value) for key, value in (line.split(':') for line in proc_io if ':' in line)}
+    except (OSError, ValueError):
+        return {}
+
+
+def wait_process(process, started, timestamp=None):
+    """
+    Waits for a Popen process and collects its resource usage.
+
+    Args:
+        process (Popen): The running process. It must not have been waited for yet.
+        started (float): The value of time.perf_counter() when the process was launched.
+        timestamp (float, optional): Start time as seconds since the epoch. Defaults to the wall time elapsed before now.
+
+    Returns:
+        dict: The resource usage record of the process. The returncode attribute of the process is set.
+
+    Note:
+        The process is first waited for without being reaped (waitid with WNOWAIT), so /proc/<pid>/io can still be
+        read, and then reaped with wait4 to obtain its rusage: CPU times and peak RSS of the process and of the
+        descendants it waited for. Where these calls are not available, only the wall time and exit status are recorded.
+    """
+
+    record = new_record(process.args, process.pid, timestamp)
+
+    io_counters = {}
+
+    try:
+        if hasattr(os, 'waitid'):
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+            io_counters = read_proc_io(process.pid)
+
+        _, status, rusage = os.wait4(process.pid, 0)
+
+    except (ChildProcessError, AttributeError):
+        process.wait()
+        rusage = None
+
+    else:
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    wall_time = time.perf_counter() - started
+
+    record[KEY_RETURNCODE] = process.returncode
+    record[KEY_WALL] = wall_time
+
+    if not timestamp:
+        record[KEY_TIMESTAMP] = time.time() - wall_time
+
+    if rusage:
+        record[KEY_USER] = rusage.ru_utime
+        record[KEY_SYS] = rusage.ru_stime
+        record[KEY_MAX_RSS] = rusage.ru_maxrss * MAX_RSS_UNIT
+
+    for key in (KEY_READ_BYTES, KEY_WRITE_BYTES, KEY_RCHAR, KEY_WCHAR):
+        record[key] = io_counters.get(key)
+
+    return record
+
+
+def write_jsonl(records, output, append=True):
+    """
+    Writes resource usage records as JSON Lines.
+
+    Args:
+        records (list): The records.
+        output (str): The output file path.
+        append (bool, optional): If True, appends the records to the file. Defaults to True.
+    """
+
+    with open(output, 'a' if append else 'w') as jsonl:
+        for record in records:
+            jsonl.write(json.dumps(record) + '\n')
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_prometheus(records, output):
+    """
+    Writes resource usage records as a Prometheus text file (e.g. for the node_exporter textfile collector).
+
+    Args:
+        records (list): The records.
+        output (str): The output file path. It is replaced atomically.
+
+    Note:
+        Records are aggregated by tool and subcommand: runs and failures are counted, times and bytes are summed
+        and the peak RSS is the maximum of all the runs.
+    """
+
+    groups = {}
+    for record in records:
+        groups.setdefault((record[KEY_TOOL], record[KEY_SUBCMD]), []).append(record)
+
+    lines = []
+
+    def add_metric(name, metric_type, help_text, values):
+        lines.append(f'# HELP {PROMETHEUS_PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{name} {metric_type}')
+        for (tool, subcommand), value in values:
+            lines.append(f'{PROMETHEUS_PREFIX}_{name}{{tool="{_label(tool)}",subcommand="{_label(subcommand)}"}} {value}')
+
+    add_metric('runs_total', 'counter', 'Number of executed commands',
+               [(group, len(runs)) for group, runs in groups.items()])
+    add_metric('failures_total', 'counter', 'Number of commands with a non-zero exit status',
+               [(group, sum(1 for run in runs if run[KEY_RETURNCODE])) for group, runs in groups.items()])
+
+    for name, key, metric_type, help_text in PROMETHEUS_METRICS:
+        aggregate = sum if metric_type == 'counter' else max
+        values = []
+        for group, runs in groups.items():
+            measured = [run[key] for run in runs if run[key] is not None]
+            if measured:
+                values.append((group, aggregate(measured)))
+        add_metric(name, metric_type, help_text, values)
+
+    tmp_output = f'{output}.{os.getpid()}.tmp'
+    with open(tmp_output, 'w') as prom:
+        prom.write('\n'.join(lines) + '\n')
+    os.replace(tmp_output, output)
+
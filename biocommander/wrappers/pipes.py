@@ -0,0 +1,223 @@
+import subprocess
+from .logger import set_logger
+from . import metrics
+from . import cancel
+import threading
+import signal
+import time
+
+
+class CliPipeline():
+    """
+    Chains CliCommand objects stdout-to-stdin and runs them as concurrent processes.
+
+    Args:
+        commands (list, optional): The CliCommand objects (or command lists) to chain, in order.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+        fail_fast (bool, optional): If True, the first stage that fails kills the other stages. Defaults to False.
+        timeout (float, optional): Wall-clock seconds after which every stage is killed. Defaults to None (no limit).
+        cpu_timeout (float, optional): CPU seconds after which a stage is killed (RLIMIT_CPU). Defaults to None.
+
+    Note:
+        Every stage is started as its own OS process and the stdout of each stage is connected to the stdin of
+        the next one through a kernel pipe, so the data never passes through Python and no intermediate
+        file is written. The parent closes its copy of every pipe, so a stage that exits early makes its
+        upstream stage receive SIGPIPE instead of hanging.
+
+        CliCommand objects are built with the *_command methods of the wrappers, e.g.:
+
+            pipeline = CliPipeline([
+                bwa.mem_command(['r1.fq', 'r2.fq']),
+                samtools.view_command('-', b=True),
+                samtools.sort_command('-', o='sample.bam'),
+            ])
+            pipeline.run()
+
+        The pipe operator can be used as well: bwa.mem_command(reads) | samtools.sort_command('-', o='sample.bam')
+
+        Without fail_fast, the stages after a failed one see the end of their input and may exit successfully
+        with a truncated output, e.g. a sorted BAM of part of the reads. With fail_fast, they are killed as soon
+        as a stage fails, with the processes they forked. A stage killed by SIGPIPE is not a failure: its
+        consumer stopped reading on purpose. Every stage is also registered with the CancelGroup of the
+        current thread, so a fail-fast batch or task graph kills the pipeline too.
+    """
+
+    KEY_CMD = 'cmd'
+    KEY_RETURNCODE = 'returncode'
+    KEY_METRICS = 'metrics'
+
+    def __init__(self, commands=None, verbosity=20, fail_fast=False, timeout=None, cpu_timeout=None):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+        self.fail_fast = fail_fast
+        self.timeout = timeout
+        self.cpu_timeout = cpu_timeout
+
+        self.commands = []
+        self.returncodes = []
+        self.metrics = []
+
+        for command in commands if commands else []:
+            self.add(command)
+
+    def __repr__(self):
+        return f'CliPipeline({self.cmd_str})'
+
+    def __or__(self, command):
+        return self.add(command)
+
+    @property
+    def cmd_str(self):
+        return ' | '.join(' '.join(self._cmd_list(command)) for command in self.commands)
+
+    @staticmethod
+    def _cmd_list(command):
+        return command.cmd_list if hasattr(command, 'cmd_list') else command
+
+    def add(self, command):
+        """
+        Appends a stage to the end of the pipeline.
+
+        Args:
+            command (CliCommand, list or CliPipeline): The command to append. The stages of a CliPipeline are appended in order.
+
+        Returns:
+            CliPipeline: The pipeline itself, so calls can be chained.
+        """
+
+        if isinstance(command, CliPipeline):
+            self.commands.extend(command.commands)
+        else:
+            self.commands.append(command)
+
+        return self
+
+    def _open_target(self, target, mode):
+        #Paths are opened by the pipeline, file objects and descriptors are passed as they are
+
+        if isinstance(target, str):
+            return open(target, mode), True
+        return target, False
+
+    def run(self, stdin=None, stdout=None, stderr=None):
+        """
+        Runs every stage of the pipeline concurrently and waits for all of them.
+
+        Args:
+            stdin (str or file, optional): Input of the first stage, as a path or a file object. Defaults to None (inherited).
+            stdout (str or file, optional): Output of the last stage, as a path or a file object. Defaults to None (inherited).
+            stderr (file, optional): Standard error of every stage. Defaults to None (inherited).
+
+        Returns:
+            list: A list with one dictionary per stage, {'cmd' : cmd_list, 'returncode' : exit status, 'metrics' : record}.
+                  A negative exit status -N means the stage was killed by signal N. The record holds the resource
+                  usage of the stage (see metrics.wait_process).
+
+        Raises:
+            CommandCancelled: If the CancelGroup of the current thread has been cancelled.
+        """
+
+        if not self.commands:
+            self.logger.error('The pipeline has no commands')
+            return []
+
+        group = cancel.CancelGroup(self.fail_fast)
+
+        try:
+            group.check()
+            return self._run(group, stdin, stdout, stderr)
+        finally:
+            group.close()
+
+    def _run(self, group, stdin, stdout, stderr):
+
+        self.logger.info(f'Executing: {self.cmd_str}')
+
+        stdin, close_stdin = self._open_target(stdin, 'rb')
+        stdout, close_stdout = self._open_target(stdout, 'wb')
+
+        processes = []
+        upstream = stdin
+        started = time.perf_counter()
+
+        try:
+            for idx, command in enumerate(self.commands):
+                last = idx == len(self.commands) - 1
+
+                process = subprocess.Popen(
+                    self._cmd_list(command),
+                    stdin=upstream,
+                    stdout=stdout if last else subprocess.PIPE,
+                    stderr=stderr,
+                    start_new_session=True,
+                )
+                cancel.limit_cpu(process, self.cpu_timeout)
+                group.register(process)
+
+                #The child owns the read end now; the parent must drop its copy for SIGPIPE to work
+                if idx:
+                    upstream.close()
+
+                upstream = process.stdout
+                processes.append(process)
+
+        except OSError:
+            #A stage could not be started: do not leave the previous ones blocked on a pipe
+            for process in processes:
+                cancel.kill_group(process)
+                process.wait()
+            raise
+
+        finally:
+            #The children hold their own copies of the pipeline input and output
+            if close_stdin:
+                stdin.close()
+            if close_stdout:
+                stdout.close()
+
+        watchdog = cancel.Watchdog(processes, self.timeout)
+
+        #Stages are waited for concurrently, so the first failure is seen while the others still run
+        self.metrics = [None] * len(processes)
+        waiters = [threading.Thread(target=self._wait_stage, args=(idx, process, started, group), daemon=True)
+                   for idx, process in enumerate(processes)]
+
+        try:
+            for waiter in waiters:
+                waiter.start()
+            for waiter in waiters:
+                waiter.join()
+        except BaseException:
+            group.cancel('interrupted')
+            raise
+        finally:
+            watchdog.cancel()
+
+        self.returncodes = [record[metrics.KEY_RETURNCODE] for record in self.metrics]
+
+        if watchdog.expired:
+            self.logger.error(f'Pipeline killed after the timeout of {self.timeout} s: {self.cmd_str}')
+
+        results = []
+        for command, record in zip(self.commands, self.metrics):
+            cmd_list = self._cmd_list(command)
+            record[metrics.KEY_TIMED_OUT] = watchdog.expired
+            if record[metrics.KEY_RETURNCODE]:
+                self.logger.error(f'Stage {" ".join(cmd_list)} exited with status {record[metrics.KEY_RETURNCODE]}')
+            results.append({self.KEY_CMD: cmd_list, self.KEY_RETURNCODE: record[metrics.KEY_RETURNCODE], self.KEY_METRICS: record})
+
+        return results
+
+    def _wait_stage(self, idx, process, started, group):
+
+        record = metrics.wait_process(process, started)
+        self.metrics[idx] = record
+
+        returncode = record[metrics.KEY_RETURNCODE]
+        if returncode and returncode != -signal.SIGPIPE and not group.cancelled:
+            group.fail(f'{record[metrics.KEY_CMD]} exited with status {returncode}')
+
+    @property
+    def success(self):
+        return bool(self.returncodes) and not any(self.returncodes)
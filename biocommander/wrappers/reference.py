@@ -0,0 +1,255 @@
+from .logger import set_logger
+import contextlib
+import tempfile
+import hashlib
+import fcntl
+import os
+
+
+class ReferenceRegistry():
+    """
+    Detects and builds the indexes of the references: bwa index, minimap2 index (.mmi), FASTA index (.fai) and
+    sequence dictionary (.dict).
+
+    Args:
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        An index is up to date when all its files exist, are not empty and are newer than the reference. Only the
+        missing or outdated indexes are built, each one under an exclusive file lock next to the reference: when N
+        processes prepare the same reference, one builds every index and the rest wait for it and reuse the result.
+
+        Indexes are built under a temporary name and renamed into place, so an interrupted build never
+        leaves files that look complete. The builds are run without declaring outputs: freshness is decided here,
+        so the incremental mode of the wrappers does not write manifests for the temporary names.
+    """
+
+    BWA_EXTS = ['.amb', '.ann', '.pac', '.bwt', '.sa']
+    FAI_EXT = '.fai'
+    DICT_EXT = '.dict'
+    GZ_EXT = '.gz'
+    FASTA_EXTS = ['.fasta', '.fa', '.fna', '.fas']
+
+    LOCK_TEMPLATE = '.{name}.{kind}.lock'
+
+    BWA = 'bwa'
+    FAI = 'fai'
+    DICT = 'dict'
+
+    def __init__(self, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+    def bwa_files(self, reference):
+        return [f'{reference}{ext}' for ext in self.BWA_EXTS]
+
+    def fai_file(self, reference):
+        return f'{reference}{self.FAI_EXT}'
+
+    def dict_file(self, reference):
+        #Picard convention: the FASTA extension is replaced by .dict
+
+        base = reference[:-len(self.GZ_EXT)] if reference.endswith(self.GZ_EXT) else reference
+        root, ext = os.path.splitext(base)
+
+        return f'{root if ext in self.FASTA_EXTS else base}{self.DICT_EXT}'
+
+    def is_current(self, reference, files):
+        """
+        Checks whether the index files of a reference are complete and up to date.
+
+        Args:
+            reference (str): The reference FASTA file.
+            files (list): The index files.
+
+        Returns:
+            bool: True if every file exists, is not empty and is not older than the reference.
+        """
+
+        try:
+            reference_mtime = os.stat(reference).st_mtime_ns
+            for path in files:
+                stat = os.stat(path)
+                if not stat.st_size or stat.st_mtime_ns < reference_mtime:
+                    return False
+        except OSError:
+            return False
+
+        return True
+
+    def _lock_path(self, reference, kind):
+
+        directory, name = os.path.split(os.path.abspath(reference))
+
+        if not os.access(directory, os.W_OK):
+            #Read-only reference directory: lock in the temporary directory, keyed by the reference path
+            directory = tempfile.gettempdir()
+            name = hashlib.sha256(os.path.abspath(reference).encode()).hexdigest()
+
+        return os.path.join(directory, self.LOCK_TEMPLATE.format(name=name, kind=kind))
+
+    @contextlib.contextmanager
+    def lock(self, reference, kind):
+        """
+        Holds an exclusive file lock for building one kind of index of a reference.
+
+        Args:
+            reference (str): The reference FASTA file.
+            kind (str): The kind of index: 'bwa', 'fai' or 'dict'.
+        """
+
+        with open(self._lock_path(reference, kind), 'a') as lock_file:
+            self.logger.debug(f'Waiting for the {kind} lock of {reference}')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ensure(self, reference, kind, files, tmp_files, build, force=False):
+        #Builds the index if needed, checking again under the lock in case another process has just built it
+
+        if not force and self.is_current(reference, files):
+            return False
+
+        with self.lock(reference, kind):
+
+            if not force and self.is_current(reference, files):
+                self.logger.info(f'{kind} index of {reference} built by another process')
+                return False
+
+            self.logger.info(f'Building {kind} index of {reference}')
+
+            try:
+                result = build(tmp_files)
+
+                if result is None or result.returncode:
+                    raise RuntimeError(f'Could not build the {kind} index of {reference}')
+
+                for tmp_path, path in zip(tmp_files, files):
+                    os.replace(tmp_path, path)
+
+            finally:
+                for tmp_path in tmp_files:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+        return True
+
+    def bwa_index(self, reference, bwa, force=False, **kwargs):
+        """
+        Builds the bwa index of a reference, if it is missing or outdated.
+
+        Args:
+            reference (str): The reference FASTA file.
+            bwa (BwaMapper): The wrapper used to build the index.
+            force (bool, optional): If True, the index is rebuilt even if it is up to date. Defaults to False.
+            **kwargs: Options of bwa index.
+
+        Returns:
+            bool: True if the index was built by this call.
+        """
+
+        tmp_prefix = f'{reference}.tmp{os.getpid()}'
+        tmp_files = [f'{tmp_prefix}{ext}' for ext in self.BWA_EXTS]
+
+        def build(tmp_files):
+            return bwa.launch_command([bwa.SUBCMD_INDEX], kwargs={**kwargs, 'p': tmp_prefix}, args=reference)
+
+        return self._ensure(reference, self.BWA, self.bwa_files(reference), tmp_files, build, force)
+
+    def minimap2_index(self, reference, minimap2, mmi, force=False, **kwargs):
+        """
+        Builds a minimap2 index (.mmi) of a reference, if it is missing or outdated.
+
+        Args:
+            reference (str): The reference FASTA file.
+            minimap2 (Minimap2Mapper): The wrapper used to build the index.
+            mmi (str): The index file. Indexes built with different presets are not interchangeable.
+            force (bool, optional): If True, the index is rebuilt even if it is up to date. Defaults to False.
+            **kwargs: Options of minimap2 used to build the index (preset, batch size...).
+
+        Returns:
+            bool: True if the index was built by this call.
+        """
+
+        def build(tmp_files):
+            return minimap2.launch_command(kwargs={**kwargs, minimap2.INDEX_FLAG: tmp_files[0]}, args=reference)
+
+        #One lock per index file, e.g. 'map-ont.mmi' for <reference>.map-ont.mmi
+        kind = os.path.basename(mmi)
+        prefix = f'{os.path.basename(reference)}.'
+        if kind.startswith(prefix):
+            kind = kind[len(prefix):]
+
+        return self._ensure(reference, kind, [mmi], [f'{mmi}.tmp{os.getpid()}'], build, force)
+
+    def faidx(self, reference, samtools, force=False):
+        """
+        Builds the FASTA index (.fai) of a reference, if it is missing or outdated.
+
+        Args:
+            reference (str): The reference FASTA file.
+            samtools (Samtools): The wrapper used to build the index.
+            force (bool, optional): If True, the index is rebuilt even if it is up to date. Defaults to False.
+
+        Returns:
+            bool: True if the index was built by this call.
+        """
+
+        fai = self.fai_file(reference)
+
+        def build(tmp_files):
+            return samtools.execute_command(samtools.faidx_command(reference, tmp_files[0]).cmd_list)
+
+        return self._ensure(reference, self.FAI, [fai], [f'{fai}.tmp{os.getpid()}'], build, force)
+
+    def sequence_dict(self, reference, samtools, force=False):
+        """
+        Builds the sequence dictionary (.dict) of a reference, if it is missing or outdated.
+
+        Args:
+            reference (str): The reference FASTA file.
+            samtools (Samtools): The wrapper used to build the dictionary.
+            force (bool, optional): If True, the dictionary is rebuilt even if it is up to date. Defaults to False.
+
+        Returns:
+            bool: True if the dictionary was built by this call.
+        """
+
+        dict_file = self.dict_file(reference)
+
+        def build(tmp_files):
+            return samtools.execute_command(samtools.sequence_dict_command(reference, tmp_files[0]).cmd_list)
+
+        return self._ensure(reference, self.DICT, [dict_file], [f'{dict_file}.tmp{os.getpid()}'], build, force)
+
+    def prepare(self, reference, bwa=None, samtools=None):
+        """
+        Builds every missing or outdated index of a reference.
+
+        Args:
+            reference (str): The reference FASTA file.
+            bwa (BwaMapper, optional): If provided, the bwa index is prepared.
+            samtools (Samtools, optional): If provided, the .fai and .dict files are prepared.
+
+        Returns:
+            list: The kinds of index built by this call.
+        """
+
+        built = []
+
+        if samtools is not None:
+            if self.faidx(reference, samtools):
+                built.append(self.FAI)
+            if self.sequence_dict(reference, samtools):
+                built.append(self.DICT)
+
+        if bwa is not None and self.bwa_index(reference, bwa):
+            built.append(self.BWA)
+
+        return built
+
+
+#Registry shared by the wrappers
+REGISTRY = ReferenceRegistry()
@@ -0,0 +1,106 @@
+import math
+
+#Helpers to split a reference into region shards (see Bcftools.scatter_call)
+
+FAI_EXT = '.fai'
+
+
+def read_fai(fai):
+    """
+    Reads the contigs of a FASTA index.
+
+    Args:
+        fai (str): The .fai file path.
+
+    Returns:
+        list: (contig, length) tuples, in reference order.
+    """
+
+    contigs = []
+    with open(fai) as index:
+        for line in index:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2:
+                contigs.append((fields[0], int(fields[1])))
+
+    return contigs
+
+
+#Characters of a contig name that htslib would read as region syntax
+REGION_SEPARATORS = (':', ',')
+
+
+def region_str(contig, start, end):
+    """
+    Formats a region as accepted by samtools/bcftools (1-based, inclusive).
+
+    Note:
+        Contig names with ':' or ',' (e.g. HLA alleles such as HLA-A*01:01:01:01) are written within braces,
+        {contig}:start-end, so htslib does not split the name when parsing the region or a list of regions.
+    """
+
+    if any(separator in contig for separator in REGION_SEPARATORS):
+        contig = f'{{{contig}}}'
+
+    return f'{contig}:{start}-{end}'
+
+
+def shard_regions(contigs, n_shards, reads=None):
+    """
+    Splits a reference into ordered shards of similar work.
+
+    Args:
+        contigs (list): (contig, length) tuples, in reference order.
+        n_shards (int): The target number of shards.
+        reads (dict, optional): A dictionary of {contig : mapped reads}, e.g. from Samtools.idxstats. The work of a
+                                contig is proportional to its reads. Defaults to None (proportional to its length).
+
+    Returns:
+        list: The shards in reference order. Every shard is a list of (contig, start, end) regions, 1-based and
+              inclusive; concatenating the shards in order covers the reference once, in order.
+
+    Note:
+        Contigs heavier than the target work per shard are split into equal-length pieces; consecutive light contigs
+        are grouped in the same shard. The index only knows the reads per contig, so reads are assumed to be
+        uniform within a contig.
+    """
+
+    if reads and sum(reads.get(contig, 0) for contig, _ in contigs):
+        #Contigs without reads still cost a little, so they are not all piled into one shard
+        weights = [reads.get(contig, 0) + length * 1e-6 for contig, length in contigs]
+    else:
+        weights = [float(length) for _, length in contigs]
+
+    target = sum(weights) / max(n_shards, 1)
+
+    shards = []
+    current = []
+    current_weight = 0.0
+
+    for (contig, length), weight in zip(contigs, weights):
+        if not length:
+            continue
+
+        pieces = min(max(1, math.ceil(weight / target)) if target else 1, length)
+        piece_length = math.ceil(length / pieces)
+        piece_weight = weight / pieces
+
+        for piece in range(pieces):
+            start = piece * piece_length + 1
+            end = min((piece + 1) * piece_length, length)
+
+            if start > length:
+                break
+
+            if current and current_weight + piece_weight > target:
+                shards.append(current)
+                current = []
+                current_weight = 0.0
+
+            current.append((contig, start, end))
+            current_weight += piece_weight
+
+    if current:
+        shards.append(current)
+
+    return shards
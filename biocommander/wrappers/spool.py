@@ -0,0 +1,636 @@
+"""
+Job spooling through a directory of a shared filesystem, to run wrapper commands on several nodes.
+
+A driver submits commands (see SpoolQueue.submit, or CommandLineSoftware(spool=...)) and worker daemons started
+on any node that mounts the directory claim and run them:
+
+    python -m biocommander.wrappers.spool worker /shared/spool --slots 4
+    python -m biocommander.wrappers.spool status /shared/spool
+    python -m biocommander.wrappers.spool stop /shared/spool
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from .logger import set_logger
+from . import metrics
+from . import cancel
+import subprocess
+import threading
+import argparse
+import socket
+import signal
+import json
+import time
+import sys
+import os
+
+
+class SpoolQueue():
+    """
+    A job queue kept as files in a directory of a shared POSIX filesystem.
+
+    Args:
+        directory (str): The spool directory. It is created if it does not exist.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        Every job is a JSON file with the command, its working directory and its declared outputs. It is written
+        to tmp/ and renamed into pending/, so workers never read a partial job. A worker claims a job by renaming
+        it from pending/ to running/: rename is atomic, so exactly one of the workers racing for a job succeeds and
+        the others move on to the next file. Jobs are claimed in submission order.
+
+        The worker writes the standard output and error of the job to output/, then the result (exit status,
+        resource usage record, host, missing outputs) to results/, and removes the job from running/. While the
+        job runs, the worker touches its file in running/ every HEARTBEAT seconds; requeue_stale() moves the jobs
+        of dead workers back to pending/, so a job may run more than once if a worker stalls. The live workers and
+        the drivers waiting for results call it every HEARTBEAT seconds.
+
+        cancel() removes a job from pending/, or, once a worker claimed it, leaves a marker in cancelled/ that
+        makes the worker kill the process group of the job.
+
+        The command runs in the working directory of the driver, so relative paths must be valid on every node.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    RESULTS = 'results'
+    OUTPUT = 'output'
+    TMP = 'tmp'
+    CANCELLED = 'cancelled'
+    DIRECTORIES = [PENDING, RUNNING, RESULTS, OUTPUT, TMP, CANCELLED]
+
+    STOP_FILE = 'stop'
+    JOB_EXT = '.json'
+    STDOUT_EXT = '.out'
+    STDERR_EXT = '.err'
+
+    KEY_ID = 'id'
+    KEY_CMD = 'cmd'
+    KEY_SHELL = 'shell'
+    KEY_CWD = 'cwd'
+    KEY_ENV = 'env'
+    KEY_OUTPUTS = 'outputs'
+    KEY_TIMEOUT = 'timeout'
+    KEY_CPU_TIMEOUT = 'cpu_timeout'
+    KEY_SUBMITTED = 'submitted'
+    KEY_ATTEMPTS = 'attempts'
+
+    KEY_RETURNCODE = 'returncode'
+    KEY_METRICS = 'metrics'
+    KEY_WORKER = 'worker'
+    KEY_HOST = 'host'
+    KEY_STARTED = 'started'
+    KEY_FINISHED = 'finished'
+    KEY_MISSING = 'missing_outputs'
+    KEY_ERROR = 'error'
+    KEY_CANCELLED = 'cancelled'
+
+    POLL = 0.5
+    HEARTBEAT = 30
+    STALE_TIMEOUT = 300
+
+    #Exit status of a command that could not be started, as in the shells
+    NOT_STARTED = 127
+
+    def __init__(self, directory, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+        self.directory = os.path.abspath(directory)
+
+        for name in self.DIRECTORIES:
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _path(self, directory, job_id, extension=JOB_EXT):
+        return os.path.join(self.directory, directory, f'{job_id}{extension}')
+
+    def output_path(self, job_id, extension):
+        #Standard output (.out) or error (.err) of a job
+        return self._path(self.OUTPUT, job_id, extension)
+
+    def _new_id(self):
+        #Ids sort in submission order and are unique across drivers
+
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+
+        return f'{time.time_ns():020d}-{socket.gethostname()}-{os.getpid()}-{counter:06d}'
+
+    def _write_json(self, data, path):
+        #Written next to the spool and renamed, so readers never see a partial file
+
+        tmp = os.path.join(self.directory, self.TMP, f'{os.path.basename(path)}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}')
+
+        with open(tmp, 'w') as handle:
+            json.dump(data, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read_json(path):
+
+        with open(path) as handle:
+            return json.load(handle)
+
+    def submit(self, cmd, outputs=(), cwd=None, env=None, shell=False, timeout=None, cpu_timeout=None):
+        """
+        Adds a command to the queue.
+
+        Args:
+            cmd (list, str or CliCommand): The command.
+            outputs (list, optional): The output files written by the command, checked by the worker.
+            cwd (str, optional): The working directory of the command. Defaults to the current directory.
+            env (dict, optional): Variables added to the environment of the worker. Defaults to None.
+            shell (bool, optional): If True, the command is run through the shell. Defaults to False.
+            timeout (float, optional): Wall-clock seconds after which the worker kills the command. Defaults to None.
+            cpu_timeout (float, optional): CPU seconds after which each process of the command is killed. Defaults to None.
+
+        Returns:
+            str: The job id.
+        """
+
+        cmd = getattr(cmd, 'cmd_list', cmd)
+        cwd = os.path.abspath(cwd) if cwd else os.getcwd()
+
+        job = {
+            self.KEY_ID: self._new_id(),
+            self.KEY_CMD: cmd if isinstance(cmd, str) else [str(arg) for arg in cmd],
+            self.KEY_SHELL: shell,
+            self.KEY_CWD: cwd,
+            self.KEY_ENV: dict(env) if env else {},
+            self.KEY_OUTPUTS: [os.path.join(cwd, output) for output in outputs if output],
+            self.KEY_TIMEOUT: timeout,
+            self.KEY_CPU_TIMEOUT: cpu_timeout,
+            self.KEY_SUBMITTED: time.time(),
+            self.KEY_ATTEMPTS: 0,
+        }
+
+        self._write_json(job, self._path(self.PENDING, job[self.KEY_ID]))
+        self.logger.debug(f'Submitted {job[self.KEY_ID]}')
+
+        return job[self.KEY_ID]
+
+    def claim(self):
+        """
+        Claims the oldest pending job.
+
+        Returns:
+            dict: The job, or None if no job is pending.
+        """
+
+        for name in sorted(os.listdir(os.path.join(self.directory, self.PENDING))):
+            if not name.endswith(self.JOB_EXT):
+                continue
+
+            pending = os.path.join(self.directory, self.PENDING, name)
+            running = os.path.join(self.directory, self.RUNNING, name)
+
+            #Touched before the rename, so requeue_stale never takes a job just claimed for a dead one
+            try:
+                os.utime(pending)
+                os.rename(pending, running)
+            except FileNotFoundError:
+                #Claimed by another worker
+                continue
+
+            try:
+                return self._read_json(running)
+            except (OSError, ValueError) as error:
+                self.logger.error(f'Invalid job {name}: {error}')
+                os.replace(running, os.path.join(self.directory, self.TMP, f'{name}.invalid'))
+
+        return None
+
+    def heartbeat(self, job_id):
+        #Marks a running job as alive
+
+        try:
+            os.utime(self._path(self.RUNNING, job_id))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, job_id, result):
+        """
+        Stores the result of a job and removes it from running/.
+
+        Args:
+            job_id (str): The job id.
+            result (dict): The result, see SpoolWorker.run_job.
+        """
+
+        self._write_json(result, self._path(self.RESULTS, job_id))
+
+        for path in (self._path(self.RUNNING, job_id), self._path(self.CANCELLED, job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def cancel(self, job_id):
+        """
+        Cancels a job: it is removed from pending/ if no worker claimed it, otherwise its worker kills it.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            bool: True if the job was removed before running, so no result will be written.
+        """
+
+        try:
+            os.remove(self._path(self.PENDING, job_id))
+            return True
+        except FileNotFoundError:
+            pass
+
+        #Claimed (or being requeued): the marker is checked by the worker before and while the job runs
+        open(self._path(self.CANCELLED, job_id), 'w').close()
+
+        return False
+
+    def cancel_requested(self, job_id):
+        return os.path.exists(self._path(self.CANCELLED, job_id))
+
+    def result(self, job_id):
+        """
+        Returns the result of a job, or None if it has not finished.
+        """
+
+        try:
+            return self._read_json(self._path(self.RESULTS, job_id))
+        except FileNotFoundError:
+            return None
+
+    def wait(self, job_ids, timeout=None, poll=POLL, group=None, stale_timeout=None):
+        """
+        Waits for jobs to finish.
+
+        Args:
+            job_ids (list): The job ids.
+            timeout (float, optional): Maximum seconds to wait. Defaults to None (no limit).
+            poll (float, optional): Seconds between checks of the results directory. Defaults to POLL.
+            group (CancelGroup, optional): If it is cancelled, the unfinished jobs are cancelled. Defaults to None.
+            stale_timeout (float, optional): If set, the jobs of workers without heartbeat for this many seconds
+                                             are requeued while waiting (see requeue_stale). Defaults to None.
+
+        Returns:
+            dict: A dictionary of {job id : result}.
+
+        Raises:
+            TimeoutError: If the jobs do not finish within the timeout.
+            CommandCancelled: If the group is cancelled before the jobs finish.
+        """
+
+        pending = list(job_ids)
+        results = {}
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        last_requeue = time.monotonic()
+
+        while pending:
+            for job_id in list(pending):
+                result = self.result(job_id)
+                if result is not None:
+                    results[job_id] = result
+                    pending.remove(job_id)
+
+            if not pending:
+                break
+
+            if group is not None and group.cancelled:
+                for job_id in pending:
+                    self.cancel(job_id)
+                raise cancel.CommandCancelled(f'Cancelled: {group.reason}')
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f'{len(pending)} spooled jobs did not finish in {timeout} s')
+
+            if stale_timeout is not None and time.monotonic() - last_requeue >= self.HEARTBEAT:
+                self.requeue_stale(stale_timeout)
+                last_requeue = time.monotonic()
+
+            time.sleep(poll)
+
+        return results
+
+    def clean(self, job_id):
+        #Removes the result and the captured outputs of a finished job
+
+        for path in (self._path(self.RESULTS, job_id), self._path(self.CANCELLED, job_id),
+                     self.output_path(job_id, self.STDOUT_EXT), self.output_path(job_id, self.STDERR_EXT)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def requeue_stale(self, timeout=STALE_TIMEOUT):
+        """
+        Moves back to pending/ the running jobs whose worker has not sent a heartbeat for timeout seconds.
+
+        Args:
+            timeout (float, optional): Seconds without heartbeat. Defaults to STALE_TIMEOUT.
+
+        Returns:
+            list: The ids of the requeued jobs.
+        """
+
+        requeued = []
+        now = time.time()
+
+        for name in os.listdir(os.path.join(self.directory, self.RUNNING)):
+            running = os.path.join(self.directory, self.RUNNING, name)
+
+            try:
+                if now - os.stat(running).st_mtime < timeout:
+                    continue
+                job = self._read_json(running)
+            except (OSError, ValueError):
+                continue
+
+            job[self.KEY_ATTEMPTS] = job.get(self.KEY_ATTEMPTS, 0) + 1
+            self._write_json(job, self._path(self.PENDING, job[self.KEY_ID]))
+
+            try:
+                os.remove(running)
+            except FileNotFoundError:
+                pass
+
+            self.logger.warning(f'Requeued stale job {job[self.KEY_ID]}')
+            requeued.append(job[self.KEY_ID])
+
+        return requeued
+
+    def status(self):
+        #Number of jobs in each state
+
+        return {name: len([file for file in os.listdir(os.path.join(self.directory, name)) if file.endswith(self.JOB_EXT)])
+                for name in (self.PENDING, self.RUNNING, self.RESULTS)}
+
+    def stop_workers(self):
+        #Workers started before this call exit once their running jobs finish
+
+        open(os.path.join(self.directory, self.STOP_FILE), 'w').close()
+
+    def stop_requested(self, since):
+        #True if stop_workers was called after 'since' (seconds since the epoch)
+
+        try:
+            return os.stat(os.path.join(self.directory, self.STOP_FILE)).st_mtime >= since
+        except FileNotFoundError:
+            return False
+
+
+class SpoolWorker():
+    """
+    Worker daemon: claims jobs of a SpoolQueue, runs them and writes back their results and resource usage.
+
+    Args:
+        queue (SpoolQueue or str): The queue, or its directory.
+        name (str, optional): Worker name stored in the results. Defaults to host:pid.
+        slots (int, optional): Jobs run at the same time. Defaults to 1.
+        poll (float, optional): Seconds between checks of the queue when it is empty. Defaults to SpoolQueue.POLL.
+        idle_timeout (float, optional): Exit after this many seconds without jobs. Defaults to None (never).
+        max_jobs (int, optional): Exit after running this many jobs. Defaults to None (no limit).
+        stale_timeout (float, optional): Seconds without heartbeat after which the jobs of dead workers are requeued.
+                                         Defaults to SpoolQueue.STALE_TIMEOUT. None disables the requeue.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        Set slots to the cores of the node divided by the threads of the spooled commands. The worker exits when
+        the stop file of the queue exists (SpoolQueue.stop_workers) or on SIGTERM, after its running jobs finish.
+        Every HEARTBEAT seconds it also requeues the jobs of dead workers.
+    """
+
+    def __init__(self, queue, name=None, slots=1, poll=SpoolQueue.POLL, idle_timeout=None, max_jobs=None,
+                 stale_timeout=SpoolQueue.STALE_TIMEOUT, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+        self.queue = queue if isinstance(queue, SpoolQueue) else SpoolQueue(queue, verbosity)
+        self.name = name if name else f'{socket.gethostname()}:{os.getpid()}'
+        self.slots = max(int(slots), 1)
+        self.poll = poll
+        self.idle_timeout = idle_timeout
+        self.max_jobs = max_jobs
+        self.stale_timeout = stale_timeout
+
+        self.completed = 0
+        self._stop = threading.Event()
+        self._started = time.time()
+
+    def stop(self, *args):
+        #Also used as signal handler
+
+        self._stop.set()
+
+    def _monitor(self, job_id, process, done, cancelled):
+        #Sends the heartbeats of a running job and kills it when it is cancelled
+
+        last_beat = time.monotonic()
+
+        while not done.wait(self.poll):
+            if not cancelled.is_set() and self.queue.cancel_requested(job_id):
+                cancelled.set()
+                self.logger.warning(f'Job {job_id} cancelled')
+                cancel.kill_group(process)
+
+            if time.monotonic() - last_beat >= self.queue.HEARTBEAT:
+                self.queue.heartbeat(job_id)
+                last_beat = time.monotonic()
+
+    def run_job(self, job):
+        """
+        Runs a claimed job and stores its result in the queue.
+
+        Args:
+            job (dict): The job, as returned by SpoolQueue.claim.
+
+        Returns:
+            dict: The result: 'id', 'returncode', 'metrics' (see the metrics module), 'worker', 'host',
+                  'started', 'finished', 'missing_outputs', 'error' and 'cancelled'. A job cancelled before it
+                  started is not run and has exit status -SIGKILL, as a job killed by the cancellation.
+        """
+
+        queue = self.queue
+        job_id = job[queue.KEY_ID]
+        cmd = job[queue.KEY_CMD]
+
+        self.logger.info(f'Running {job_id}: {cmd if isinstance(cmd, str) else " ".join(cmd)}')
+
+        done = threading.Event()
+        cancelled = threading.Event()
+
+        env = dict(os.environ, **job.get(queue.KEY_ENV, {}))
+        started = time.time()
+        error = None
+
+        try:
+            if queue.cancel_requested(job_id):
+                cancelled.set()
+                record = metrics.new_record(cmd, timestamp=started)
+                record[metrics.KEY_RETURNCODE] = -signal.SIGKILL
+            else:
+                record = self._run_process(job, env, started, done, cancelled)
+        except OSError as exception:
+            record = metrics.new_record(cmd, timestamp=started)
+            record[metrics.KEY_RETURNCODE] = queue.NOT_STARTED
+            error = str(exception)
+        finally:
+            done.set()
+
+        missing = [] if cancelled.is_set() else [path for path in job.get(queue.KEY_OUTPUTS, []) if not os.path.exists(path)]
+
+        result = {
+            queue.KEY_ID: job_id,
+            queue.KEY_RETURNCODE: record[metrics.KEY_RETURNCODE],
+            queue.KEY_METRICS: record,
+            queue.KEY_WORKER: self.name,
+            queue.KEY_HOST: socket.gethostname(),
+            queue.KEY_STARTED: started,
+            queue.KEY_FINISHED: time.time(),
+            queue.KEY_MISSING: missing,
+            queue.KEY_ERROR: error,
+            queue.KEY_CANCELLED: cancelled.is_set(),
+        }
+
+        if not cancelled.is_set() and (error or result[queue.KEY_RETURNCODE] or missing):
+            self.logger.error(f'Job {job_id} failed: {error if error else f"exit status {result[queue.KEY_RETURNCODE]}"}'
+                              f'{f", missing outputs: {missing}" if missing else ""}')
+
+        queue.complete(job_id, result)
+        self.completed += 1
+
+        return result
+
+    def _run_process(self, job, env, started, done, cancelled):
+        #Runs the command of a job with its outputs captured to the queue, under the monitor thread
+
+        queue = self.queue
+        job_id = job[queue.KEY_ID]
+
+        with open(queue.output_path(job_id, queue.STDOUT_EXT), 'wb') as stdout, \
+             open(queue.output_path(job_id, queue.STDERR_EXT), 'wb') as stderr:
+            start = time.perf_counter()
+            process = subprocess.Popen(job[queue.KEY_CMD], shell=job.get(queue.KEY_SHELL, False), cwd=job.get(queue.KEY_CWD),
+                                       env=env, stdout=stdout, stderr=stderr, start_new_session=True)
+            cancel.limit_cpu(process, job.get(queue.KEY_CPU_TIMEOUT))
+
+        threading.Thread(target=self._monitor, args=(job_id, process, done, cancelled), daemon=True).start()
+        watchdog = cancel.Watchdog(process, job.get(queue.KEY_TIMEOUT))
+
+        try:
+            record = metrics.wait_process(process, start, started)
+        finally:
+            watchdog.cancel()
+
+        record[metrics.KEY_TIMED_OUT] = watchdog.expired
+
+        return record
+
+    def _finished(self, idle_since):
+
+        if self._stop.is_set() or self.queue.stop_requested(self._started):
+            return True
+        if self.max_jobs is not None and self.completed >= self.max_jobs:
+            return True
+
+        return self.idle_timeout is not None and time.monotonic() - idle_since > self.idle_timeout
+
+    def run(self):
+        """
+        Claims and runs jobs until the worker is stopped.
+
+        Returns:
+            int: The number of jobs run.
+        """
+
+        self._started = time.time()
+        self.logger.info(f'Worker {self.name} serving {self.queue.directory} with {self.slots} slots')
+
+        running = set()
+        claimed = 0
+        idle_since = time.monotonic()
+        last_requeue = None
+
+        with ThreadPoolExecutor(max_workers=self.slots) as executor:
+
+            while not self._finished(idle_since) or running:
+
+                running = {future for future in running if not future.done()}
+
+                if self.stale_timeout is not None and (last_requeue is None or time.monotonic() - last_requeue >= self.queue.HEARTBEAT):
+                    self.queue.requeue_stale(self.stale_timeout)
+                    last_requeue = time.monotonic()
+
+                can_claim = len(running) < self.slots and not self._finished(idle_since)
+                if self.max_jobs is not None:
+                    can_claim = can_claim and claimed < self.max_jobs
+
+                job = self.queue.claim() if can_claim else None
+
+                if job is None:
+                    if running:
+                        idle_since = time.monotonic()
+                    time.sleep(self.poll)
+                    continue
+
+                claimed += 1
+                idle_since = time.monotonic()
+                running.add(executor.submit(self.run_job, job))
+
+        self.logger.info(f'Worker {self.name} exiting after {self.completed} jobs')
+
+        return self.completed
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m biocommander.wrappers.spool', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    worker = subparsers.add_parser('worker', help='Run a worker daemon')
+    worker.add_argument('directory')
+    worker.add_argument('--name')
+    worker.add_argument('--slots', type=int, default=1)
+    worker.add_argument('--poll', type=float, default=SpoolQueue.POLL)
+    worker.add_argument('--idle-timeout', type=float)
+    worker.add_argument('--max-jobs', type=int)
+    worker.add_argument('--stale-timeout', type=float, default=SpoolQueue.STALE_TIMEOUT)
+    worker.add_argument('--verbosity', type=int, default=20)
+
+    for action, help in (('status', 'Print the number of jobs in each state'), ('stop', 'Ask the workers to exit'),
+                         ('requeue', 'Requeue the jobs of dead workers')):
+        subparser = subparsers.add_parser(action, help=help)
+        subparser.add_argument('directory')
+        if action == 'requeue':
+            subparser.add_argument('--timeout', type=float, default=SpoolQueue.STALE_TIMEOUT)
+
+    options = parser.parse_args(argv)
+
+    if options.action == 'worker':
+        spool_worker = SpoolWorker(options.directory, options.name, options.slots, options.poll,
+                                   options.idle_timeout, options.max_jobs, options.stale_timeout, options.verbosity)
+        signal.signal(signal.SIGTERM, spool_worker.stop)
+        signal.signal(signal.SIGINT, spool_worker.stop)
+        spool_worker.run()
+        return 0
+
+    queue = SpoolQueue(options.directory)
+
+    if options.action == 'status':
+        print(json.dumps(queue.status()))
+    elif options.action == 'stop':
+        queue.stop_workers()
+    elif options.action == 'requeue':
+        print('\n'.join(queue.requeue_stale(options.timeout)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
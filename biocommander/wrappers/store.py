@@ -0,0 +1,452 @@
+from .logger import set_logger
+from . import incremental
+import numpy as np
+import functools
+import hashlib
+import bisect
+import struct
+import json
+import zlib
+import os
+
+
+class StoredCoverage():
+    """
+    Read-only access to a coverage file written by CoverageStore.
+
+    Args:
+        path (str): The coverage file.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The file holds the coverage of every chromosome as runs of equal depth (run end and depth), split in
+        blocks of BLOCK_RUNS runs that are compressed independently with zlib. The header stores, for every
+        chromosome, the first position of each block and its place in the file (the bin index).
+
+        Opening a file only reads the header. A region query finds its first block by bisection of the block
+        starts and its runs by bisection of the run ends (O(log n)), and decompresses only the blocks that
+        overlap the region; the last decompressed blocks are kept in memory, so neighbouring queries (e.g. the
+        targets of an exome panel, in order) decompress each block once.
+    """
+
+    MAGIC = b'BCOVSTR1'
+    HEADER_SIZE = struct.Struct('<Q')
+
+    KEY_IDENTITY = 'identity'
+    KEY_DTYPE = 'dtype'
+    KEY_ENDS_DTYPE = 'ends_dtype'
+    KEY_CHROMOSOMES = 'chromosomes'
+    KEY_NAME = 'name'
+    KEY_LENGTH = 'length'
+    KEY_BLOCKS = 'blocks'
+
+    #Decompressed blocks kept in memory
+    BLOCK_CACHE = 16
+
+    def __init__(self, path, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+        self.path = path
+
+        self._fd = os.open(path, os.O_RDONLY)
+
+        try:
+            self.header, self._data_start = self.read_header(self._fd)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self.identity = self.header[self.KEY_IDENTITY]
+        self.dtype = np.dtype(self.header[self.KEY_DTYPE])
+        self.ends_dtype = np.dtype(self.header[self.KEY_ENDS_DTYPE])
+
+        self.chrom_sizes = {}
+        #{chromosome : (block starts, [(offset, size, runs), ...])}
+        self.index = {}
+        for chrom in self.header[self.KEY_CHROMOSOMES]:
+            self.chrom_sizes[chrom[self.KEY_NAME]] = chrom[self.KEY_LENGTH]
+            blocks = chrom[self.KEY_BLOCKS]
+            self.index[chrom[self.KEY_NAME]] = ([block[0] for block in blocks], [tuple(block[1:]) for block in blocks])
+
+        self._block = functools.lru_cache(maxsize=self.BLOCK_CACHE)(self._read_block)
+
+    def __repr__(self):
+        return f'StoredCoverage({self.path})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @classmethod
+    def read_header(cls, fd):
+        """
+        Reads the header of a coverage file from an open descriptor.
+
+        Returns:
+            tuple: (header dictionary, file offset of the first block).
+
+        Raises:
+            ValueError: If the file is not a coverage file.
+        """
+
+        prefix = os.pread(fd, len(cls.MAGIC) + cls.HEADER_SIZE.size, 0)
+
+        if len(prefix) < len(cls.MAGIC) + cls.HEADER_SIZE.size or not prefix.startswith(cls.MAGIC):
+            raise ValueError('Not a biocommander coverage file')
+
+        size, = cls.HEADER_SIZE.unpack(prefix[len(cls.MAGIC):])
+
+        return json.loads(os.pread(fd, size, len(prefix))), len(prefix) + size
+
+    def _read_block(self, chrom, idx):
+        #(run ends, depths) of a block
+
+        offset, size, runs = self.index[chrom][1][idx]
+        data = zlib.decompress(os.pread(self._fd, size, self._data_start + offset))
+
+        ends_size = runs * self.ends_dtype.itemsize
+        ends = np.frombuffer(data, dtype=self.ends_dtype, count=runs)
+        values = np.frombuffer(data, dtype=self.dtype, count=runs, offset=ends_size)
+
+        return ends, values
+
+    def runs(self, chrom, start=0, end=None):
+        """
+        Returns the runs of equal depth overlapping a region, clipped to it.
+
+        Args:
+            chrom (str): The chromosome.
+            start (int, optional): 0-based start. Defaults to 0.
+            end (int, optional): End (exclusive). Defaults to the chromosome end.
+
+        Returns:
+            tuple: (run starts, run ends, depths) arrays, 0-based and half-open.
+        """
+
+        if chrom not in self.index:
+            raise ValueError(f"Chromosome '{chrom}' is not in {self.path}")
+
+        length = self.chrom_sizes[chrom]
+        end = length if end is None else min(end, length)
+        start = max(start, 0)
+
+        block_starts, _ = self.index[chrom]
+
+        first = max(bisect.bisect_right(block_starts, start) - 1, 0)
+        last = bisect.bisect_left(block_starts, end)
+
+        if start >= end or first >= last:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=self.dtype)
+
+        blocks = [self._block(chrom, idx) for idx in range(first, last)]
+        ends = np.concatenate([block[0] for block in blocks]).astype(np.int64)
+        values = np.concatenate([block[1] for block in blocks])
+
+        #Consecutive blocks are contiguous: every run starts where the previous one ends
+        starts = np.concatenate(([block_starts[first]], ends[:-1]))
+
+        lo = np.searchsorted(ends, start, side='right')
+        hi = np.searchsorted(ends, end, side='left') + 1
+
+        return np.clip(starts[lo:hi], start, end), np.clip(ends[lo:hi], start, end), values[lo:hi]
+
+    def region(self, chrom, start=0, end=None):
+        """
+        Returns the per-base depth of a region as an array.
+        """
+
+        starts, ends, values = self.runs(chrom, start, end)
+
+        return np.repeat(values, ends - starts)
+
+    def histogram(self, regions=None):
+        """
+        Returns the depth histogram of every chromosome, optionally restricted to regions (see GenomeCoverage.histogram).
+
+        Note:
+            The histograms are weighted by the run lengths, so the bases are never expanded.
+        """
+        from .coverage import GenomeCoverage
+
+        histograms = {}
+
+        if regions is None:
+            for chrom in self.index:
+                starts, ends, values = self.runs(chrom)
+                histograms[chrom] = GenomeCoverage._histogram(values, weights=ends - starts)
+            return histograms
+
+        for chrom, (region_starts, region_ends, _) in regions.merge().intervals.items():
+            runs = [self.runs(chrom, start, end) for start, end in zip(region_starts, region_ends)] if chrom in self.index else []
+
+            values = np.concatenate([run[2] for run in runs]) if runs else np.empty(0, dtype=self.dtype)
+            lengths = np.concatenate([run[1] - run[0] for run in runs]) if runs else np.empty(0, dtype=np.int64)
+
+            #Region bases beyond the chromosome, or on chromosomes without coverage, have depth 0
+            missing = int((region_ends - region_starts).sum()) - int(lengths.sum())
+            histograms[chrom] = GenomeCoverage._histogram(values, missing, weights=lengths)
+
+        return histograms
+
+    def summary(self, thresholds=None, percentiles=None, regions=None):
+        """
+        Computes the depth statistics of every chromosome and of the whole genome (or target), as GenomeCoverage.summary.
+
+        Args:
+            thresholds (list, optional): Depths whose breadth is reported. Defaults to GenomeCoverage.DEFAULT_THRESHOLDS.
+            percentiles (list, optional): Percentiles of the depth reported besides the median. Defaults to GenomeCoverage.DEFAULT_PERCENTILES.
+            regions (str or IntervalSet, optional): A BED file or an IntervalSet of target regions. Defaults to None (every base).
+
+        Returns:
+            DataFrame: One row per chromosome plus a 'genome' row.
+        """
+        from .coverage import GenomeCoverage
+        from .intervals import IntervalSet
+
+        if regions is not None and not isinstance(regions, IntervalSet):
+            regions = IntervalSet.from_bed(regions, self.verbosity)
+
+        return GenomeCoverage._summary_frame(
+            self.histogram(regions),
+            thresholds if thresholds is not None else GenomeCoverage.DEFAULT_THRESHOLDS,
+            percentiles if percentiles is not None else GenomeCoverage.DEFAULT_PERCENTILES,
+        )
+
+    def region_summary(self, chrom, start=0, end=None, thresholds=None, percentiles=None):
+        """
+        Computes the depth statistics of one region.
+
+        Returns:
+            dict: The statistics, with the columns of summary().
+        """
+        from .coverage import GenomeCoverage
+
+        starts, ends, values = self.runs(chrom, start, end)
+        depths, counts = GenomeCoverage._histogram(values, weights=ends - starts)
+
+        return GenomeCoverage._summary_row(
+            chrom, depths, counts,
+            thresholds if thresholds is not None else GenomeCoverage.DEFAULT_THRESHOLDS,
+            percentiles if percentiles is not None else GenomeCoverage.DEFAULT_PERCENTILES,
+        )
+
+    def to_coverage(self):
+        """
+        Expands the runs into a GenomeCoverage with one array per chromosome.
+        """
+        from .coverage import GenomeCoverage
+
+        return GenomeCoverage({chrom: self.region(chrom) for chrom in self.index}, self.verbosity)
+
+
+class CoverageStore():
+    """
+    Persistent cache of genomecov results, keyed by the identity of the source BAM.
+
+    Args:
+        directory (str, optional): The directory of the coverage files. Defaults to $BIOCOMMANDER_CACHE_DIR/coverage,
+                                   or $XDG_CACHE_HOME/biocommander/coverage (~/.cache/biocommander/coverage).
+        mode (str, optional): How the BAM identity is computed: 'stat' (path, size and modification time) or
+                              'hash' (SHA-256 of the content). Defaults to 'stat'.
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        get() runs bedtools genomecov (-bga) the first time a BAM is seen and writes its coverage as a compact,
+        chunked and compressed run-length file (see StoredCoverage); later calls, in this or any other run,
+        only read the header of that file. A BAM that changed (different identity) is recomputed.
+
+        Example:
+            store = CoverageStore()
+            with store.get('sample.bam') as coverage:
+                depth = coverage.region('chr1', 1000000, 1001000)
+                stats = coverage.summary(regions='exome.bed')
+    """
+
+    SUBDIR = 'coverage'
+    EXTENSION = '.bcov'
+
+    #Runs per compressed block
+    BLOCK_RUNS = 1 << 16
+    COMPRESSION_LEVEL = 6
+
+    def __init__(self, directory=None, mode=incremental.STAT, verbosity=20):
+        from .versions import VersionCache
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+        self.verbosity = verbosity
+
+        if mode not in incremental.MODES:
+            raise ValueError(f"Invalid identity mode '{mode}'. Valid modes are {', '.join(incremental.MODES)}")
+
+        self.mode = mode
+        self.directory = directory if directory else os.path.join(os.path.dirname(VersionCache.default_path()), self.SUBDIR)
+
+    def identity(self, bam, **kwargs):
+        """
+        Returns the identity of a BAM and of the genomecov options its coverage is computed with.
+        """
+
+        return [os.path.abspath(bam), incremental.file_identity(bam, self.mode), sorted(kwargs.items())]
+
+    def path(self, bam, **kwargs):
+        """
+        Returns the coverage file of a BAM: one file per BAM path and genomecov options, overwritten when the BAM changes.
+        """
+
+        key = hashlib.sha256(json.dumps([os.path.abspath(bam), sorted(kwargs.items())]).encode()).hexdigest()
+
+        return os.path.join(self.directory, f'{key}{self.EXTENSION}')
+
+    def load(self, bam, **kwargs):
+        """
+        Opens the stored coverage of a BAM.
+
+        Returns:
+            StoredCoverage: The coverage, or None if it is not stored or the BAM changed since it was stored.
+        """
+
+        path = self.path(bam, **kwargs)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            coverage = StoredCoverage(path, self.verbosity)
+        except (OSError, ValueError) as error:
+            self.logger.warning(f'Ignoring unreadable coverage file {path}: {error}')
+            return None
+
+        #Compared as JSON, the form the identity is stored in
+        if coverage.identity != json.loads(json.dumps(self.identity(bam, **kwargs))):
+            self.logger.info(f'{bam} changed since its coverage was stored')
+            coverage.close()
+            return None
+
+        return coverage
+
+    def get(self, bam, bedtools=None, chrom_sizes=None, force=False, **kwargs):
+        """
+        Returns the coverage of a BAM, computing and storing it if it is not stored or out of date.
+
+        Args:
+            bam (str): The BAM file.
+            bedtools (BedTools, optional): The wrapper used to run genomecov. Defaults to a new BedTools.
+            chrom_sizes (dict, optional): A dictionary of {chromosome : length} (see BedTools.get_coverage).
+            force (bool, optional): If True, the coverage is recomputed. Defaults to False.
+            **kwargs: Other genomecov options, e.g. split=True. They are part of the key of the stored file.
+
+        Returns:
+            StoredCoverage: The coverage, or None if genomecov failed.
+        """
+
+        coverage = None if force else self.load(bam, **kwargs)
+
+        if coverage is not None:
+            self.logger.debug(f'Coverage of {bam} loaded from {coverage.path}')
+            return coverage
+
+        if bedtools is None:
+            from .bedtools import BedTools
+            bedtools = BedTools(verbosity=self.verbosity)
+
+        #The identity is taken before genomecov runs, so a BAM rewritten meanwhile is not stored as current
+        identity = self.identity(bam, **kwargs)
+
+        if not bedtools.genomecov(ibam=bam, bga=True, **kwargs):
+            self.logger.error(f'genomecov failed for {bam}; coverage not stored')
+            return None
+
+        genome_coverage = bedtools.get_coverage(chrom_sizes)
+        if genome_coverage is None:
+            return None
+
+        path = self.path(bam, **kwargs)
+        self.write(path, genome_coverage, identity)
+        self.logger.info(f'Coverage of {bam} stored in {path}')
+
+        return StoredCoverage(path, self.verbosity)
+
+    @staticmethod
+    def _encode_runs(array):
+        #Run ends and depths of a per-base array
+
+        if not len(array):
+            return np.empty(0, dtype=np.int64), array[:0]
+
+        ends = np.append(np.flatnonzero(array[1:] != array[:-1]) + 1, len(array))
+
+        return ends, array[ends - 1]
+
+    def write(self, path, coverage, identity):
+        """
+        Writes a GenomeCoverage as a coverage file, atomically.
+
+        Args:
+            path (str): The coverage file.
+            coverage (GenomeCoverage): The coverage.
+            identity (list): The identity of the source, stored in the header (see identity()).
+        """
+
+        dtypes = [array.dtype for array in coverage.arrays.values()]
+        dtype = np.result_type(*dtypes) if dtypes else np.dtype(np.uint8)
+
+        max_length = max(coverage.chrom_sizes.values(), default=0)
+        ends_dtype = np.dtype(np.uint32) if max_length <= np.iinfo(np.uint32).max else np.dtype(np.uint64)
+
+        blocks_data = []
+        chromosomes = []
+        #Block offsets are relative to the end of the header
+        offset = 0
+
+        for chrom, array in coverage.arrays.items():
+            ends, values = self._encode_runs(array)
+            blocks = []
+
+            for first in range(0, len(ends), self.BLOCK_RUNS):
+                block_ends = ends[first:first + self.BLOCK_RUNS]
+                block_values = values[first:first + self.BLOCK_RUNS]
+
+                data = zlib.compress(block_ends.astype(ends_dtype).tobytes() + block_values.astype(dtype).tobytes(),
+                                     self.COMPRESSION_LEVEL)
+
+                block_start = int(ends[first - 1]) if first else 0
+                blocks.append([block_start, offset, len(data), len(block_ends)])
+                blocks_data.append(data)
+                offset += len(data)
+
+            chromosomes.append({
+                StoredCoverage.KEY_NAME: chrom,
+                StoredCoverage.KEY_LENGTH: len(array),
+                StoredCoverage.KEY_BLOCKS: blocks,
+            })
+
+        header = {
+            StoredCoverage.KEY_IDENTITY: identity,
+            StoredCoverage.KEY_DTYPE: dtype.name,
+            StoredCoverage.KEY_ENDS_DTYPE: ends_dtype.name,
+            StoredCoverage.KEY_CHROMOSOMES: chromosomes,
+        }
+
+        encoded = json.dumps(header).encode()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as handle:
+            handle.write(StoredCoverage.MAGIC)
+            handle.write(StoredCoverage.HEADER_SIZE.pack(len(encoded)))
+            handle.write(encoded)
+            for data in blocks_data:
+                handle.write(data)
+
+        os.replace(tmp, path)
@@ -0,0 +1,156 @@
+from . import metrics
+from .cancel import kill_group
+import collections
+import threading
+
+
+class StderrBuffer():
+    """
+    Keeps the last bytes written by a process to its standard error.
+
+    Args:
+        limit (int): The maximum number of bytes kept. Older bytes are discarded.
+
+    Note:
+        The stream is drained by a daemon thread, so a tool that writes a lot of log messages never blocks
+        on a full stderr pipe while its stdout is being consumed.
+    """
+
+    READ_SIZE = 1 << 16
+
+    def __init__(self, stream, limit):
+
+        self.limit = limit
+        self.discarded = 0
+
+        self._chunks = collections.deque()
+        self._size = 0
+
+        self._thread = threading.Thread(target=self._drain, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _drain(self, stream):
+
+        read = getattr(stream, 'read1', stream.read)
+
+        with stream:
+            while chunk := read(self.READ_SIZE):
+                self._chunks.append(chunk)
+                self._size += len(chunk)
+
+                while self._size > self.limit:
+                    excess = self._size - self.limit
+                    first = self._chunks[0]
+                    if len(first) <= excess:
+                        self._chunks.popleft()
+                        removed = len(first)
+                    else:
+                        self._chunks[0] = first[excess:]
+                        removed = excess
+                    self._size -= removed
+                    self.discarded += removed
+
+    def join(self):
+        self._thread.join()
+
+    def getvalue(self):
+        return b''.join(self._chunks)
+
+
+class CommandStream():
+    """
+    Iterates over the standard output of a running command while it is produced.
+
+    Args:
+        process (Popen): The process, launched with stdout=PIPE and stderr=PIPE.
+        started (float): The value of time.perf_counter() when the process was launched.
+        lines (bool, optional): If True, yields lines; otherwise yields byte chunks. Defaults to True.
+        chunk_size (int, optional): Maximum size of the chunks. Defaults to 4 MiB.
+        encoding (str, optional): Encoding of the lines. If None, lines are yielded as bytes. Defaults to 'utf-8'.
+        stderr_limit (int, optional): Bytes of stderr kept in memory (the last ones). Defaults to 1 MiB.
+        on_finish (callable, optional): Called with the resource usage record of the process when it is reaped.
+
+    Note:
+        Only one line or chunk is held in memory at a time, so outputs of any size are processed with constant
+        memory, overlapping with the execution of the tool. Lines keep their trailing newline, as in file iteration.
+
+        Once the output is exhausted, the process is waited for and returncode, stderr and metrics are set.
+        If the consumer stops early, close() (or leaving the with block) closes the pipe, so the tool receives
+        SIGPIPE, and the process is killed if it does not exit.
+    """
+
+    CHUNK_SIZE = 1 << 22
+    STDERR_LIMIT = 1 << 20
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, process, started, lines=True, chunk_size=CHUNK_SIZE, encoding='utf-8', stderr_limit=STDERR_LIMIT, on_finish=None):
+
+        self.process = process
+        self.started = started
+        self.lines = lines
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.on_finish = on_finish
+
+        self.returncode = None
+        self.metrics = None
+
+        self._exhausted = False
+        self._stderr = StderrBuffer(process.stderr, stderr_limit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+
+        stdout = self.process.stdout
+
+        try:
+            if self.lines:
+                for line in stdout:
+                    yield line.decode(self.encoding) if self.encoding else line
+            else:
+                while chunk := stdout.read1(self.chunk_size):
+                    yield chunk
+            self._exhausted = True
+        finally:
+            self.close()
+
+    @property
+    def stderr(self):
+        return self._stderr.getvalue().decode('utf-8', errors='replace')
+
+    @property
+    def success(self):
+        return self.returncode == 0
+
+    def close(self):
+        """
+        Closes the output, waits for the process and collects its exit status, stderr and resource usage.
+        """
+
+        if self.metrics is not None:
+            return
+
+        self.process.stdout.close()
+
+        #A tool still writing gets SIGPIPE; one that ignores it is killed
+        timer = None
+        if not self._exhausted:
+            timer = threading.Timer(self.CLOSE_TIMEOUT, kill_group, (self.process,))
+            timer.start()
+
+        self.metrics = metrics.wait_process(self.process, self.started)
+        self.returncode = self.metrics[metrics.KEY_RETURNCODE]
+
+        if timer:
+            timer.cancel()
+
+        self._stderr.join()
+
+        if self.on_finish:
+            self.on_finish(self.metrics)
+
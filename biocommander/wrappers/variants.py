@@ -1,5 +1,14 @@
 
 from .wrappers import CommandLineSoftware
+from .pipes import CliPipeline
+from .batch import available_cores
+from concurrent.futures import ThreadPoolExecutor
+from .reference import REGISTRY
+from .formats import OutputPolicy
+from . import regions as region_utils
+import tempfile
+import shutil
+import os
 
 #TODO: Mejorar la gestion de outputs
 
@@ -12,113 +21,673 @@ class SamtoolsProject(CommandLineSoftware):
     functionalities for different file types
     such as SAM, BAM, VCF, etc.
 
+    Args:
+        output_policy (OutputPolicy, optional): Chooses the output format, compression level and compression threads,
+            and indexes the outputs. Defaults to OUTPUT_POLICY (None: the format is set by the keyword arguments).
+        *args, **kwargs: The arguments of CommandLineSoftware.
+
     Note:
         This class serves as a base class and should not be instantiated directly.
+
+        The policy is applied to the POLICY_SUBCMDS, unless the call sets the format itself (FORMAT_FLAGS). The
+        methods of those subcommands accept final=True for the final outputs of a workflow (see OutputPolicy).
     """
     SAM = '.sam'
     BAM = '.bam'
     SORTED = '.sorted'
     BAI = '.bai'
+    CSI = '.csi'
+    TBI = '.tbi'
     VCF = '.vcf'
 
+    OUTPUT_FLAG = 'o'
+    INDEX_EXT = BAI
+
     SUBCMD_SORT = 'sort'
     SUBCMD_VIEW  = 'view'
     SUBCMD_INDEX = 'index'
     SUBCMD_MPILEUP = 'mpileup'
+    SUBCMD_IDXSTATS = 'idxstats'
 
     MPILEUP_REF_FLAG = 'f'
 
+    THREADS_EXTRA = True
+
+    INDEX_EXTS = [BAI, CSI]
+
+    OUTPUT_POLICY = None
+    POLICY_KIND = None
+
+    reference = None
+    POLICY_SUBCMDS = []
+    FORMAT_FLAGS = []
+
+    def __init__(self, *args, output_policy=None, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.output_policy = output_policy if output_policy else self.OUTPUT_POLICY
+
     def add_reference(self, reference):
         self.reference = reference
 
-    def sort(self, input, **kwargs):
+    def _policy_kwargs(self, subcommand, output, kwargs, final=False):
+        """
+        Adds the output format, compression level and compression threads chosen by the output policy.
+
+        Args:
+            subcommand (str): The subcommand.
+            output (str): The output file, '' or '-' for stdout.
+            kwargs (dict): The keyword arguments of the command. It is not modified.
+            final (bool, optional): True for the final outputs. Defaults to False.
+
+        Returns:
+            dict: The keyword arguments with the format flags of the software.
+        """
+
+        policy = self.output_policy
+
+        if not policy or subcommand not in self.POLICY_SUBCMDS or any(flag in kwargs for flag in self.FORMAT_FLAGS):
+            return kwargs
+
+        kwargs = dict(kwargs)
+
+        format = policy.output_format(output, self.POLICY_KIND, final)
+        kwargs.update(self._format_kwargs(format, policy.level(final), policy.is_file(output)))
+
+        #Compression threads are in addition to the main one: they are the value of the flag itself
+        if policy.threads and not self.threads and self.THREADS_KWARG not in kwargs and self.THREADS_FLAG not in kwargs:
+            kwargs[self.THREADS_FLAG] = policy.threads
+
+        return kwargs
+
+    def _format_kwargs(self, format, level, to_file):
+        #Format flags of the software, implemented by the subclasses
+
+        return {}
+
+    def _indexes_output(self, subcommand, output, final, result):
+        #Final outputs of the policy are indexed once written; a failed command is not
+
+        if result is not None and result.returncode:
+            return False
+
+        policy = self.output_policy
+
+        return bool(policy) and subcommand in self.POLICY_SUBCMDS and policy.should_index(output, self.POLICY_KIND, final)
+
+    def _indexes_input(self, input):
+        #Inputs of region queries are indexed when the policy asks for it
+
+        policy = self.output_policy
+
+        return bool(policy) and policy.index and isinstance(input, str) and OutputPolicy.indexable(input)
+
+    def _execute_policy_output(self, cmd, method, output, final=False):
+
+        result = self._execute_output(cmd, method, output)
+
+        if self._indexes_output(method, output, final, result):
+            self.ensure_index(output)
+
+        return result
+
+    async def _execute_policy_output_async(self, cmd, method, output, final=False):
+
+        result = await self._execute_output_async(cmd, method, output)
+
+        if self._indexes_output(method, output, final, result):
+            await self.ensure_index_async(output)
+
+        return result
+
+    def has_index(self, input, **kwargs):
+        """
+        Checks whether a file has an index that is not older than the file.
+
+        Args:
+            input (str): The indexed file.
+            **kwargs: The options of the index subcommand, e.g. csi=True.
+
+        Returns:
+            bool: True if the index (or, when no option names one, any index of INDEX_EXTS) is current.
+        """
+
+        indexes = [self.index_output(input, **kwargs)]
+        if not kwargs:
+            indexes.extend(f'{input}{extension}' for extension in self.INDEX_EXTS)
+
+        return any(REGISTRY.is_current(input, [index]) for index in indexes)
+
+    def ensure_index(self, input, **kwargs):
+        """
+        Indexes a file when its index is missing or older than the file.
+
+        Args:
+            input (str): The BGZF file (BAM, CRAM, BCF or bgzipped VCF).
+            **kwargs: The options of the index subcommand.
+
+        Returns:
+            bool: True if the index was built.
+        """
+
+        if self.has_index(input, **kwargs):
+            return False
+
+        self.index(input, **kwargs)
+
+        return True
+
+    async def ensure_index_async(self, input, **kwargs):
+
+        if self.has_index(input, **kwargs):
+            return False
+
+        await self.index_async(input, **kwargs)
+
+        return True
+
+    #Methods ending in _command only build the CliCommand, so it can be piped (see CliPipeline)
+
+    def sort_command(self, input, final=False, **kwargs):
 
-        cmd = self._build_command([self.SUBCMD_SORT], kwargs=kwargs, args = input)
+        kwargs = self._policy_kwargs(self.SUBCMD_SORT, kwargs.get(self.OUTPUT_FLAG), kwargs, final)
 
-        self.execute_command(cmd.cmd_list)
+        return self._build_command([self.SUBCMD_SORT], kwargs=kwargs, args = input)
+
+    def sort(self, input, final=False, **kwargs):
+
+        cmd = self.sort_command(input, final, **kwargs)
+
+        return self._execute_policy_output(cmd, self.SUBCMD_SORT, kwargs.get(self.OUTPUT_FLAG), final)
+
+    def view_command(self, input, regions = [], final=False, **kwargs):
+
+        kwargs = self._policy_kwargs(self.SUBCMD_VIEW, kwargs.get(self.OUTPUT_FLAG), kwargs, final)
+
+        return self._build_command([self.SUBCMD_VIEW], kwargs=kwargs, args=(input, *regions))
         
-    def view(self, input, regions = [], **kwargs):
+    def view(self, input, regions = [], final=False, **kwargs):
+
+        if regions and self._indexes_input(input):
+            self.ensure_index(input)
+
+        cmd = self.view_command(input, regions, final, **kwargs)
         
+        return self._execute_policy_output(cmd, self.SUBCMD_VIEW, kwargs.get(self.OUTPUT_FLAG), final)
+
+    def view_stream(self, input, regions = [], **kwargs):
+        #Records (or VCF lines) yielded while the tool runs, with constant memory (see CommandLineSoftware.stream_command)
+
+        if regions and self._indexes_input(input):
+            self.ensure_index(input)
+
+        #The output policy is not applied: the stream is parsed as SAM/VCF text, not BAM/BCF bytes
         cmd = self._build_command([self.SUBCMD_VIEW], kwargs=kwargs, args=(input, *regions))
-        
-        self.execute_command(cmd.cmd_list)
+
+        return self.stream_command(cmd.cmd_list)
+
+    def index_command(self, input, **kwargs):
+
+        return self._build_command([self.SUBCMD_INDEX], kwargs=kwargs, args=input)
+
+    def index_output(self, input, **kwargs):
+        #Index file written by the index subcommand
+
+        if self.OUTPUT_FLAG in kwargs:
+            return kwargs[self.OUTPUT_FLAG]
+        if 'c' in kwargs or 'csi' in kwargs:
+            return f'{input}{self.CSI}'
+        if 't' in kwargs or 'tbi' in kwargs:
+            return f'{input}{self.TBI}'
+
+        return f'{input}{self.INDEX_EXT}'
 
     def index(self, input, **kwargs):
 
-        cmd = self._build_command([self.SUBCMD_INDEX], kwargs=kwargs, args=input)
+        cmd = self.index_command(input, **kwargs)
 
-        self.execute_command(cmd.cmd_list)
+        return self._execute_output(cmd, self.SUBCMD_INDEX, self.index_output(input, **kwargs))
 
-    def mpileup(self, input=[], output='', **kwargs):
+    def mpileup_command(self, input=[], output='', final=False, **kwargs):
 
         if output:
             kwargs['o'] = output
 
         kwargs[self.MPILEUP_REF_FLAG] = self.reference
+        kwargs = self._policy_kwargs(self.SUBCMD_MPILEUP, output, kwargs, final)
         
-        cmd = self._build_command([self.SUBCMD_MPILEUP], args = input, kwargs=kwargs)
+        return self._build_command([self.SUBCMD_MPILEUP], args = input, kwargs=kwargs)
+
+    def mpileup(self, input=[], output='', final=False, **kwargs):
+
+        cmd = self.mpileup_command(input, output, final, **kwargs)
+
+        return self._execute_policy_output(cmd, self.SUBCMD_MPILEUP, output, final)
+
+    #Asynchronous versions, to run many jobs from one event loop (see CommandLineSoftware.execute_command_async)
+
+    async def sort_async(self, input, final=False, **kwargs):
+
+        cmd = self.sort_command(input, final, **kwargs)
+
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_SORT, kwargs.get(self.OUTPUT_FLAG), final)
+
+    async def view_async(self, input, regions = [], final=False, **kwargs):
 
-        self.execute_command(cmd.cmd_list)
+        if regions and self._indexes_input(input):
+            await self.ensure_index_async(input)
 
+        cmd = self.view_command(input, regions, final, **kwargs)
 
-    def get_version(self):
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_VIEW, kwargs.get(self.OUTPUT_FLAG), final)
+
+    async def index_async(self, input, **kwargs):
+
+        cmd = self.index_command(input, **kwargs)
+
+        return await self._execute_output_async(cmd, self.SUBCMD_INDEX, self.index_output(input, **kwargs))
+
+    async def mpileup_async(self, input=[], output='', final=False, **kwargs):
+
+        cmd = self.mpileup_command(input, output, final, **kwargs)
+
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_MPILEUP, output, final)
+
+
+    def _probe_version(self):
 
         #samtools y bcftools devuelven varias lineas con la versión. Capturamos la primera.
 
-        super().get_version(info_version=False)
+        version = super()._probe_version()
 
-        self.version = self.version.splitlines()[0].strip()
-        self.logger.info(f'Software version: {self.version}')
+        return version.splitlines()[0].strip() if version else None
 
 
 class Samtools(SamtoolsProject):
 
     DEFAULT_COMMAND = 'samtools'
 
+    THREADS_FLAG = '@'
+    THREADED_SUBCMDS = [SamtoolsProject.SUBCMD_SORT, SamtoolsProject.SUBCMD_VIEW, SamtoolsProject.SUBCMD_INDEX]
+
+    #samtools mpileup writes text pileup, only sort and view follow the output policy
+    POLICY_KIND = OutputPolicy.ALIGNMENTS
+    POLICY_SUBCMDS = [SamtoolsProject.SUBCMD_SORT, SamtoolsProject.SUBCMD_VIEW]
+    FORMAT_FLAGS = ['O', 'output_fmt', 'b', 'bam', 'C', 'cram', 'u', 'uncompressed']
+    OUTPUT_FMT_FLAG = 'O'
+    CRAM_REF_FLAG = 'reference'
+
+    SUBCMD_FAIDX = 'faidx'
+    SUBCMD_DICT = 'dict'
+    FAI_IDX_FLAG = 'fai-idx'
+
     
+    def _format_kwargs(self, format, level, to_file):
+        #samtools --output-fmt FORMAT[,level=N]; CRAM is encoded against the reference
+
+        kwargs = {self.OUTPUT_FMT_FLAG: format if level is None or format == OutputPolicy.SAM else f'{format},level={level}'}
+
+        if format == OutputPolicy.CRAM and getattr(self, 'reference', None):
+            kwargs[self.CRAM_REF_FLAG] = self.reference
+
+        return kwargs
+
     def sam_to_bam(self, input, output):
         self.view(input, S=True, b= True, o = output)
+    async def sam_to_bam_async(self, input, output):
+        return await self.view_async(input, S=True, b= True, o = output)
+    def idxstats_command(self, input, **kwargs):
+
+        return self._build_command([self.SUBCMD_IDXSTATS], kwargs=kwargs, args=input)
+
+    def idxstats(self, input, **kwargs):
+        #Mapped reads per contig, read from the BAM index: {contig : mapped reads}
+
+        cmd = self.idxstats_command(input, **kwargs)
+
+        output = self.execute_command(cmd.cmd_list, capture_output=True)
+
+        reads = {}
+        for line in output[self.STDOUT].splitlines():
+            fields = line.split('\t')
+            if len(fields) >= 3 and fields[0] != '*':
+                reads[fields[0]] = int(fields[2])
+
+        return reads
+
+    def faidx_command(self, reference, fai_idx=None, **kwargs):
+
+        if fai_idx:
+            kwargs[self.FAI_IDX_FLAG] = fai_idx
+
+        return self._build_command([self.SUBCMD_FAIDX], kwargs=kwargs, args=reference)
+
+    def faidx(self, reference, fai_idx=None, **kwargs):
+        #Indexes the reference FASTA; prefer REGISTRY.faidx, which skips current indexes and serializes concurrent builds
+
+        cmd = self.faidx_command(reference, fai_idx, **kwargs)
+
+        return self._execute_output(cmd, self.SUBCMD_FAIDX, fai_idx if fai_idx else f'{reference}{region_utils.FAI_EXT}')
+
+    def sequence_dict_command(self, reference, output='', **kwargs):
+
+        if output:
+            kwargs[self.OUTPUT_FLAG] = output
+
+        return self._build_command([self.SUBCMD_DICT], kwargs=kwargs, args=reference)
+
+    def sequence_dict(self, reference, output='', **kwargs):
+        #Sequence dictionary of the reference (.dict), as written by Picard CreateSequenceDictionary
+
+        cmd = self.sequence_dict_command(reference, output, **kwargs)
+
+        return self._execute_output(cmd, self.SUBCMD_DICT, output)
+
+    def prepare_reference(self, reference=None):
+        """
+        Builds the missing or outdated .fai and .dict files of the reference.
+
+        Args:
+            reference (str, optional): The reference FASTA file. Defaults to the reference of the object.
+
+        Returns:
+            list: The kinds of index built by this call (see ReferenceRegistry.prepare).
+
+        Raises:
+            ValueError: If no reference is given and none has been set with add_reference.
+        """
+
+        reference = reference if reference else self.reference
+
+        if not reference:
+            raise ValueError('No reference: pass one to prepare_reference or set it with add_reference')
+
+        return REGISTRY.prepare(reference, samtools=self)
+
     def bam_to_sam(self, input, output):
         pass
 
 class Bcftools(SamtoolsProject):
     DEFAULT_COMMAND = 'bcftools'
 
+    INDEX_EXT = SamtoolsProject.CSI
+    INDEX_EXTS = [SamtoolsProject.CSI, SamtoolsProject.TBI]
+
     SUBCMD_CALL = 'call'
     SUBCMD_NORM = 'norm'
     SUBCMD_CONSENSUS = 'consensus'
     SUBCMD_FILTER = 'filter'
+    SUBCMD_CONCAT = 'concat'
+
+    OUTPUT_TYPE_FLAG = 'O'
+    NO_VERSION_FLAG = 'no_version'
+    REGIONS_FLAG = 'r'
+
+    #Output types of bcftools: compressed/uncompressed BCF, compressed/uncompressed VCF
+    BCF_TYPE = 'b'
+    UBCF_TYPE = 'u'
+    VCF_GZ_TYPE = 'z'
+    VCF_TYPE = 'v'
 
-    def call(self, input, output, **kwargs):
+    BCF = '.bcf'
+    GZ = '.gz'
 
-        kwargs['o'] = output
+    #Shards per worker in scatter_call, so slow shards do not leave workers idle
+    SHARDS_PER_WORKER = 4
+
+    THREADS_FLAG = 'threads'
+    THREADED_SUBCMDS = [
+        SamtoolsProject.SUBCMD_VIEW, SamtoolsProject.SUBCMD_INDEX, SamtoolsProject.SUBCMD_MPILEUP,
+        SUBCMD_CALL, SUBCMD_NORM, SUBCMD_FILTER, SUBCMD_CONCAT
+    ]
+
+    #consensus writes FASTA: it only takes part in the policy by indexing its input
+    POLICY_KIND = OutputPolicy.VARIANTS
+    POLICY_SUBCMDS = [
+        SamtoolsProject.SUBCMD_VIEW, SamtoolsProject.SUBCMD_MPILEUP,
+        SUBCMD_CALL, SUBCMD_NORM, SUBCMD_FILTER, SUBCMD_CONCAT
+    ]
+    FORMAT_FLAGS = [OUTPUT_TYPE_FLAG, 'output_type']
+
+    def call_command(self, input, output='', final=False, **kwargs):
+
+        if output:
+            kwargs['o'] = output
+        kwargs = self._policy_kwargs(self.SUBCMD_CALL, output, kwargs, final)
 
-        cmd = self._build_command([self.SUBCMD_CALL], args=input, kwargs = kwargs)
+        return self._build_command([self.SUBCMD_CALL], args=input, kwargs = kwargs)
 
-        self.execute_command(cmd.cmd_list)
+    def call(self, input, output, final=False, **kwargs):
 
-    def norm(self, input, output, **kwargs):
+        cmd = self.call_command(input, output, final, **kwargs)
 
-        kwargs['o'] = output
+        return self._execute_policy_output(cmd, self.SUBCMD_CALL, output, final)
+
+    def norm_command(self, input, output='', final=False, **kwargs):
+
+        if output:
+            kwargs['o'] = output
+        kwargs = self._policy_kwargs(self.SUBCMD_NORM, output, kwargs, final)
         kwargs['f'] = self.reference
 
-        cmd = self._build_command([self.SUBCMD_NORM], args = input, kwargs=kwargs)
+        return self._build_command([self.SUBCMD_NORM], args = input, kwargs=kwargs)
 
-        self.execute_command(cmd.cmd_list)
+    def norm(self, input, output, final=False, **kwargs):
 
-    def filter(self, input, output, **kwargs):
+        cmd = self.norm_command(input, output, final, **kwargs)
 
-        kwargs['o'] = output
+        return self._execute_policy_output(cmd, self.SUBCMD_NORM, output, final)
 
-        cmd = self._build_command([self.SUBCMD_FILTER], args = input, kwargs=kwargs)
+    def filter_command(self, input, output='', final=False, **kwargs):
 
-        self.execute_command(cmd.cmd_list)
+        if output:
+            kwargs['o'] = output
+        kwargs = self._policy_kwargs(self.SUBCMD_FILTER, output, kwargs, final)
 
-    def consensus(self, input, output, **kwargs):
+        return self._build_command([self.SUBCMD_FILTER], args = input, kwargs=kwargs)
 
-        kwargs['o'] = output
+    def filter(self, input, output, final=False, **kwargs):
+
+        cmd = self.filter_command(input, output, final, **kwargs)
+
+        return self._execute_policy_output(cmd, self.SUBCMD_FILTER, output, final)
+
+    def consensus_command(self, input, output='', **kwargs):
+
+        if output:
+            kwargs['o'] = output
         kwargs['f'] = self.reference
 
-        cmd = self._build_command([self.SUBCMD_CONSENSUS], args = input, kwargs=kwargs)
+        return self._build_command([self.SUBCMD_CONSENSUS], args = input, kwargs=kwargs)
+
+    def consensus(self, input, output, **kwargs):
+        #bcftools consensus reads the variants through their index
+
+        if self._indexes_input(input):
+            self.ensure_index(input)
+
+        cmd = self.consensus_command(input, output, **kwargs)
+
+        return self._execute_output(cmd, self.SUBCMD_CONSENSUS, output)
+
+    async def call_async(self, input, output, final=False, **kwargs):
+
+        cmd = self.call_command(input, output, final, **kwargs)
+
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_CALL, output, final)
+
+    async def norm_async(self, input, output, final=False, **kwargs):
+
+        cmd = self.norm_command(input, output, final, **kwargs)
+
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_NORM, output, final)
+
+    async def filter_async(self, input, output, final=False, **kwargs):
+
+        cmd = self.filter_command(input, output, final, **kwargs)
+
+        return await self._execute_policy_output_async(cmd, self.SUBCMD_FILTER, output, final)
+
+    async def consensus_async(self, input, output, **kwargs):
+
+        if self._indexes_input(input):
+            await self.ensure_index_async(input)
+
+        cmd = self.consensus_command(input, output, **kwargs)
+
+        return await self._execute_output_async(cmd, self.SUBCMD_CONSENSUS, output)
+
+    def concat_command(self, input, output='', final=False, **kwargs):
+
+        if output:
+            kwargs['o'] = output
+        kwargs = self._policy_kwargs(self.SUBCMD_CONCAT, output, kwargs, final)
+
+        return self._build_command([self.SUBCMD_CONCAT], args = input, kwargs=kwargs)
+
+    def concat(self, input, output, final=False, **kwargs):
+
+        cmd = self.concat_command(input, output, final, **kwargs)
+
+        return self._execute_policy_output(cmd, self.SUBCMD_CONCAT, output, final)
+
+    def _format_kwargs(self, format, level, to_file):
+        #bcftools -O b|u|z|v[0-9]. Uncompressed BCF files keep the BGZF blocks (-Ob0) so they can be indexed
+
+        if format == OutputPolicy.VCF:
+            return {self.OUTPUT_TYPE_FLAG: self.VCF_TYPE}
+
+        if format == OutputPolicy.BCF and level == 0 and not to_file:
+            return {self.OUTPUT_TYPE_FLAG: self.UBCF_TYPE}
+
+        output_type = self.BCF_TYPE if format == OutputPolicy.BCF else self.VCF_GZ_TYPE
+
+        return {self.OUTPUT_TYPE_FLAG: output_type if level is None else f'{output_type}{level}'}
+
+    def output_type(self, output):
+        #bcftools output type (-O) matching the extension of the output file
+
+        if output.endswith(self.BCF):
+            return self.BCF_TYPE
+        if output.endswith(self.GZ):
+            return self.VCF_GZ_TYPE
+
+        return self.VCF_TYPE
+
+    def _shard_pipeline(self, input, shard, output, mpileup_kwargs, call_kwargs, filter_kwargs):
+        #mpileup | call [| filter] over the regions of one shard, written as uncompressed BCF
+
+        shard_regions = ','.join(region_utils.region_str(*region) for region in shard)
+
+        stages = [
+            self.mpileup_command(input, **{
+                **mpileup_kwargs, self.REGIONS_FLAG: shard_regions,
+                self.OUTPUT_TYPE_FLAG: self.UBCF_TYPE, self.NO_VERSION_FLAG: True
+            }),
+        ]
+
+        call_output = '' if filter_kwargs is not None else output
+        stages.append(self.call_command('-', call_output, **{
+            **call_kwargs, self.OUTPUT_TYPE_FLAG: self.UBCF_TYPE, self.NO_VERSION_FLAG: True
+        }))
+
+        if filter_kwargs is not None:
+            stages.append(self.filter_command('-', output, **{
+                **filter_kwargs, self.OUTPUT_TYPE_FLAG: self.UBCF_TYPE, self.NO_VERSION_FLAG: True
+            }))
+
+        return CliPipeline(stages, verbosity=self.verbosity)
+
+    def scatter_call(self, input, output, shards=None, workers=None, mpileup_kwargs=None, call_kwargs=None,
+                     filter_kwargs=None, samtools=None, keep_shards=False):
+        """
+        Runs mpileup | call | filter sharded by regions in a worker pool and gathers one ordered, indexed output.
+
+        Args:
+            input (str or list): The sorted and indexed BAM file(s).
+            output (str): The output file. The format follows the extension (.bcf, .vcf.gz or .vcf).
+            shards (int, optional): Number of region shards. Defaults to SHARDS_PER_WORKER shards per worker.
+            workers (int, optional): Number of shards processed at the same time. Defaults to the available cores.
+            mpileup_kwargs (dict, optional): Options of bcftools mpileup. The reference is always added.
+            call_kwargs (dict, optional): Options of bcftools call, e.g. {'m': True, 'v': True}.
+            filter_kwargs (dict, optional): Options of bcftools filter. If None, the filter step is skipped.
+            samtools (Samtools, optional): The wrapper used to read the read counts from the BAM index.
+            keep_shards (bool, optional): If True, the shard files are not removed. Defaults to False.
+
+        Returns:
+            bool: True if every shard and the gather step succeeded.
+
+        Note:
+            The reference is split with its .fai index (see regions.shard_regions) and the shards are balanced by
+            the mapped reads per contig reported by samtools idxstats. Every shard restricts mpileup with -r, so
+            each position is piled up, called and filtered once, with all the reads overlapping it, and the shards,
+            concatenated in reference order, give the same records as the unsharded run. --no-version keeps the
+            command lines out of the headers, so the headers are identical too.
+
+            Each shard streams mpileup -> call -> filter through pipes as uncompressed BCF; only the shard
+            results are written to a temporary directory next to the output.
+        """
+
+        mpileup_kwargs = dict(mpileup_kwargs) if mpileup_kwargs else {}
+        call_kwargs = dict(call_kwargs) if call_kwargs else {}
+        filter_kwargs = dict(filter_kwargs) if filter_kwargs is not None else None
+
+        inputs = input if isinstance(input, (list, tuple)) else [input]
+
+        workers = workers if workers else available_cores()
+        shards = shards if shards else workers * self.SHARDS_PER_WORKER
+
+        contigs = region_utils.read_fai(f'{self.reference}{region_utils.FAI_EXT}')
+
+        samtools = samtools if samtools else Samtools(verbosity=self.verbosity, probe_version=False)
+        reads = {}
+        for bam in inputs:
+            for contig, count in samtools.idxstats(bam).items():
+                reads[contig] = reads.get(contig, 0) + count
+
+        shard_list = region_utils.shard_regions(contigs, shards, reads)
+
+        self.logger.info(f'Calling {len(shard_list)} shards with {workers} workers')
+
+        shard_dir = tempfile.mkdtemp(prefix='.scatter.', dir=os.path.dirname(os.path.abspath(output)))
+        shard_outputs = [os.path.join(shard_dir, f'shard_{idx:06d}{self.BCF}') for idx in range(len(shard_list))]
+
+        pipelines = [
+            self._shard_pipeline(list(inputs), shard, shard_output, mpileup_kwargs, call_kwargs, filter_kwargs)
+            for shard, shard_output in zip(shard_list, shard_outputs)
+        ]
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda pipeline: pipeline.run(), pipelines))
+
+            for pipeline in pipelines:
+                self.metrics.extend(pipeline.metrics)
+
+            failed = [shard for shard, pipeline in zip(shard_list, pipelines) if not pipeline.success]
+
+            if failed:
+                self.logger.error(f'{len(failed)} shards failed, first: {region_utils.region_str(*failed[0][0])}')
+                return False
+
+            result = self.concat(shard_outputs, output, **{
+                self.OUTPUT_TYPE_FLAG: self.output_type(output), self.NO_VERSION_FLAG: True
+            })
+
+            if result is not None and result.returncode:
+                self.logger.error('Concatenation of the shards failed')
+                return False
+
+            if self.output_type(output) != self.VCF_TYPE:
+                result = self.index(output)
+
+                if result is not None and result.returncode:
+                    self.logger.error(f'Indexing of {output} failed')
+                    return False
+
+        finally:
+            if not keep_shards:
+                shutil.rmtree(shard_dir, ignore_errors=True)
 
-        self.execute_command(cmd.cmd_list)
+        return True
@@ -0,0 +1,109 @@
+from .logger import set_logger
+import threading
+import shutil
+import json
+import os
+
+
+class VersionCache():
+    """
+    On-disk cache of the software versions, keyed by the identity of the binary.
+
+    Args:
+        path (str, optional): The JSON file of the cache. Defaults to $BIOCOMMANDER_CACHE_DIR/versions.json, or
+                              $XDG_CACHE_HOME/biocommander/versions.json (~/.cache/biocommander/versions.json).
+        verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+
+    Note:
+        The key is built from the resolved path, size, modification time and inode of the binary, so every
+        installation is probed only once and an upgraded binary is probed again. The file is loaded once per
+        process and rewritten atomically, so concurrent processes never read a partial cache.
+    """
+
+    CACHE_DIR_ENV = 'BIOCOMMANDER_CACHE_DIR'
+    XDG_CACHE_ENV = 'XDG_CACHE_HOME'
+    CACHE_DIR = 'biocommander'
+    CACHE_FILE = 'versions.json'
+
+    def __init__(self, path=None, verbosity=20):
+
+        self.logger = set_logger(self.__class__.__name__, verbosity)
+
+        self.path = path if path else self.default_path()
+
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default_path(cls):
+
+        cache_dir = os.environ.get(cls.CACHE_DIR_ENV)
+
+        if not cache_dir:
+            xdg_cache = os.environ.get(cls.XDG_CACHE_ENV) or os.path.join(os.path.expanduser('~'), '.cache')
+            cache_dir = os.path.join(xdg_cache, cls.CACHE_DIR)
+
+        return os.path.join(cache_dir, cls.CACHE_FILE)
+
+    @staticmethod
+    def binary_key(command, namespace=''):
+        """
+        Builds the cache key of a command.
+
+        Args:
+            command (str): The command, as a name in the PATH or a path.
+            namespace (str, optional): Prefix of the key, e.g. the wrapper class that parses the version. Defaults to ''.
+
+        Returns:
+            str or None: The key, or None if the binary can not be located.
+        """
+
+        binary = shutil.which(command)
+
+        if not binary:
+            return None
+
+        binary = os.path.realpath(binary)
+        stat = os.stat(binary)
+
+        return f'{namespace}|{binary}|{stat.st_size}|{stat.st_mtime_ns}|{stat.st_ino}'
+
+    def _load(self):
+
+        if self._entries is None:
+            try:
+                with open(self.path) as cache:
+                    self._entries = json.load(cache)
+            except (OSError, ValueError):
+                self._entries = {}
+
+        return self._entries
+
+    def get(self, key):
+
+        with self._lock:
+            return self._load().get(key)
+
+    def set(self, key, version):
+        """
+        Stores a version and rewrites the cache file.
+
+        Args:
+            key (str): The key returned by binary_key().
+            version (str): The version of the binary.
+        """
+
+        with self._lock:
+            self._entries = None
+            entries = self._load()
+            entries[key] = version
+
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, 'w') as cache:
+                    json.dump(entries, cache, indent=1)
+                os.replace(tmp_path, self.path)
+            except OSError as error:
+                self.logger.debug(f'Version cache not written: {error}')
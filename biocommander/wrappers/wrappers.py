@@ -2,6 +2,15 @@
 import subprocess
 from .logger import set_logger
 from .cli_cmd import CliCommand
+from .versions import VersionCache
+from . import metrics
+from . import incremental as manifests
+from .streaming import CommandStream
+from .capture import CapturedOutput
+from . import cancel
+import threading
+import weakref
+import time
 import os
 
 
@@ -25,18 +34,43 @@ class CommandLineSoftware():
         DEFAULT_COMMAND (str): Default command for the software.
 
         VERSION_FLAGS (list): List of flags to check the software version.
+        VERSION_CACHE (VersionCache): On-disk cache of the versions, shared by all the wrappers. Set to None to disable it.
+
+        THREADS_FLAG (str): Flag used by the software to set the number of threads, e.g. 't' or '@'. If it is
+            'threads', like THREADS_KWARG, a threads keyword argument is passed to the software unchanged.
+        THREADED_SUBCMDS (list): Subcommands that accept THREADS_FLAG.
+        THREADS_EXTRA (bool): True if THREADS_FLAG sets the number of threads in addition to the main one.
 
         STDOUT (str): Constant representing standard output.
         STDERR (str): Constant representing standard error.
         KWARGS (str): Constant representing keyword arguments.
+        CAPTURE_BUFFER (str): Value of capture_output that returns the captured outputs as CapturedOutput buffers.
+        CAPTURE_SPILL_SIZE (int): Size in bytes above which a captured output is spilled to a temporary file.
+
+        METRICS_JSONL (str): Format name of the JSON Lines metrics export.
+        METRICS_PROMETHEUS (str): Format name of the Prometheus text metrics export.
+
+        ASYNC_CONCURRENCY (int): Maximum number of processes launched concurrently by the *_async methods
+            in one event loop, shared by all the wrappers. Defaults to the number of CPUs.
 
     Args:
         command (str, optional): The command for the software. If not provided, it will be set to the DEFAULT_COMMAND if available.
         shell (bool, optional): If True, enables the shell function for command execution. Defaults to False.
         verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+        threads (int, optional): Total number of threads used by the threaded subcommands. Defaults to None (software default).
+        probe_version (bool, optional): If False, the software version is never probed. Defaults to True.
+        incremental (bool or str, optional): If True or 'stat', commands whose outputs are up to date are skipped.
+            Use 'hash' to compare the inputs by content instead of size and modification time. Defaults to False.
+        spool (SpoolQueue or str, optional): If set, execute_command submits the commands to this shared-filesystem
+            queue and waits for a worker to run them, possibly on another node. Defaults to None (run locally).
+        timeout (float, optional): Wall-clock seconds after which a command is killed. Defaults to None (no limit).
+        cpu_timeout (float, optional): CPU seconds after which each process of a command is killed. Defaults to None.
 
     Note:
         This class should be used as a base class and should not be instantiated directly.
+
+        The software version is probed lazily, the first time the version attribute is used, and stored in
+        VERSION_CACHE, so building many wrapper objects does not spawn any process.
     """
 
     #Messages
@@ -48,11 +82,29 @@ class CommandLineSoftware():
 
     VERSION_FLAGS = ['--version', '-v' ]
 
+    VERSION_CACHE = VersionCache()
+
+    THREADS_KWARG = 'threads'
+    THREADS_FLAG = ''
+    THREADED_SUBCMDS = []
+    THREADS_EXTRA = False
+
     STDOUT = 'stdout'
     STDERR = 'stederr'
     KWARGS = 'kwargs'
+
+    CAPTURE_BUFFER = 'buffer'
+    CAPTURE_SPILL_SIZE = CapturedOutput.SPILL_SIZE
+
+    METRICS_JSONL = 'jsonl'
+    METRICS_PROMETHEUS = 'prometheus'
+
+    ASYNC_CONCURRENCY = os.cpu_count() or 1
+
+    # One semaphore per event loop, shared by all the wrappers
+    _async_semaphores = weakref.WeakKeyDictionary()
         
-    def __init__(self, command ='', shell = False, verbosity = 20):
+    def __init__(self, command ='', shell = False, verbosity = 20, threads = None, probe_version = True, incremental = False, spool = None, timeout = None, cpu_timeout = None):
         """
         Initialize the CommandLineSoftware object.
 
@@ -60,13 +112,37 @@ class CommandLineSoftware():
             command (str, optional): The command for the software. If not provided, it will be set to the DEFAULT_COMMAND if available.
             shell (bool, optional): If True, enables the shell function for command execution. Defaults to False.
             verbosity (int, optional): The verbosity level for logging. Defaults to 20.
+            threads (int, optional): Total number of threads used by the threaded subcommands. Defaults to None (software default).
+            probe_version (bool, optional): If False, the software version is never probed, e.g. for objects built in hot loops.
+                Defaults to True.
+            incremental (bool or str, optional): If True or 'stat', commands whose outputs are up to date are skipped.
+                Use 'hash' to compare the inputs by content instead of size and modification time. Defaults to False.
+            spool (SpoolQueue or str, optional): Queue, or its directory, the commands are submitted to. Defaults to None.
+            timeout (float, optional): Wall-clock seconds after which a command is killed. Defaults to None (no limit).
+            cpu_timeout (float, optional): CPU seconds after which each process of a command is killed (RLIMIT_CPU).
+                Defaults to None (no limit).
         """
         
         self.verbosity = verbosity
+        self.threads = threads
+        self.timeout = timeout
+        self.cpu_timeout = cpu_timeout
+        self.probe_version = probe_version
+
+        if incremental is True:
+            incremental = manifests.STAT
+        if incremental and incremental not in manifests.MODES:
+            raise ValueError(f"Invalid 'incremental' value. Valid values are True, False, {', '.join(manifests.MODES)}")
+        self.incremental = incremental
         self.logger = set_logger(self.__class__.__name__, self.verbosity)
 
         self._shell = shell
 
+        if isinstance(spool, str):
+            from .spool import SpoolQueue
+            spool = SpoolQueue(spool, verbosity)
+        self.spool = spool
+
 
         if command:
             self.command = command
@@ -79,9 +155,29 @@ class CommandLineSoftware():
         self.cli_command = ''
 
         self.last_outputs = {}
-        self.get_version()
+        #Resource usage records of the executed commands (see the metrics module)
+        self.metrics = []
+
+        self._version = None
+        self._version_probed = False
+
         self._shell_warning()
 
+    @property
+    def version(self):
+        #The version is probed the first time it is requested
+
+        if not self._version_probed and self.probe_version:
+            self.get_version()
+
+        return self._version
+
+    @version.setter
+    def version(self, version):
+
+        self._version = version
+        self._version_probed = True
+
     def _shell_warning(self):
 
         if self._shell:
@@ -101,7 +197,12 @@ class CommandLineSoftware():
 
         Note:
             The subcommands must be provided in the correct order, as they will be used to construct the command in sequence.
+
+            A 'threads' keyword argument (or the threads attribute) is translated into the THREADS_FLAG of the software.
         """
+
+        kwargs = self._threads_kwargs(subcommands, kwargs)
+
         cli_command = CliCommand(
             cmd=self.command,
             subcmds=subcommands,
@@ -112,6 +213,55 @@ class CommandLineSoftware():
 
         return cli_command
 
+    def _threads_kwargs(self, subcommands, kwargs):
+        """
+        Translates the unified 'threads' option into the threads flag of the software.
+
+        Args:
+            subcommands (list): The subcommands of the command.
+            kwargs (dict): The keyword arguments of the command. It is not modified.
+
+        Returns:
+            dict: The keyword arguments with the threads flag, when the subcommand accepts it.
+
+        Note:
+            'threads' is the total number of threads. When THREADS_EXTRA is True (e.g. samtools -@) the flag is
+            set to threads - 1, and omitted for a single thread. A threads flag given explicitly is never replaced.
+
+            When THREADS_FLAG is named like the keyword argument (bcftools --threads), a 'threads' keyword argument
+            is the flag of the software itself and is passed as it is, on every subcommand; only the threads
+            attribute is translated. A 'threads' keyword argument that a subcommand does not accept is dropped
+            with a warning.
+        """
+
+        kwargs = dict(kwargs) if kwargs else {}
+
+        requested = kwargs.pop(self.THREADS_KWARG, None)
+
+        if requested and self.THREADS_FLAG == self.THREADS_KWARG:
+            kwargs[self.THREADS_FLAG] = requested
+            return kwargs
+
+        threads = requested or self.threads
+
+        if not threads:
+            return kwargs
+
+        subcommand = subcommands[0] if subcommands else ''
+
+        if not self.THREADS_FLAG or subcommand not in self.THREADED_SUBCMDS:
+            #The threads attribute applies to the subcommands that accept it; an explicit option is worth a warning
+            log = self.logger.warning if requested else self.logger.debug
+            log(f'{self.command} {subcommand} does not accept threads, option ignored')
+            return kwargs
+
+        value = threads - 1 if self.THREADS_EXTRA else threads
+
+        if value > 0 and self.THREADS_FLAG not in kwargs:
+            kwargs[self.THREADS_FLAG] = value
+
+        return kwargs
+
     def dynamic_output(self, input, output_extension):
         #Not work. FIx
         input_name = os.path.splitext(os.path.basename(input))
@@ -119,32 +269,461 @@ class CommandLineSoftware():
         return output
 
 
-    def execute_command(self, cmd, capture_output = False):
+    def execute_command(self, cmd, capture_output = False, outputs = None):
         """
         Executes the provided command and returns the result.
 
         Args:
             cmd (list or str): The command to be executed, provided as a list or a string.
-            capture_output (bool, optional): If True, captures the command's output. Defaults to False.
+            capture_output (bool or str, optional): If True, captures the command's output. Use 'buffer' to
+                receive the outputs as CapturedOutput objects instead of strings. Defaults to False.
+            outputs (list, optional): The output files written by the command. Required by the incremental mode.
 
         Returns:
-            CompletedProcess or dict: The CompletedProcess object returned by subprocess.run if capture_output is False,
-            otherwise, a dictionary containing the captured standard output and standard error as strings.
+            CompletedProcess or dict: A CompletedProcess object if capture_output is False, otherwise, a dictionary
+            containing the captured standard output and standard error as strings. With capture_output='buffer',
+            a CompletedProcess whose stdout and stderr are CapturedOutput objects. A skipped command returns
+            None.
 
         Note:
             Executing the command as a list is considered more secure than executing it as a string.
+
+            The wall time, CPU times, peak RSS, I/O bytes and exit status of the command are appended to the
+            metrics attribute (see export_metrics).
+
+            Captured outputs larger than CAPTURE_SPILL_SIZE are written to a temporary file instead of memory.
+            With capture_output='buffer' they are read through a memory map, so parsers consume them without
+            any copy, e.g. pd.read_csv(result.stdout.open()) or np.frombuffer(result.stdout.buffer, ...).
+            Close them (or use them as context managers) to remove the temporary files.
+
+            In incremental mode, the command, the software version and the identity of the input files (the files
+            of the command that are not outputs) are stored in a manifest next to each output. The command is skipped
+            when every output exists, has not been modified and its manifest matches.
+
+            With a spool, the command is run by a worker of the queue and this call waits for its result; the metrics
+            record is the one measured by the worker. Run several calls from threads (e.g. BatchRunner or TaskGraph)
+            to spread them across the workers.
+
+            A command that exceeds the timeout is killed with its whole process group and its record is marked
+            'timed_out'. Inside a fail-fast CancelGroup (BatchRunner, CliPipeline or TaskGraph with fail_fast=True), a
+            non-zero exit status cancels the group, and commands started in a cancelled group raise CommandCancelled.
         """
-        
+
+        manifest = None
+        if self.incremental and outputs and not capture_output:
+            manifest = manifests.build_manifest(cmd, self.version, outputs, self.incremental)
+            if manifests.is_up_to_date(manifest, outputs):
+                self.logger.info(f'Outputs up to date, skipping: {" ".join(str(arg) for arg in cmd)}')
+                return None
+
+        if self.spool is not None:
+            returncode, captured = self._execute_spooled(cmd, capture_output, outputs)
+        else:
+            returncode, captured = self._execute_local(cmd, capture_output)
+
+        result = subprocess.CompletedProcess(cmd, returncode, captured.get(self.STDOUT), captured.get(self.STDERR))
+
+        if manifest and not returncode:
+            manifests.write_manifest(manifest, outputs)
+
+        if capture_output == self.CAPTURE_BUFFER:
+            return result
+
+        if capture_output:
+            try:
+                return self.capture_output(result)
+            finally:
+                for output in captured.values():
+                    output.close()
+
+        return result
+
+    def _execute_local(self, cmd, capture_output):
+
+        pipe = subprocess.PIPE if capture_output else None
+
+        started = time.perf_counter()
+        process = self.open_command(cmd, stdout=pipe, stderr=pipe)
+        watchdog = cancel.Watchdog(process, self.timeout)
+
+        #Both pipes are drained while the process runs, so a full pipe can not block it
+        captured = {}
+        readers = []
+        try:
+            if capture_output:
+                for key, stream in ((self.STDOUT, process.stdout), (self.STDERR, process.stderr)):
+                    captured[key] = CapturedOutput(self.CAPTURE_SPILL_SIZE)
+                    reader = threading.Thread(target=self._read_stream, args=(stream, captured[key]), daemon=True)
+                    reader.start()
+                    readers.append(reader)
+
+            record = metrics.wait_process(process, started)
+
+        except BaseException:
+            #e.g. KeyboardInterrupt: the tool runs in its own session and would outlive us
+            cancel.kill_group(process)
+            process.wait()
+            raise
+
+        finally:
+            watchdog.cancel()
+
+        self._finish_command(record, watchdog)
+
+        for reader in readers:
+            reader.join()
+
+        return process.returncode, captured
+
+    def _finish_command(self, record, watchdog):
+        #Resource usage of a finished command, marked when the watchdog killed it
+
+        if watchdog.expired:
+            record[metrics.KEY_TIMED_OUT] = True
+            self.logger.error(f'Command killed after the timeout of {watchdog.timeout} s: {record[metrics.KEY_CMD]}')
+
+        return self.record_metrics(record)
+
+    def _execute_spooled(self, cmd, capture_output, outputs):
+        #Submits the command to the spool and waits for a worker to run it. A cancelled group cancels the job
+
+        group = cancel.current_group()
+        if group:
+            group.check()
+
+        job_id = self.spool.submit(cmd, outputs if outputs else (), shell=self._shell, timeout=self.timeout, cpu_timeout=self.cpu_timeout)
+        self.logger.info(f'Spooled {job_id}: {cmd if isinstance(cmd, str) else " ".join(cmd)}')
+
+        try:
+            #Jobs of workers that died are requeued, so the wait does not hang on them
+            result = self.spool.wait([job_id], group=group, stale_timeout=self.spool.STALE_TIMEOUT)[job_id]
+        except BaseException:
+            #e.g. KeyboardInterrupt: the job must not keep running on its worker
+            self.spool.cancel(job_id)
+            raise
+
+        if result.get(self.spool.KEY_CANCELLED):
+            self.logger.warning(f'{job_id} was cancelled')
+
+        self.logger.debug(f'{job_id} ran on {result[self.spool.KEY_HOST]} ({result[self.spool.KEY_WORKER]})')
+        self.record_metrics(result[self.spool.KEY_METRICS])
+
+        if result[self.spool.KEY_ERROR]:
+            self.logger.error(f'{job_id} could not be started: {result[self.spool.KEY_ERROR]}')
+
+        captured = {}
+        if capture_output:
+            for key, extension in ((self.STDOUT, self.spool.STDOUT_EXT), (self.STDERR, self.spool.STDERR_EXT)):
+                captured[key] = CapturedOutput(self.CAPTURE_SPILL_SIZE)
+                self._read_stream(open(self.spool.output_path(job_id, extension), 'rb'), captured[key])
+
+        self.spool.clean(job_id)
+
+        return result[self.spool.KEY_RETURNCODE], captured
+
+    @staticmethod
+    def _read_stream(stream, captured):
+
+        with stream:
+            captured.read_from(stream)
+
+    def record_metrics(self, record):
+        """
+        Stores the resource usage record of an executed command in the metrics attribute.
+
+        Args:
+            record (dict): The record, as returned by metrics.wait_process.
+
+        Returns:
+            dict: The record.
+        """
+
+        self.metrics.append(record)
+
+        if record[metrics.KEY_RETURNCODE]:
+            self.logger.warning(f'Command exited with status {record[metrics.KEY_RETURNCODE]}: {record[metrics.KEY_CMD]}')
+
+            group = cancel.current_group()
+            if group:
+                group.fail(f'{record[metrics.KEY_CMD]} exited with status {record[metrics.KEY_RETURNCODE]}')
+
+        self.logger.debug(f'Resource usage: {record}')
+
+        return record
+
+    def export_metrics(self, output, format = METRICS_JSONL, append = True):
+        """
+        Exports the resource usage records of the executed commands.
+
+        Args:
+            output (str): The output file path.
+            format (str, optional): 'jsonl' (one JSON record per line) or 'prometheus' (text file aggregated by
+                                    tool and subcommand). Defaults to 'jsonl'.
+            append (bool, optional): If True, JSON Lines records are appended to the file. Defaults to True.
+
+        Raises:
+            ValueError: If the format is not valid.
+        """
+
+        if format == self.METRICS_JSONL:
+            metrics.write_jsonl(self.metrics, output, append=append)
+        elif format == self.METRICS_PROMETHEUS:
+            metrics.write_prometheus(self.metrics, output)
+        else:
+            raise ValueError(f"Invalid metrics format. Valid values are {self.METRICS_JSONL}, {self.METRICS_PROMETHEUS}")
+
+    def open_command(self, cmd, stdin=None, stdout=subprocess.PIPE, stderr=None):
+        """
+        Starts the provided command without waiting for it to finish.
+
+        Args:
+            cmd (list or str): The command to be executed, provided as a list or a string.
+            stdin (optional): Standard input of the process, as accepted by subprocess.Popen. Defaults to None.
+            stdout (optional): Standard output of the process. Defaults to subprocess.PIPE.
+            stderr (optional): Standard error of the process. Defaults to None (inherited).
+
+        Returns:
+            Popen: The running process. The caller is responsible for consuming its pipes and waiting for it.
+
+        Raises:
+            CommandCancelled: If the CancelGroup of the current thread has been cancelled.
+
+        Note:
+            Use this method instead of execute_command when the output must be consumed while the
+            process runs, e.g. to parse large outputs in chunks without holding them in memory.
+
+            The process leads its own session and process group, so it can be killed with every process it
+            forks (see cancel.kill_group), and its CPU time is limited by cpu_timeout. It is registered with the
+            CancelGroup of the current thread.
+        """
+
+        group = cancel.current_group()
+        if group:
+            group.check()
+
         if not isinstance(cmd, list):
             self.logger.warning('Executing command string instead of list are more insecure! Please, consider use list')
         self.logger.info(f'Executing: {" ".join(cmd)}')
 
-        result = subprocess.run(cmd, shell=self._shell, capture_output=capture_output)
+        process = subprocess.Popen(cmd, shell=self._shell, stdin=stdin, stdout=stdout, stderr=stderr,
+                                   start_new_session=True)
+        cancel.limit_cpu(process, self.cpu_timeout)
+
+        if group:
+            group.register(process)
+
+        return process
+
+    def stream_command(self, cmd, lines=True, chunk_size=CommandStream.CHUNK_SIZE, encoding='utf-8', stderr_limit=CommandStream.STDERR_LIMIT):
+        """
+        Starts the provided command and returns an iterator over its standard output.
+
+        Args:
+            cmd (list or str): The command to be executed, provided as a list or a string.
+            lines (bool, optional): If True, yields the output line by line; otherwise in byte chunks. Defaults to True.
+            chunk_size (int, optional): Maximum size of the chunks. Defaults to 4 MiB.
+            encoding (str, optional): Encoding of the lines. If None, lines are yielded as bytes. Defaults to 'utf-8'.
+            stderr_limit (int, optional): Bytes of stderr kept, the last ones. Defaults to 1 MiB.
+
+        Returns:
+            CommandStream: The iterator. Its returncode, stderr and metrics attributes are set once the output
+                           is exhausted or the stream is closed.
+
+        Note:
+            Unlike execute_command(capture_output=True), the output is never held in memory, so outputs of tens
+            of GB are processed with constant memory while the tool runs, e.g.:
+
+                with samtools.stream_command(samtools.view_command('sample.bam').cmd_list) as stream:
+                    for line in stream:
+                        ...
+
+            Stderr is drained concurrently into a bounded buffer, so the tool never blocks on it. The timeout
+            counts from the start of the command, including the time spent by the consumer.
+        """
+
+        started = time.perf_counter()
+        process = self.open_command(cmd, stderr=subprocess.PIPE)
+        watchdog = cancel.Watchdog(process, self.timeout)
+
+        def on_finish(record):
+            watchdog.cancel()
+            self._finish_command(record, watchdog)
+
+        return CommandStream(process, started, lines, chunk_size, encoding, stderr_limit, on_finish=on_finish)
+
+    def launch_stream(self, subcommands=None, args = (), kwargs = None, **options):
+        """
+        Constructs the command like launch_command and streams its standard output (see stream_command).
+
+        Args:
+            subcommands (list, optional): A list of subcommands to include in the command. Defaults to None.
+            args (tuple, optional): A tuple of arguments to include in the command. Defaults to an empty tuple.
+            kwargs (dict, optional): A dictionary of keyword arguments to include in the command. Defaults to None.
+            **options: Options of stream_command.
+
+        Returns:
+            CommandStream: The iterator over the standard output.
+        """
+
+        cmd = self._build_command(subcommands, args, kwargs)
+        return self.stream_command(cmd.cmd_list, **options)
+
+    @classmethod
+    def set_async_concurrency(cls, limit):
+        """
+        Sets the maximum number of processes launched concurrently by the *_async methods.
+
+        Args:
+            limit (int): The maximum number of concurrent processes in each event loop.
+
+        Note:
+            The limit is shared by every wrapper, so one event loop never runs more than 'limit' tools at once.
+        """
+
+        if limit < 1:
+            raise ValueError('The concurrency limit must be greater than 0')
+
+        CommandLineSoftware.ASYNC_CONCURRENCY = limit
+        CommandLineSoftware._async_semaphores.clear()
+
+    def _async_semaphore(self):
+        #asyncio is imported by the asynchronous methods only, to keep the import of the wrappers fast
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+
+        semaphore = CommandLineSoftware._async_semaphores.get(loop)
+
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(CommandLineSoftware.ASYNC_CONCURRENCY)
+            CommandLineSoftware._async_semaphores[loop] = semaphore
+
+        return semaphore
+
+    async def open_command_async(self, cmd, stdin=None, stdout=subprocess.PIPE, stderr=None):
+        """
+        Starts the provided command as an asyncio subprocess without waiting for it to finish.
+
+        Args:
+            cmd (list or str): The command to be executed, provided as a list or a string.
+            stdin (optional): Standard input of the process. Defaults to None (inherited).
+            stdout (optional): Standard output of the process. Defaults to subprocess.PIPE.
+            stderr (optional): Standard error of the process. Defaults to None (inherited).
+
+        Returns:
+            asyncio.subprocess.Process: The running process.
+
+        Note:
+            This method does not take a slot of the concurrency limit; the caller must hold it while the process runs.
+        """
+
+        if not isinstance(cmd, list):
+            self.logger.warning('Executing command string instead of list are more insecure! Please, consider use list')
+        self.logger.info(f'Executing: {" ".join(cmd)}')
+
+        import asyncio
+
+        if self._shell:
+            cmd = cmd if isinstance(cmd, str) else ' '.join(cmd)
+            process = await asyncio.create_subprocess_shell(cmd, stdin=stdin, stdout=stdout, stderr=stderr,
+                                                            start_new_session=True)
+        else:
+            process = await asyncio.create_subprocess_exec(*cmd, stdin=stdin, stdout=stdout, stderr=stderr,
+                                                           start_new_session=True)
+
+        cancel.limit_cpu(process, self.cpu_timeout)
+
+        return process
+
+    async def execute_command_async(self, cmd, capture_output = False, outputs = None):
+        """
+        Asynchronous version of execute_command, built on asyncio subprocesses.
+
+        Args:
+            cmd (list or str): The command to be executed, provided as a list or a string.
+            capture_output (bool, optional): If True, captures the command's output. Defaults to False.
+            outputs (list, optional): The output files written by the command. Required by the incremental mode.
+
+        Returns:
+            CompletedProcess or dict: A CompletedProcess object if capture_output is False, otherwise, a dictionary
+            containing the captured standard output and standard error as strings.
+
+        Note:
+            At most ASYNC_CONCURRENCY commands run at the same time in an event loop; the rest wait for a free slot.
+            Standard output and standard error are read concurrently, so large outputs can not deadlock the process.
+
+            asyncio reaps its own subprocesses, so only the wall time and exit status are added to the metrics attribute.
+
+            With a spool, the synchronous execute_command runs in a worker thread of the event loop.
+
+            A command that exceeds the timeout, or whose task is cancelled, is killed with its process group.
+        """
+
+        if self.spool is not None:
+            import asyncio
+            return await asyncio.to_thread(self.execute_command, cmd, capture_output, outputs)
+
+        manifest = None
+        if self.incremental and outputs and not capture_output:
+            manifest = manifests.build_manifest(cmd, self.version, outputs, self.incremental)
+            if manifests.is_up_to_date(manifest, outputs):
+                self.logger.info(f'Outputs up to date, skipping: {" ".join(str(arg) for arg in cmd)}')
+                return None
+
+        pipe = subprocess.PIPE if capture_output else None
+
+        import asyncio
+
+        timed_out = False
+
+        async with self._async_semaphore():
+            started = time.perf_counter()
+            process = await self.open_command_async(cmd, stdout=pipe, stderr=pipe)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                cancel.kill_group(process)
+                stdout, stderr = await process.communicate()
+            except BaseException:
+                cancel.kill_group(process)
+                raise
+
+        record = self._record_async_metrics(cmd, process, started)
+
+        if timed_out:
+            record[metrics.KEY_TIMED_OUT] = True
+            self.logger.error(f'Command killed after the timeout of {self.timeout} s: {record[metrics.KEY_CMD]}')
+
+        result = subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+        if manifest and not process.returncode:
+            manifests.write_manifest(manifest, outputs)
 
         if capture_output:
             return self.capture_output(result)
-    
-    def launch_command(self, subcommands=None, args = (), kwargs = None, capture_output= False ):
+
+        return result
+
+    def _record_async_metrics(self, cmd, process, started):
+        #asyncio reaps its subprocesses, so rusage and /proc/<pid>/io are not available
+
+        record = metrics.new_record(cmd, process.pid)
+        record[metrics.KEY_WALL] = time.perf_counter() - started
+        record[metrics.KEY_TIMESTAMP] -= record[metrics.KEY_WALL]
+        record[metrics.KEY_RETURNCODE] = process.returncode
+
+        return self.record_metrics(record)
+
+    async def launch_command_async(self, subcommands=None, args = (), kwargs = None, capture_output= False, outputs = None):
+        """
+        Asynchronous version of launch_command. See execute_command_async.
+        """
+
+        cmd = self._build_command(subcommands, args, kwargs)
+        return await self.execute_command_async(cmd.cmd_list, capture_output=capture_output, outputs=outputs)
+
+    def launch_command(self, subcommands=None, args = (), kwargs = None, capture_output= False, outputs = None):
         """
         Constructs and executes the command based on the provided subcommands, arguments, and keyword arguments.
 
@@ -153,38 +732,79 @@ class CommandLineSoftware():
             args (tuple, optional): A tuple of arguments to include in the command. Defaults to an empty tuple.
             kwargs (dict, optional): A dictionary of keyword arguments to include in the command. Defaults to None.
             capture_output (bool, optional): If True, captures the command's output. Defaults to False.
+            outputs (list, optional): The output files written by the command. Required by the incremental mode.
 
         Note:
             The 'subcommands' parameter is a list, 'args' is a tuple, and 'kwargs' is a dictionary.
         """
 
         cmd = self._build_command(subcommands, args, kwargs)
-        self.execute_command(cmd.cmd_list, capture_output=capture_output)
+        return self.execute_command(cmd.cmd_list, capture_output=capture_output, outputs=outputs)
         
     def get_version(self, info_version = True):
         """
-        Retrieves the software version using the provided VERSION_FLAGS.
+        Retrieves the software version from VERSION_CACHE, or probes it with _probe_version.
 
         Args:
             info_version (bool, optional): If True, logs the software version if found. Defaults to True.
-                Set info_version to False when the subclass needs to perform specific manipulations
-                of the version output
 
         Note:
-            If the software version is not found, a warning message is logged.
+            If the software version is not found, a warning message is logged. Versions not found are not cached.
+            Subclasses that need specific manipulations of the version output override _probe_version.
         """
 
-        self.version = None
-        for version_flag in self.VERSION_FLAGS:
-            version = subprocess.run([self.command, version_flag], capture_output=True, text=True)
-            if version.stdout:
-                self.version = version.stdout.strip()
-                if info_version:
-                    self.logger.info(f'Software version: {self.version}')
-                break
+        cache = self.VERSION_CACHE
+        key = VersionCache.binary_key(self.command, self.__class__.__name__) if cache else None
+
+        version = cache.get(key) if key else None
+
+        if version is None:
+            version = self._probe_version()
+            if version and key:
+                cache.set(key, version)
+
+        self.version = version
 
         if not self.version:
             self.logger.warning(self.MSG_VERSION_NOT_FOUND)
+        elif info_version:
+            self.logger.info(f'Software version: {self.version}')
+
+        return self.version
+
+    def _probe_version(self):
+        """
+        Runs the software with the VERSION_FLAGS and returns the first non empty standard output.
+
+        Returns:
+            str or None: The software version, or None if it is not found.
+        """
+
+        for version_flag in self.VERSION_FLAGS:
+            try:
+                version = subprocess.run([self.command, version_flag], capture_output=True, text=True)
+            except OSError as error:
+                self.logger.debug(f'Version probe failed: {error}')
+                return None
+            if version.stdout:
+                return version.stdout.strip()
+
+        return None
+
+    def _execute_output(self, cmd, method, output):
+        #Executes a command that writes one output file, traced in last_outputs and used by the incremental mode
+
+        if output:
+            self.trace_output(output, method)
+
+        return self.execute_command(cmd.cmd_list, outputs=[output] if output else None)
+
+    async def _execute_output_async(self, cmd, method, output):
+
+        if output:
+            self.trace_output(output, method)
+
+        return await self.execute_command_async(cmd.cmd_list, outputs=[output] if output else None)
 
     def trace_output(self, output, method):
         """